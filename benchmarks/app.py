@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""Flask application and caching models of the benchmark suite."""
+from flask import Flask
+
+from flask_sqlalchemy_redica import CachingSQLAlchemy, CachingMixin
+
+db = CachingSQLAlchemy()
+
+
+class BenchUser(db.Model, CachingMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    group = db.Column(db.Integer, nullable=False, index=True)
+
+
+def create_app(url=None, connection_pool=None, **config):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['REDICA_CACHE_URL'] = url
+    app.config['REDICA_CACHE_CONNECTION_POOL'] = connection_pool
+    app.config.update(config)
+    db.init_app(app)
+    return app
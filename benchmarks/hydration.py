@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+    Cost of attaching a cached result of 5000 instances to a session
+    with ``merge_result``, the fast path and as detached results::
+
+        python -m benchmarks.hydration
+"""
+from __future__ import print_function
+
+import pickle
+import timeit
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from flask_sqlalchemy_redica.cache import CachingQuery
+
+from .models import Base, BenchItem
+
+ROWS = 5000
+NUMBER = 5
+
+
+def main():
+    make_session = sessionmaker(
+        bind=create_engine('sqlite://'), query_cls=CachingQuery)
+    session = make_session()
+    Base.metadata.create_all(session.bind)
+    session.add_all(BenchItem(name='item%d' % i, price=i)
+                    for i in range(ROWS))
+    session.commit()
+    data = pickle.dumps(session.query(BenchItem).all(),
+                        pickle.HIGHEST_PROTOCOL)
+    session.close()
+
+    modes = (
+        ('detached', lambda q, values: values),
+        ('merge', lambda q, values: list(q.merge_result(values, load=False))),
+        ('fast', lambda q, values: q.fast_merge_result(values)),
+    )
+
+    print('%10s %12s' % ('mode', 'time (ms)'))
+    for name, hydrate in modes:
+        def run():
+            session = make_session()
+            hydrate(session.query(BenchItem), pickle.loads(data))
+            session.close()
+
+        elapsed = timeit.timeit(run, number=NUMBER)
+        print('%10s %12.2f' % (name, elapsed / NUMBER * 1000))
+
+
+if __name__ == '__main__':
+    main()
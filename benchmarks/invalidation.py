@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+    Compare ``KEYS`` based invalidation against tag-set invalidation
+    while the keyspace grows.  Needs a disposable redis database::
+
+        REDICA_BENCH_URL=redis://localhost:6379/15 \\
+            python -m benchmarks.invalidation
+"""
+from __future__ import print_function
+
+import functools
+import os
+import timeit
+
+from dogpile.cache.region import make_region
+
+from flask_sqlalchemy_redica.model import Cache
+from flask_sqlalchemy_redica.utils import _md5_key_mangler, \
+    _tag_key_from_key
+
+KEYSPACE_SIZES = (10000, 100000, 1000000)
+CACHED_PER_OBJECT = 20
+ROUNDS = 50
+
+
+class BenchOrder(object):
+    __tablename__ = 'bench_order'
+
+
+def make_regions(url, mode):
+    return dict(default=make_region().configure(
+        'extended_redis_backend', expiration_time=3600,
+        arguments={
+            'url': url,
+            'redis_expiration_time': 3630,
+            'key_mangler': functools.partial(_md5_key_mangler, 'bench'),
+            'invalidation_mode': mode,
+        }))
+
+
+def fill_keyspace(client, size, batch=10000):
+    ppl = client.pipeline(transaction=False)
+    for i in range(size):
+        ppl.set('bench:filler:%d' % i, '')
+        if i % batch == 0:
+            ppl.execute()
+    ppl.execute()
+
+
+def populate_object(cache, pk):
+    region = cache.regions[cache.label]
+    keys = [cache.cache_relationship_key(pk, 'r%d' % i)
+            for i in range(CACHED_PER_OBJECT // 2)]
+    keys.extend(cache.cache_query_key(pk, 'q%d' % i)
+                for i in range(CACHED_PER_OBJECT // 2))
+    for key in keys:
+        region.set(key, [pk])
+        if region.backend.invalidation_mode != 'keys':
+            region.backend.tag(_tag_key_from_key(key), [key])
+
+
+def bench_mode(url, mode):
+    cache = Cache(BenchOrder, make_regions(url, mode), 'default')
+    counter = iter(range(10 ** 9))
+
+    def run():
+        pk = next(counter)
+        populate_object(cache, pk)
+        start = timeit.default_timer()
+        cache.flush_caches(pk)
+        return timeit.default_timer() - start
+
+    timings = sorted(run() for _ in range(ROUNDS))
+    return timings[len(timings) // 2] * 1000
+
+
+def main():
+    url = os.environ.get('REDICA_BENCH_URL', 'redis://localhost:6379/15')
+    client = make_regions(url, 'keys')['default'].backend.client
+    client.flushdb()
+
+    print('%12s %12s %12s' % ('keyspace', 'keys (ms)', 'tags (ms)'))
+    filled = 0
+    for size in KEYSPACE_SIZES:
+        fill_keyspace(client, size - filled)
+        filled = size
+        print('%12d %12.3f %12.3f' % (
+            size, bench_mode(url, 'keys'), bench_mode(url, 'tags')))
+    client.flushdb()
+
+
+if __name__ == '__main__':
+    main()
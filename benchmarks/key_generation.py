@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+    Micro-benchmark of query cache key generation: compiling every query
+    against reusing the compiled sql of its shape::
+
+        python -m benchmarks.key_generation
+"""
+from __future__ import print_function
+
+import timeit
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from flask_sqlalchemy_redica.utils import _key_from_query
+
+from .models import BenchItem
+
+NUMBER = 2000
+
+
+def compiled_key(query):
+    stmt = query.with_labels().statement
+    compiled = stmt.compile()
+    params = compiled.params
+    return u' '.join(
+        [u'%s' % compiled] + [u'%s' % params[k] for k in sorted(params)])
+
+
+def queries(session):
+    return dict(
+        by_pk=lambda i: session.query(BenchItem).filter(BenchItem.id == i),
+        by_name=lambda i: session.query(BenchItem).filter(
+            BenchItem.name == 'item%d' % i, BenchItem.group_id > i
+        ).order_by(BenchItem.name).limit(10).offset(i),
+        in_list=lambda i: session.query(BenchItem).filter(
+            BenchItem.id.in_([i, i + 1, i + 2])),
+    )
+
+
+def main():
+    session = sessionmaker(bind=create_engine('sqlite://'))()
+
+    print('%10s %16s %16s %8s' % (
+        'query', 'compile (us)', 'shaped (us)', 'speedup'))
+    for name, make_query in sorted(queries(session).items()):
+        query = make_query(7)
+        assert compiled_key(query) == _key_from_query(query, shape_key=name)
+
+        compile_time = timeit.timeit(
+            lambda: compiled_key(query), number=NUMBER)
+        shaped_time = timeit.timeit(
+            lambda: _key_from_query(query, shape_key=name), number=NUMBER)
+        print('%10s %16.1f %16.1f %7.1fx' % (
+            name, compile_time / NUMBER * 1e6, shaped_time / NUMBER * 1e6,
+            compile_time / shaped_time))
+
+
+if __name__ == '__main__':
+    main()
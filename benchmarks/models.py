@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""Plain SQLAlchemy models shared by the benchmarks, kept in their own
+module so that cached instances can be pickled and resolved."""
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+
+Base = declarative_base()
+
+
+class BenchItem(Base):
+    __tablename__ = 'bench_item'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100))
+    description = Column(String(255))
+    price = Column(Integer)
+    group_id = Column(Integer, ForeignKey('bench_item.id'))
+    created = Column(DateTime)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+    Size and latency of cached query results with the pickle and the
+    row serializers::
+
+        python -m benchmarks.serializer
+"""
+from __future__ import print_function
+
+import datetime
+import time
+import timeit
+
+from dogpile.cache.api import CachedValue
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from flask_sqlalchemy_redica.serializer import PickleSerializer, \
+    RowSerializer
+
+from .models import Base, BenchItem
+
+ROWS = 1000
+NUMBER = 20
+
+
+def results(session):
+    return dict(
+        entities=session.query(BenchItem).all(),
+        mixed=session.query(BenchItem, BenchItem.name, BenchItem.price).all(),
+        columns=session.query(BenchItem.id, BenchItem.name).all(),
+    )
+
+
+def main():
+    session = sessionmaker(bind=create_engine('sqlite://'))()
+    Base.metadata.create_all(session.bind)
+    now = datetime.datetime.now()
+    session.add_all(
+        BenchItem(name='item%d' % i, description='description %d' % i * 5,
+                  price=i * 100, created=now)
+        for i in range(ROWS))
+    session.commit()
+
+    serializers = (('pickle', PickleSerializer()),
+                   ('rows', RowSerializer()))
+    print('%10s %8s %12s %12s %12s' % (
+        'result', 'format', 'bytes', 'dumps (ms)', 'loads (ms)'))
+    for name, rows in sorted(results(session).items()):
+        value = CachedValue(rows, dict(ct=time.time(), v=1))
+        for fmt, serializer in serializers:
+            data = serializer.dumps(value)
+            dumps = timeit.timeit(
+                lambda: serializer.dumps(value), number=NUMBER)
+            loads = timeit.timeit(
+                lambda: serializer.loads(data), number=NUMBER)
+            print('%10s %8s %12d %12.2f %12.2f' % (
+                name, fmt, len(data),
+                dumps / NUMBER * 1000, loads / NUMBER * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+    Benchmark suite of the cache hit, miss, invalidation and key generation
+    paths.  Runs offline against SQLite and an in-process redis stand-in
+    (fakeredis), a spawned ``redis-server`` or a given redis url, and
+    writes machine readable results::
+
+        python -m benchmarks --output results.json
+        python -m benchmarks --spawn --compare results.json
+
+    ``--compare`` exits non-zero when a benchmark's median got slower than
+    ``--threshold`` times the previous run.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import socket
+import subprocess
+import sys
+import time
+from timeit import default_timer
+
+import dogpile.cache
+import flask_sqlalchemy
+import sqlalchemy
+
+from flask_sqlalchemy_redica.model import CachingInvalidator
+from flask_sqlalchemy_redica.utils import _key_from_query, _tag_key_from_key
+
+from .app import BenchUser, create_app, db
+
+USERS = 1000
+GROUPS = 10
+CACHED_PER_OBJECT = 20
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    n = len(timings)
+    return dict(
+        n=n,
+        mean_us=sum(timings) / n * 1e6,
+        min_us=timings[0] * 1e6,
+        p50_us=timings[n // 2] * 1e6,
+        p95_us=timings[min(n - 1, int(n * 0.95))] * 1e6,
+    )
+
+
+def timed(func, number, setup=None):
+    timings = []
+    for _ in range(number):
+        if setup is not None:
+            setup()
+        start = default_timer()
+        func()
+        timings.append(default_timer() - start)
+    return summarize(timings)
+
+
+def bench_from_cache(client, number):
+    query = BenchUser.query.filter_by(group=1).options(
+        BenchUser.from_cache())
+
+    def miss():
+        db.session.expunge_all()
+        query.invalidated()
+
+    yield 'from_cache/miss', {}, timed(query.all, number, setup=miss)
+    query.all()
+    yield 'from_cache/hit', {}, timed(
+        query.all, number, setup=db.session.expunge_all)
+
+
+def bench_filter(client, number):
+    def cold():
+        db.session.expunge_all()
+        client.flushdb()
+
+    def run():
+        list(BenchUser.cache.filter(group=1))
+
+    yield 'filter/cold', {}, timed(run, number, setup=cold)
+    run()
+    yield 'filter/warm', {}, timed(run, number, setup=db.session.expunge_all)
+
+
+def cache_related_keys(pk, tagged):
+    cache = BenchUser.cache
+    region = cache.regions[cache.label]
+    keys = [cache.cache_relationship_key(pk, 'r%d' % i)
+            for i in range(CACHED_PER_OBJECT // 2)]
+    keys.extend(cache.cache_query_key(pk, 'q%d' % i)
+                for i in range(CACHED_PER_OBJECT // 2))
+    region.set_multi(dict((key, [pk]) for key in keys))
+    if tagged:
+        for key in keys:
+            region.backend.tag(_tag_key_from_key(key), [key])
+
+
+def bench_flush_all(client, number, keyspace_sizes):
+    backend = BenchUser.cache.regions[BenchUser.cache.label].backend
+    user = BenchUser.query.first()
+    mode = backend.invalidation_mode
+
+    filled = 0
+    try:
+        for size in keyspace_sizes:
+            ppl = client.pipeline(transaction=False)
+            for i in range(filled, size):
+                ppl.set('bench:filler:%d' % i, '')
+            ppl.execute()
+            filled = size
+
+            for bench_mode in ('keys', 'tags'):
+                backend.invalidation_mode = bench_mode
+                tagged = bench_mode == 'tags'
+                stats = timed(
+                    lambda: BenchUser.cache.flush_all(user), number,
+                    setup=lambda: cache_related_keys(user.id, tagged))
+                yield 'flush_all/%s' % bench_mode, dict(keyspace=size), stats
+    finally:
+        backend.invalidation_mode = mode
+        client.delete(*['bench:filler:%d' % i for i in range(filled)])
+
+
+def bench_key_generation(client, number):
+    query = BenchUser.query.filter(
+        BenchUser.group == 1, BenchUser.name != 'x'
+    ).order_by(BenchUser.name).limit(10)
+    number *= 10
+
+    yield 'key_from_query/compile', {}, timed(
+        lambda: _key_from_query(query), number)
+    yield 'key_from_query/shaped', {}, timed(
+        lambda: _key_from_query(query, shape_key='bench'), number)
+
+
+def bench_invalidator_flush(client, number, item_counts):
+    pks = [pk for pk, in BenchUser.query.with_entities(BenchUser.id)]
+
+    for count in item_counts:
+        invalidator = CachingInvalidator()
+
+        def queue():
+            db.session.expunge_all()
+            for pk in pks[:count]:
+                invalidator.invalidate(
+                    module=BenchUser.__module__, model='BenchUser',
+                    target_id=pk, event='update', source='notify')
+
+        yield 'invalidator_flush', dict(items=count), timed(
+            invalidator.flush, max(1, number // 10), setup=queue)
+
+
+def redis_stand_in(args):
+    """Return app config for the redis to benchmark against, a label and
+    a cleanup callable."""
+    if args.url:
+        return dict(url=args.url), args.url, lambda: None
+
+    if args.spawn:
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        proc = subprocess.Popen(
+            ['redis-server', '--port', str(port), '--save', '',
+             '--appendonly', 'no'], stdout=subprocess.PIPE)
+        url = 'redis://127.0.0.1:%d/0' % port
+        for _ in range(50):
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                break
+            except socket.error:
+                time.sleep(0.1)
+        return dict(url=url), 'redis-server', proc.terminate
+
+    import fakeredis
+    import redis
+    pool = redis.ConnectionPool(
+        connection_class=fakeredis.FakeConnection,
+        server=fakeredis.FakeServer())
+    return dict(connection_pool=pool), 'fakeredis', lambda: None
+
+
+def run(args):
+    config, stand_in, cleanup = redis_stand_in(args)
+    app = create_app(**config)
+    results = []
+    try:
+        with app.app_context():
+            db.create_all()
+            db.session.add_all(
+                BenchUser(name='user%d' % i, group=i % GROUPS)
+                for i in range(USERS))
+            db.session.commit()
+
+            client = BenchUser.cache.regions[
+                BenchUser.cache.label].backend.client
+            client.flushdb()
+
+            if args.quick:
+                number, sizes, counts = 20, (1000, 5000), (10, 100)
+            else:
+                number, sizes, counts = 200, (1000, 10000, 50000), \
+                    (10, 100, 500)
+
+            benches = [
+                bench_from_cache(client, number),
+                bench_filter(client, number),
+                bench_flush_all(client, number, sizes),
+                bench_key_generation(client, number),
+                bench_invalidator_flush(client, number, counts),
+            ]
+            for bench in benches:
+                for name, params, stats in bench:
+                    result = dict(name=name, params=params, **stats)
+                    results.append(result)
+                    print('%-40s %12.1f us (p95 %.1f us)' % (
+                        result_key(result), stats['p50_us'],
+                        stats['p95_us']), file=sys.stderr)
+
+            db.session.remove()
+            db.drop_all()
+    finally:
+        cleanup()
+
+    return dict(
+        meta=dict(
+            created=time.time(),
+            python=platform.python_version(),
+            sqlalchemy=sqlalchemy.__version__,
+            flask_sqlalchemy=flask_sqlalchemy.__version__,
+            dogpile_cache=dogpile.cache.__version__,
+            redis=stand_in,
+            quick=args.quick,
+        ),
+        results=results,
+    )
+
+
+def result_key(result):
+    params = ','.join('%s=%s' % kv for kv in sorted(result['params'].items()))
+    return '%s[%s]' % (result['name'], params) if params else result['name']
+
+
+def compare(previous, current, threshold):
+    """Print the change of the medians, return the regressed benchmarks."""
+    before = dict((result_key(r), r) for r in previous['results'])
+    regressions = []
+    for result in current['results']:
+        key = result_key(result)
+        if key not in before:
+            continue
+        ratio = result['p50_us'] / before[key]['p50_us']
+        flag = ''
+        if ratio > threshold:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print('%-40s %8.2fx%s' % (key, ratio, flag), file=sys.stderr)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--output', help='write the json results here')
+    parser.add_argument('--url', help='benchmark against this redis')
+    parser.add_argument('--spawn', action='store_true',
+                        help='spawn a local redis-server')
+    parser.add_argument('--quick', action='store_true',
+                        help='fewer rounds and smaller keyspaces')
+    parser.add_argument('--compare', help='previous json results')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='median slowdown counted as regression')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    data = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data)
+    else:
+        print(data)
+
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(json.load(f), results, args.threshold):
+                sys.exit(1)
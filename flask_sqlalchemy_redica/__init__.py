@@ -9,5 +9,9 @@
 """
 
 from .redis import ExtendRedisBackend
+from .local import LocalCacheProxy
+from .serializer import PickleSerializer, RowSerializer, \
+    CompressingSerializer
+from .stats import stats, MemorySink, SignalSink, context_stats
 from .core import CachingSQLAlchemy
 from .model import CachingMixin, default_caching_invalidate
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_sqlalchemy_redica.aio
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    asyncio companions of the cached lookups, python 3 only::
+
+        users = await User.query.options(User.from_cache()).cached_all()
+        user = await User.cache.aget(pk)
+
+    Redis I/O goes through a ``redis.asyncio`` client per region, created
+    from ``REDICA_CACHE_URL`` on first use, one event loop per process is
+    assumed.  Values are stored in the same format as the dogpile region,
+    so sync and async callers share their entries.  SQL for cache misses
+    still runs synchronously on the current session, and unlike
+    ``get_or_create`` concurrent misses are not serialized by a mutex.
+"""
+import time
+from timeit import default_timer
+
+from dogpile.cache.api import CachedValue, NO_VALUE
+from dogpile.cache.region import value_version
+from redis import asyncio as aioredis
+
+from .cache import CachingQuery
+from .local import _evicted_keys
+from .memo import evict_memo
+from .redis import FLUSH_TAGS_SCRIPT, INDEX_BUILD_SCRIPT, \
+    INDEX_RANGE_SCRIPT, _flush_args, _index_build_args, _slot_groups
+from .serializer import PickleSerializer
+from .stats import stats
+from .utils import _tag_key_from_key
+
+_async_regions = {}
+
+
+class AsyncRegion(object):
+    """asyncio view of a dogpile region created by redica."""
+
+    def __init__(self, region, client):
+        self.region = region
+        self.backend = region.backend
+        self.client = client
+        self.serializer = getattr(self.backend, 'serializer', None) or \
+            PickleSerializer()
+        self._flush_tags = client.register_script(FLUSH_TAGS_SCRIPT)
+        self._index_range = client.register_script(INDEX_RANGE_SCRIPT)
+        self._index_build = client.register_script(INDEX_BUILD_SCRIPT)
+
+    @property
+    def cluster(self):
+        return getattr(self.backend, 'cluster', False)
+
+    @property
+    def invalidation_mode(self):
+        return getattr(self.backend, 'invalidation_mode', 'keys')
+
+    def mangle(self, key):
+        if self.region.key_mangler:
+            return self.region.key_mangler(key)
+        return key
+
+    def _unwrap(self, data, expiration_time=None):
+        if data is None:
+            return NO_VALUE
+        value = self.serializer.loads(data)
+        if not isinstance(value, CachedValue) or \
+                value.metadata.get('v') != value_version:
+            return NO_VALUE
+
+        created = value.metadata['ct']
+        expiration_time = expiration_time or self.region.expiration_time
+        if expiration_time and expiration_time > 0 and \
+                time.time() - created > expiration_time:
+            return NO_VALUE
+        invalidator = getattr(self.region, 'region_invalidator', None)
+        if invalidator is not None and invalidator.is_invalidated(created):
+            return NO_VALUE
+        return value.payload
+
+    def _dumps(self, payload):
+        return self.serializer.dumps(CachedValue(
+            payload, dict(ct=time.time(), v=value_version)))
+
+    async def get(self, key, expiration_time=None):
+        data = await self.client.get(self.mangle(key))
+        return self._unwrap(data, expiration_time)
+
+    async def get_multi(self, keys, expiration_time=None):
+        if not keys:
+            return []
+        keys = [self.mangle(k) for k in keys]
+        if self.cluster:
+            values = await self.client.mget_nonatomic(keys)
+        else:
+            values = await self.client.mget(keys)
+        return [self._unwrap(v, expiration_time) for v in values]
+
+    async def set(self, key, value):
+        await self.set_multi({key: value})
+
+    async def set_multi(self, mapping, expire=None):
+        expire = expire or \
+            getattr(self.backend, 'redis_expiration_time', None) or None
+        keys = []
+        async with self.client.pipeline(transaction=False) as ppl:
+            for key, value in mapping.items():
+                keys.append(self.mangle(key))
+                ppl.set(keys[-1], self._dumps(value), ex=expire)
+            await ppl.execute()
+        # like the sync local tier, sets are not broadcast
+        await self._evict(keys, publish=False)
+
+    async def tag(self, tag, keys):
+        keys = [self.mangle(k) for k in keys]
+        expire = getattr(self.backend, 'redis_expiration_time', None)
+        async with self.client.pipeline(transaction=False) as ppl:
+            ppl.sadd(self.mangle(tag), *keys)
+            if expire:
+                ppl.expire(self.mangle(tag), expire)
+            await ppl.execute()
+
+    async def delete_multi(self, keys, raw=False):
+        if not raw:
+            keys = [self.mangle(k) for k in keys]
+        if keys:
+            await self.client.delete(*keys)
+            await self._evict(keys)
+
+    async def keys_multi(self, patterns):
+        """Resolve key patterns with ``KEYS`` in one pipeline."""
+        async with self.client.pipeline(transaction=False) as ppl:
+            for p in patterns:
+                ppl.keys(self.mangle(p))
+            results = await ppl.execute()
+        return [k for rs in results if rs for k in rs]
+
+    async def scan_keys(self, pattern, count=1000):
+        return [k async for k in self.client.scan_iter(
+            match=self.mangle(pattern), count=count)]
+
+    async def invalidate_tags(self, tags, keys=()):
+        """Same as ``ExtendRedisBackend.invalidate_tags`` for mangled keys."""
+        tags, keys = list(tags), list(keys)
+        if not tags and not keys:
+            return []
+        tagged = {}
+        if self.cluster:
+            # like the sync backend, tag members are read ahead and
+            # flushed as plain keys of their slots
+            if tags:
+                async with self.client.pipeline(transaction=False) as ppl:
+                    for tag in tags:
+                        ppl.smembers(tag)
+                    tagged = dict(zip(tags, await ppl.execute()))
+            members = [m for tag in tags for m in tagged[tag]]
+            groups = _slot_groups([], keys + members)
+        else:
+            groups = [(tags, keys, [])]
+        deleted = []
+        for group in groups:
+            script_keys, args = _flush_args(*group)
+            deleted.extend(await self._flush_tags(keys=script_keys, args=args))
+        if any(tagged.values()):
+            async with self.client.pipeline(transaction=False) as ppl:
+                for tag, members in tagged.items():
+                    if members:
+                        ppl.srem(tag, *members)
+                await ppl.execute()
+        await self._evict(_evicted_keys(keys, deleted))
+        return deleted
+
+    async def index_range(self, key, offset=None, limit=None, desc=False):
+        """Same as ``ExtendRedisBackend.index_range``."""
+        return await self._index_range(keys=[self.mangle(key)], args=[
+            'desc' if desc else 'asc', offset or 0,
+            -1 if limit is None else limit])
+
+    async def index_build(self, key, members, expire=None):
+        await self._index_build(
+            keys=[self.mangle(key)], args=_index_build_args(members, expire))
+
+    async def _evict(self, keys, publish=True):
+        evict_memo(keys)
+        local = self.backend
+        if not keys or not hasattr(local, 'evict'):
+            return
+        local.evict(keys, publish=False)
+        if publish:
+            await self.client.publish(
+                local.channel, local.eviction_message(keys))
+
+
+def register_async_client(region, client):
+    """Use ``client`` for the asyncio calls on ``region``, e.g. to share a
+    connection pool or to use a redis stand-in in tests."""
+    _async_regions[region] = AsyncRegion(region, client)
+    return _async_regions[region]
+
+
+def async_region(region):
+    try:
+        return _async_regions[region]
+    except KeyError:
+        if getattr(region.backend, 'cluster', False):
+            return register_async_client(
+                region, aioredis.RedisCluster.from_url(
+                    region.backend.cache_url))
+        pool = aioredis.BlockingConnectionPool.from_url(
+            region.backend.cache_url)
+        return register_async_client(
+            region, aioredis.Redis(connection_pool=pool))
+
+
+async def cached_all(query):
+    dogpile_region, cache_key = query._get_cache_plus_key()
+    aregion = async_region(dogpile_region)
+
+    value = await aregion.get(
+        cache_key, query._cache_region.expiration_time)
+    created = []
+    if value is NO_VALUE:
+        start = default_timer()
+        value = list(super(CachingQuery, query).__iter__())
+        if value:
+            await aregion.set(cache_key, value)
+        else:
+            await aregion.set_multi(
+                {cache_key: value},
+                query._negative_expiration_time(aregion.backend))
+        tag = _tag_key_from_key(cache_key)
+        if tag and aregion.invalidation_mode != 'keys':
+            await aregion.tag(tag, [cache_key])
+        created.append(default_timer() - start)
+    if stats.enabled:
+        query._record_lookup(value, created)
+
+    return list(query._hydrate(dogpile_region, value))
+
+
+async def get(cache, pk):
+    return (await get_many(cache, [pk]))[0]
+
+
+async def get_many(cache, pks, as_dict=False):
+    pks, keys, unique = cache._unique_keys(pks)
+
+    objs = {}
+    if unique:
+        aregion = async_region(cache.regions[cache.label])
+        values = await aregion.get_multi([key for _, key in unique])
+        objs, missing = cache._merge_cached(unique, values)
+        if missing:
+            start = default_timer()
+            loaded = cache._query_many(missing)
+            if loaded:
+                await aregion.set_multi(
+                    dict((key, [obj]) for key, obj in loaded.items()))
+            negative_expiration_time = cache._negative_expiration_time(
+                aregion.backend)
+            unknown = [key for key in map(cache.cache_key, missing)
+                       if key not in loaded]
+            if negative_expiration_time and unknown:
+                await aregion.set_multi(
+                    dict((key, []) for key in unknown),
+                    negative_expiration_time)
+            objs.update(loaded)
+            if stats.enabled:
+                cache._record_lookups(
+                    0, len(missing), default_timer() - start)
+        if stats.enabled:
+            cache._record_lookups(len(unique) - len(missing), 0)
+
+    return cache._many_result(pks, keys, objs, as_dict)
+
+
+async def filter(cache, **kwargs):
+    limit, offset, order_by, query_kwargs = cache._filter_args(kwargs)
+    if cache.pk in query_kwargs:
+        return [await get(cache, query_kwargs[cache.pk])]
+
+    aregion = async_region(cache.regions[cache.label])
+    index_key = cache.cache_index_key(**query_kwargs)
+
+    members = await aregion.index_range(
+        index_key, offset, limit, desc=order_by == 'desc')
+    if members is None:
+        start = default_timer()
+        pks = cache._query_index(query_kwargs)
+        await aregion.index_build(
+            index_key, [cache._index_member(pk) for pk in pks],
+            cache._built_index_expiration_time(aregion.backend, pks))
+        pks = cache._page(pks, order_by, offset, limit)
+        if stats.enabled:
+            cache._record_lookups(0, 1, default_timer() - start)
+    else:
+        pks = [cache._pk_from_member(m) for m in members]
+        if stats.enabled:
+            cache._record_lookups(1, 0)
+
+    return [obj for obj in await get_many(cache, pks) if obj is not None]
+
+
+async def flush_caches(cache, obj_pk):
+    aregion = async_region(cache.regions[cache.label])
+    patterns = cache._pattern_keys(obj_pk)
+
+    if aregion.invalidation_mode == 'keys':
+        await aregion.delete_multi(
+            await aregion.keys_multi(patterns), raw=True)
+        return
+
+    tags, keys = cache._split_patterns(aregion.backend, patterns)
+    if aregion.invalidation_mode == 'migrate':
+        for p in patterns:
+            if p.endswith('*'):
+                keys.extend(await aregion.scan_keys(p))
+    await aregion.invalidate_tags(tags, keys)
+
+
+async def flush_all(cache, obj):
+    aregion = async_region(cache.regions[cache.label])
+    await aregion.delete_multi(cache._flush_filter_keys(obj))
+
+    obj_pk = getattr(obj, cache.pk)
+    if obj_pk:
+        await flush_caches(cache, obj_pk)
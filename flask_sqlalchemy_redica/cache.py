@@ -1,11 +1,51 @@
 # -*- coding: utf-8 -*-
 import functools
+import math
+import random
+import threading
+from collections import OrderedDict
+from timeit import default_timer
 
 from flask_sqlalchemy import BaseQuery
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import instance_state, set_committed_value
 from sqlalchemy.orm.interfaces import MapperOption
+from sqlalchemy.sql.expression import BinaryExpression
 from dogpile.cache.api import NO_VALUE
 
-from .utils import _prefixed_key_from_query, _key_from_query
+from .memo import evict_memo, request_memo
+from .refresh import refresh_session
+from .stats import stats
+from .utils import _prefixed_key_from_query, _key_from_query, \
+    _tag_key_from_key
+
+_MAX_CREATION_TIMES = 2000
+
+#: recent creation times of cached query results by cache key, for the
+#: early recomputes, measured in this process only
+_creation_times = OrderedDict()
+_creation_times_lock = threading.Lock()
+
+
+def _record_creation_time(cache_key, seconds):
+    with _creation_times_lock:
+        _creation_times.pop(cache_key, None)
+        _creation_times[cache_key] = seconds
+        if len(_creation_times) > _MAX_CREATION_TIMES:
+            _creation_times.popitem(last=False)
+
+
+def _xfetch_expiration(expiration_time, delta, beta, rand=random.random):
+    """Expiration time shortened at random as in XFetch (Vattani et al.),
+    the longer a value takes to create the likelier it is recomputed
+    before it expires."""
+    return expiration_time + delta * beta * math.log(1.0 - rand())
+
+
+#: ``merge``: merge cached results into the session with ``merge_result``
+#: ``fast``: add cached instances unknown to the session as they are
+#: ``detached``: return cached results untouched, for read only use
+HYDRATE_MODES = ('merge', 'fast', 'detached')
 
 
 class CachingQuery(BaseQuery):
@@ -16,10 +56,21 @@ class CachingQuery(BaseQuery):
         super(CachingQuery, self).__init__(*args, **kwargs)
 
     def __iter__(self):
+        options = getattr(self, '_batch_relationships', None)
+        if not options:
+            return self._iter_cached()
+
+        result = list(self._iter_cached())
+        for option in options:
+            load_relationships(result, option.attribute, option.region)
+        return iter(result)
+
+    def _iter_cached(self):
         if hasattr(self, '_cache_region'):
             expiration_time = self._cache_region.expiration_time
             return self.get_value(
-                createfunc=lambda: list(super(CachingQuery, self).__iter__()),
+                createfunc=lambda: list(
+                    super(CachingQuery, self._refreshing()).__iter__()),
                 expiration_time=expiration_time
             )
         else:
@@ -29,17 +80,36 @@ class CachingQuery(BaseQuery):
     def regions(self):
         return self.cache_regions or self.default_regions
 
+    def _refreshing(self):
+        """The query on the session of a background refresh when it runs
+        in one, the request's session is not ours to use."""
+        session = refresh_session()
+        if session is not None:
+            return self.with_session(session)
+        return self
+
     def _get_cache_plus_key(self):
         dogpile_region = self.regions[self._cache_region.region]
         if self._cache_region.cache_key:
             key = self._cache_region.cache_key
-        elif self._cache_region.query_prefix:
-            key = _prefixed_key_from_query(
-                self, self._cache_region.query_prefix)
         else:
-            key = _key_from_query(self)
+            shape_key = getattr(self._cache_region, 'shape_key', None)
+            if self._cache_region.query_prefix:
+                key = _prefixed_key_from_query(
+                    self, self._cache_region.query_prefix, shape_key)
+            else:
+                key = _key_from_query(self, shape_key)
         return dogpile_region, key
 
+    @staticmethod
+    def _tag_cache_key(dogpile_region, cache_key):
+        backend = dogpile_region.backend
+        if getattr(backend, 'invalidation_mode', 'keys') == 'keys':
+            return
+        tag = _tag_key_from_key(cache_key)
+        if tag:
+            backend.tag(tag, [cache_key])
+
     def invalidated(self):
         dogpile_region, cache_key = self._get_cache_plus_key()
         dogpile_region.delete(cache_key)
@@ -51,24 +121,163 @@ class CachingQuery(BaseQuery):
         assert not ignore_expiration or not createfunc, \
             "Can't ignore expiration and also provide createfunc"
 
+        memo = request_memo() if merge else None
+        if memo is not None:
+            memo_key = self._memo_key(dogpile_region, cache_key)
+            cached_value = memo.get(memo_key, self.session)
+            if cached_value is not NO_VALUE:
+                if stats.enabled:
+                    stats.incr('memo_hits', **self._stats_labels())
+                return iter(cached_value)
+
+        created = []
         if ignore_expiration or not createfunc:
             cached_value = dogpile_region.get(
                 cache_key, expiration_time=expiration_time,
                 ignore_expiration=ignore_expiration)
         else:
+            def creator():
+                start = default_timer()
+                value = createfunc()
+                self._tag_cache_key(dogpile_region, cache_key)
+                created.append(default_timer() - start)
+                _record_creation_time(cache_key, created[0])
+                return value
+
+            expiration_time = self._early_expiration(
+                dogpile_region, cache_key, expiration_time)
             cached_value = dogpile_region.get_or_create(
-                cache_key, createfunc, expiration_time=expiration_time)
+                cache_key, creator, expiration_time=expiration_time)
 
+        if stats.enabled:
+            self._record_lookup(cached_value, created)
         if cached_value is NO_VALUE:
             raise KeyError(cache_key)
+        if created and not cached_value:
+            self._expire_negative(dogpile_region, cache_key)
         if merge:
-            cached_value = self.merge_result(cached_value, load=False)
+            cached_value = self._hydrate(dogpile_region, cached_value)
+        if memo is not None:
+            cached_value = list(cached_value)
+            memo.set(memo_key, self.session, cached_value)
+            cached_value = iter(cached_value)
 
         return cached_value
 
+    @staticmethod
+    def _memo_key(dogpile_region, cache_key):
+        if dogpile_region.key_mangler:
+            return dogpile_region.key_mangler(cache_key)
+        return cache_key
+
+    def _early_expiration(self, dogpile_region, cache_key, expiration_time):
+        beta = getattr(self._cache_region, 'xfetch_beta', None)
+        if beta is None:
+            beta = getattr(dogpile_region.backend, 'xfetch_beta', 0)
+        delta = _creation_times.get(cache_key) if beta else None
+        if not delta:
+            return expiration_time
+
+        expiration_time = expiration_time or dogpile_region.expiration_time
+        if expiration_time is None or expiration_time <= 0:
+            return expiration_time
+        return max(0, _xfetch_expiration(expiration_time, delta, beta))
+
+    def _expire_negative(self, dogpile_region, cache_key):
+        """Keep an empty result for the negative expiration time only."""
+        seconds = self._negative_expiration_time(dogpile_region.backend)
+        if seconds:
+            dogpile_region.backend.expire([cache_key], seconds)
+
+    def _negative_expiration_time(self, backend):
+        seconds = getattr(self._cache_region, 'negative_expiration_time', None)
+        if seconds is None:
+            seconds = getattr(backend, 'negative_expiration_time', None)
+        return seconds
+
+    def _stats_labels(self):
+        model = getattr(self._mapper_zero(), 'class_', None)
+        return dict(region=self._cache_region.region,
+                    model=getattr(model, '__name__', ''))
+
+    def _record_lookup(self, cached_value, created):
+        labels = self._stats_labels()
+        if created:
+            stats.incr('cache_misses', **labels)
+            stats.timing('cache_creation_seconds', created[0], **labels)
+        elif cached_value is NO_VALUE:
+            stats.incr('cache_misses', **labels)
+        else:
+            stats.incr('cache_hits', **labels)
+
+    def _hydrate(self, dogpile_region, cached_value):
+        hydrate = getattr(self._cache_region, 'hydrate', 'merge')
+        shared = getattr(dogpile_region.backend, 'shares_values', False)
+        if hydrate == 'fast' and not shared:
+            return iter(self.fast_merge_result(cached_value))
+        elif hydrate != 'detached':
+            return self.merge_result(cached_value, load=False)
+        return iter(cached_value)
+
+    def cached_all(self):
+        """awaitable ``all()`` of a query with a :class:`FromCache`
+        option, see :mod:`flask_sqlalchemy_redica.aio`"""
+        from .aio import cached_all
+        return cached_all(self)
+
+    def fast_merge_result(self, iterator):
+        """Like ``merge_result(iterator, load=False)``, but cached instances
+        the session doesn't hold yet are added to it as they are instead of
+        being copied attribute by attribute.  Instances conflicting with one
+        in the session and results other than plain entities are merged.
+        """
+        values = list(iterator)
+        try:
+            states = [instance_state(v) for v in values]
+        except AttributeError:
+            return self.merge_result(values, load=False)
+
+        session = self.session
+        identity_map = session.identity_map
+        result = []
+        for value, state in zip(values, states):
+            existing = identity_map.get(state.key)
+            if existing is value:
+                result.append(value)
+            elif existing is None and state.session_id is None:
+                relationships = state.mapper.relationships
+                if not any(r.key in state.dict for r in relationships):
+                    session._update_impl(state)
+                elif self._cascade_conflicts(state):
+                    value = session.merge(value, load=False)
+                else:
+                    # cascade to the related objects loaded with it
+                    session.add(value)
+                result.append(value)
+            else:
+                result.append(session.merge(value, load=False))
+        return result
+
+    def _cascade_conflicts(self, state):
+        """Whether adding ``state`` would cascade to a related instance
+        that is attached elsewhere or whose identity the session holds."""
+        identity_map = self.session.identity_map
+        for obj, _, related, _ in state.mapper.cascade_iterator(
+                'save-update', state):
+            if related.session_id is not None and \
+                    related.session_id != self.session.hash_key:
+                return True
+            existing = identity_map.get(related.key) \
+                if related.key is not None else None
+            if existing is not None and existing is not obj:
+                return True
+        return False
+
     def set_value(self, value):
         dogpile_region, cache_key = self._get_cache_plus_key()
         dogpile_region.set(cache_key, value)
+        evict_memo([self._memo_key(dogpile_region, cache_key)])
+        self._tag_cache_key(dogpile_region, cache_key)
 
 
 def query_callable(regions, query_cls=CachingQuery):
@@ -80,12 +289,38 @@ class FromCache(MapperOption):
     propagate_to_loaders = False
 
     def __init__(self, region='default', cache_key=None, query_prefix=None,
-                 cache_regions=None, expiration_time=None):
+                 cache_regions=None, expiration_time=None, shape_key=None,
+                 hydrate='merge', xfetch_beta=None,
+                 negative_expiration_time=None):
+        """:param shape_key: optional.  A hashable identifying the
+        structure of the query, like the key of a baked query.  The
+        compiled sql is then reused between calls and only the bound
+        values are serialized into the cache key.  Queries with the same
+        ``shape_key`` must only differ in their bound values.
+
+        :param hydrate: how cached results are attached to the session,
+        one of :data:`HYDRATE_MODES`.  ``detached`` results must be
+        treated as read only and can't lazy load.
+
+        :param xfetch_beta: optional.  Overrides ``REDICA_XFETCH_BETA``,
+        how eagerly results are recomputed before they expire, ``0``
+        never, ``1`` is a good start.
+
+        :param negative_expiration_time: optional.  Overrides
+        ``REDICA_NEGATIVE_CACHE_TTL``, seconds an empty result is cached.
+        """
+        if hydrate not in HYDRATE_MODES:
+            raise ValueError(
+                'hydrate must be one of %s' % ', '.join(HYDRATE_MODES))
         self.region = region
         self.cache_key = cache_key
         self.query_prefix = query_prefix
         self.cache_regions = cache_regions
         self.expiration_time = expiration_time
+        self.shape_key = shape_key
+        self.hydrate = hydrate
+        self.xfetch_beta = xfetch_beta
+        self.negative_expiration_time = negative_expiration_time
 
     def process_query(self, query):
         query._cache_region = self
@@ -146,3 +381,147 @@ class RelationshipCache(MapperOption):
         """
         self._relationship_options.update(option._relationship_options)
         return self
+
+
+class RelationshipBatchCache(MapperOption):
+    """Loads a relationship of all the instances a query returns at once,
+    like ``selectinload`` but through the cache, see
+    :func:`load_relationships`::
+
+        orders = Order.query.options(
+            RelationshipBatchCache(Order.items)).all()
+    """
+
+    propagate_to_loaders = False
+
+    def __init__(self, attribute, region='default'):
+        self.attribute = attribute
+        self.region = region
+
+    def process_query(self, query):
+        query._batch_relationships = \
+            getattr(query, '_batch_relationships', ()) + (self,)
+
+
+def load_relationships(parents, attribute, region='default'):
+    """Populate the relationship ``attribute`` of the ``parents`` that
+    didn't load it yet from their ``cache_relationship_key`` entries, with
+    a single MGET.  The misses are loaded with one IN query and cached
+    with one ``set_multi``.  Relationships that don't join on a single
+    column pair are lazy loaded one parent at a time instead.
+
+    Only the pks of the related objects are not enough to invalidate
+    these entries, the parents must be notified of changes to them as
+    with any cached relationship.
+    """
+    prop = attribute.property
+    if prop.lazy == 'dynamic':
+        raise ValueError('%s is a dynamic relationship' % attribute)
+    parent_cls = prop.parent.class_
+    cache = parent_cls.cache
+
+    pending, seen = [], set()
+    for parent in parents:
+        if isinstance(parent, parent_cls) and id(parent) not in seen and \
+                prop.key not in instance_state(parent).dict:
+            seen.add(id(parent))
+            pending.append(parent)
+    if not pending:
+        return
+
+    session = object_session(pending[0])
+    dogpile_region = cache.regions[region]
+    keys = [cache.cache_relationship_key(getattr(p, cache.pk), prop.key)
+            for p in pending]
+    values = dogpile_region.get_multi(keys)
+
+    hits, missing = [], []
+    for parent, key, value in zip(pending, keys, values):
+        if value is NO_VALUE:
+            missing.append((parent, key))
+        else:
+            hits.append((parent, value))
+
+    if hits:
+        merged = iter(session.query(prop.mapper).merge_result(
+            [obj for _, value in hits for obj in value], load=False))
+        for parent, value in hits:
+            _set_related(parent, prop, [next(merged) for _ in value])
+
+    if missing:
+        start = default_timer()
+        loaded = _load_related(session, prop, [p for p, _ in missing])
+        mapping = {}
+        for parent, key in missing:
+            value = loaded.get(id(parent), [])
+            _set_related(parent, prop, value)
+            mapping[key] = value
+        dogpile_region.set_multi(mapping)
+
+        backend = dogpile_region.backend
+        if getattr(backend, 'invalidation_mode', 'keys') != 'keys':
+            tags = {}
+            for key in mapping:
+                tags.setdefault(_tag_key_from_key(key), []).append(key)
+            backend.tag_multi(tags)
+        if stats.enabled:
+            cache._record_lookups(0, len(missing), default_timer() - start)
+
+    if stats.enabled and hits:
+        cache._record_lookups(len(hits), 0)
+
+
+def _set_related(parent, prop, objs):
+    if prop.uselist:
+        set_committed_value(parent, prop.key, objs)
+    else:
+        set_committed_value(parent, prop.key, objs[0] if objs else None)
+
+
+def _load_related(session, prop, parents):
+    """Related objects by ``id`` of their parent, as lists."""
+    if prop.secondary is None:
+        pairs = prop.local_remote_pairs
+        simple = isinstance(prop.primaryjoin, BinaryExpression)
+    else:
+        pairs = prop.synchronize_pairs
+        simple = len(prop.secondary_synchronize_pairs) == 1
+    if len(pairs) != 1 or not simple:
+        return dict((id(p), _lazy_related(p, prop)) for p in parents)
+
+    (local, remote), = pairs
+    local_key = prop.parent.get_property_by_column(local).key
+    by_value = {}
+    for parent in parents:
+        by_value.setdefault(getattr(parent, local_key), []).append(parent)
+    values = [v for v in by_value if v is not None]
+    if not values:
+        return {}
+
+    if prop.secondary is None:
+        query = session.query(prop.mapper)
+    else:
+        query = session.query(prop.mapper, remote).join(
+            prop.secondary, prop.secondaryjoin)
+    query = query.filter(remote.in_(values))
+    if prop.order_by:
+        query = query.order_by(*prop.order_by)
+
+    if prop.secondary is None:
+        remote_key = prop.mapper.get_property_by_column(remote).key
+        rows = ((obj, getattr(obj, remote_key)) for obj in query)
+    else:
+        rows = query
+
+    related = {}
+    for obj, value in rows:
+        for parent in by_value.get(value, ()):
+            related.setdefault(id(parent), []).append(obj)
+    return related
+
+
+def _lazy_related(parent, prop):
+    value = getattr(parent, prop.key)
+    if prop.uselist:
+        return list(value)
+    return [value] if value is not None else []
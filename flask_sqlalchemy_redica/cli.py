@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_sqlalchemy_redica.cli
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    ``flask redica warm`` fills the cache ahead of traffic, e.g. after a
+    deploy or a redis failover::
+
+        flask redica warm User Order --pks 1:50000 --filter status
+        flask redica warm --query top_products
+
+    Objects are cached under their ``cache_key(pk)``, ``--filter`` builds
+    the ``Cache.filter`` indices of a column, or of the comma separated
+    columns of a compound index.  Rows are streamed with ``yield_per`` and
+    written with one pipeline per batch.
+
+    ``REDICA_WARM_BATCH_SIZE``
+        rows per batch, default 500
+    ``REDICA_WARM_RATE``
+        rows per second the command is throttled to, default 0 for no
+        limit
+
+    Queries for ``--query`` are registered with
+    :meth:`CachingSQLAlchemy.warm_query`.
+"""
+from __future__ import absolute_import
+
+import time
+from timeit import default_timer
+
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+
+from .utils import current_redica
+
+redica_cli = AppGroup('redica', help='Manage the redica cache.')
+
+
+def _find_model(redica, name):
+    registry = getattr(redica.Model, '_decl_class_registry', None)
+    if registry is None:
+        # sqlalchemy 1.4+
+        registry = redica.Model.registry._class_registry
+    model = registry.get(name)
+    if not isinstance(model, type) or getattr(model, 'cache', None) is None:
+        raise click.BadParameter('%s is not a cached model' % name)
+    return model
+
+
+def _pk_range(value):
+    if not value:
+        return None, None
+    try:
+        start, end = value.split(':')
+        return int(start) if start else None, int(end) if end else None
+    except ValueError:
+        raise click.BadParameter('--pks takes a START:END range')
+
+
+class CacheWarmer(object):
+    """Writes objects, filter indices and query results to the cache in
+    batches of ``batch_size`` rows, at most ``rate`` rows per second."""
+
+    def __init__(self, redica, batch_size=500, rate=0, echo=None):
+        self.redica = redica
+        self.batch_size = batch_size
+        self.rate = rate
+        self.echo = echo or (lambda message: None)
+        #: rows written so far
+        self.rows = 0
+        self._start = default_timer()
+
+    @property
+    def throughput(self):
+        elapsed = default_timer() - self._start
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def _written(self, rows, what, total):
+        self.rows += rows
+        self.echo('%s: %d rows, %.0f rows/s' % (what, total, self.throughput))
+        if self.rate:
+            ahead = self.rows / float(self.rate) - \
+                (default_timer() - self._start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def warm_objects(self, model, start=None, end=None):
+        """Cache the objects of ``model`` with pks from ``start`` to ``end``,
+        all of them also fill the index of ``cache.filter()``."""
+        cache = model.cache
+        region = cache.regions[cache.label]
+        pk_column = getattr(model, cache.pk)
+        query = model.query.order_by(pk_column)
+        if start is not None:
+            query = query.filter(pk_column >= start)
+        if end is not None:
+            query = query.filter(pk_column <= end)
+
+        session = self.redica.session
+        pks = [] if start is None and end is None else None
+        batch, total = {}, 0
+        for obj in query.yield_per(self.batch_size):
+            pk = getattr(obj, cache.pk)
+            batch[cache.cache_key(pk)] = [obj]
+            if pks is not None:
+                pks.append(cache._index_member(pk))
+            if len(batch) >= self.batch_size:
+                region.set_multi(batch)
+                session.expunge_all()
+                total += len(batch)
+                self._written(len(batch), model.__name__, total)
+                batch = {}
+        if batch:
+            region.set_multi(batch)
+            session.expunge_all()
+            total += len(batch)
+            self._written(len(batch), model.__name__, total)
+        if pks is not None:
+            region.backend.index_build(
+                cache.cache_index_key(), pks, cache._index_expiration_time)
+        return total
+
+    def warm_index(self, model, columns):
+        """Build the filter indices of a column, or of the columns of a
+        compound index, for all of their values."""
+        cache = model.cache
+        columns = tuple(columns)
+        if len(columns) > 1:
+            if cache._compound_index(dict.fromkeys(columns)) is None:
+                raise click.BadParameter(
+                    '%s has no cache index on %s' %
+                    (model.__name__, ', '.join(columns)))
+        elif columns[0] not in cache._columns:
+            raise click.BadParameter(
+                '%s has no cache index on %s' % (model.__name__, columns[0]))
+
+        backend = cache.regions[cache.label].backend
+        expire = cache._index_expiration_time
+        entities = [getattr(model, c) for c in columns] + \
+            [getattr(model, cache.pk)]
+        query = model.query.with_entities(*entities).order_by(*entities)
+
+        what = '%s(%s)' % (model.__name__, ','.join(columns))
+        pending, buffered, total = {}, 0, 0
+        current, members = None, None
+        for row in query.yield_per(self.batch_size):
+            values = tuple(row[:-1])
+            if values != current:
+                if buffered >= self.batch_size:
+                    backend.index_build_multi(pending, expire)
+                    total += buffered
+                    self._written(buffered, what, total)
+                    pending, buffered = {}, 0
+                current, members = values, []
+                pending[cache.cache_index_key(
+                    **dict(zip(columns, values)))] = members
+            members.append(cache._index_member(row[-1]))
+            buffered += 1
+        if pending:
+            backend.index_build_multi(pending, expire)
+            total += buffered
+            self._written(buffered, what, total)
+        return total
+
+    def warm_query(self, name):
+        """Run a query registered with ``warm_query``."""
+        try:
+            factory = self.redica.warm_queries[name]
+        except KeyError:
+            raise click.BadParameter('no warm query named %s' % name)
+        rows = len(factory().all())
+        self._written(rows, name, rows)
+        return rows
+
+
+@redica_cli.command('warm')
+@click.argument('models', nargs=-1)
+@click.option('--pks', help='START:END range of pks to cache, inclusive.')
+@click.option('--filter', 'filters', multiple=True,
+              help='Column, or comma separated columns of a compound '
+                   'index, to build the filter indices of.')
+@click.option('--query', 'queries', multiple=True,
+              help='Name of a query registered with warm_query.')
+@click.option('--batch-size', type=int, help='Rows per pipeline.')
+@click.option('--rate', type=float, help='Rows per second at most.')
+@with_appcontext
+def warm(models, pks, filters, queries, batch_size, rate):
+    """Fill the cache with the objects of MODELS."""
+    redica = current_redica._get_current_object()
+    config = current_app.config
+    warmer = CacheWarmer(
+        redica,
+        batch_size=batch_size or config.get('REDICA_WARM_BATCH_SIZE', 500),
+        rate=rate if rate is not None else config.get('REDICA_WARM_RATE', 0),
+        echo=click.echo)
+
+    start, end = _pk_range(pks)
+    for name in models:
+        model = _find_model(redica, name)
+        warmer.warm_objects(model, start, end)
+        for columns in filters:
+            warmer.warm_index(model, columns.split(','))
+    for name in queries:
+        warmer.warm_query(name)
+
+    click.echo('warmed %d rows at %.0f rows/s' %
+               (warmer.rows, warmer.throughput))
@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import warnings
+from timeit import default_timer
+
 from sqlalchemy import event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session
@@ -11,12 +14,18 @@ except ImportError:
 from flask_sqlalchemy import SQLAlchemy, _QueryProperty, Model
 
 from .cache import CachingQuery
+from .cli import redica_cli
 from .redis import make_redis_region
+from .replica import pin_primary
 from .model import CachingInvalidator, CachingMeta, CeleryCachingInvalidator, \
-    Cache
+    Cache, InvalidationBatch
+from .stats import stats, AppContextSink, MemorySink
+from .worker import ThreadedCachingInvalidator
 
 DEFAULT_REDICA_KEY_PREFIX = 'redica'
 
+_app_context_sink = AppContextSink()
+
 
 class CachingSQLAlchemy(SQLAlchemy):
     def __init__(self, app=None, **kwargs):
@@ -28,6 +37,9 @@ class CachingSQLAlchemy(SQLAlchemy):
             'invalidator_class', None)
         self.cache_invalidator_callback = kwargs.pop(
             'invalidator_callback', None)
+        self.stats_sink = None
+        #: query factories by name, for ``flask redica warm --query``
+        self.warm_queries = {}
 
         if 'query_class' in kwargs:
             self.query_cls = kwargs.setdefault('query_class', CachingQuery)
@@ -40,12 +52,18 @@ class CachingSQLAlchemy(SQLAlchemy):
         super(CachingSQLAlchemy, self).__init__(app, **kwargs)
 
     def init_app(self, app):
+        if not app.config.setdefault('REDICA_BATCH_INVALIDATION', True):
+            self.check_write_through()
         self.init_regions(app)
         self.init_events()
+        self.init_stats(app)
 
         if not hasattr(app, 'extensions'):
             app.extensions = {}
         app.extensions['sqlalchemy_redica'] = self
+        if hasattr(app, 'cli'):
+            app.cli.add_command(redica_cli)
+        app.teardown_appcontext(self.teardown_memo)
 
         super(CachingSQLAlchemy, self).init_app(app)
 
@@ -55,6 +73,8 @@ class CachingSQLAlchemy(SQLAlchemy):
                 redica_invalidator_type = app.config.get('REDICA_INVALIDATOR_TYPE')
                 if redica_invalidator_type == 'celery':
                     self.cache_invalidator_class = CeleryCachingInvalidator
+                elif redica_invalidator_type == 'thread':
+                    self.cache_invalidator_class = ThreadedCachingInvalidator
                 else:
                     self.cache_invalidator_class = CachingInvalidator
 
@@ -63,6 +83,50 @@ class CachingSQLAlchemy(SQLAlchemy):
             Cache.default_regions = self.regions
             CachingQuery.default_regions = self.regions
 
+    def check_write_through(self):
+        """Warn about ``cache_write_through`` models, objects are only
+        written through by the invalidation batch of a commit."""
+        models = list(self.Model.__subclasses__())
+        while models:
+            model = models.pop()
+            models.extend(model.__subclasses__())
+            if getattr(model, 'cache_write_through', False):
+                warnings.warn(
+                    '%s.cache_write_through needs REDICA_BATCH_INVALIDATION, '
+                    'its cached objects are deleted instead' %
+                    model.__name__)
+
+    def init_stats(self, app):
+        """Collect metrics into :attr:`stats_sink` and sum them up per app
+        context with ``REDICA_STATS_ENABLED``, other sinks can be added to
+        :data:`flask_sqlalchemy_redica.stats.stats` directly."""
+        if not app.config.setdefault('REDICA_STATS_ENABLED', False):
+            return
+        if self.stats_sink is None:
+            self.stats_sink = MemorySink()
+        stats.add_sink(self.stats_sink)
+        stats.add_sink(_app_context_sink)
+
+    @staticmethod
+    def teardown_memo(exc):
+        """Drop the request memo, see :mod:`flask_sqlalchemy_redica.memo`."""
+        ctx = stack.top
+        if ctx is not None and hasattr(ctx, 'redica_memo'):
+            del ctx.redica_memo
+
+    def warm_query(self, name=None):
+        """Register a function returning a query with a ``FromCache``
+        option, ``flask redica warm --query name`` runs it::
+
+            @db.warm_query()
+            def top_products():
+                return Product.query.options(Product.from_cache()).limit(50)
+        """
+        def decorator(f):
+            self.warm_queries[name or f.__name__] = f
+            return f
+        return decorator
+
     def make_declarative_base(self, model, metadata=None):
         """Creates the declarative base."""
         base = declarative_base(cls=model, name='Model',
@@ -80,12 +144,58 @@ class CachingSQLAlchemy(SQLAlchemy):
                     self.cache_invalidator_callback)
             return ctx.redica_invalidator
 
+    @property
+    def invalidation_batch(self):
+        """Invalidations of the current transaction, run once it ended,
+        ``None`` if they are run right away."""
+        ctx = stack.top
+        if ctx is not None and \
+                ctx.app.config.get('REDICA_BATCH_INVALIDATION'):
+            if not hasattr(ctx, 'redica_invalidation_batch'):
+                ctx.redica_invalidation_batch = InvalidationBatch()
+            return ctx.redica_invalidation_batch
+
     def init_events(self):
         event.listen(Session, 'after_commit', self.cache_flush)
+        event.listen(Session, 'after_transaction_end',
+                     self.cache_flush_batch)
 
     @staticmethod
     def cache_flush(session):
         ctx = stack.top
+        batch = getattr(ctx, 'redica_invalidation_batch', None)
+        if batch is not None:
+            # update the filter indices rather than dropping them
+            batch.committed = True
         if ctx is not None and hasattr(ctx, 'redica_invalidator'):
+            invalidations = len(ctx.redica_invalidator.items)
+            if invalidations and ctx.app.config.get('REDICA_CACHE_READ_URLS'):
+                # the flush may run elsewhere, e.g. in an invalidator thread
+                pin_primary(
+                    ctx.app.config.get('REDICA_READ_PIN_SECONDS', 2))
+            memo = getattr(ctx, 'redica_memo', None)
+            if invalidations and memo and isinstance(
+                    ctx.redica_invalidator,
+                    (CeleryCachingInvalidator, ThreadedCachingInvalidator)):
+                # the keys are deleted elsewhere, later
+                memo.clear()
+            if not stats.enabled or not invalidations:
+                ctx.redica_invalidator.flush()
+                return
+
+            start = default_timer()
             ctx.redica_invalidator.flush()
+            stats.timing('cache_flush_seconds', default_timer() - start)
+            stats.incr('invalidations', invalidations)
 
+    @staticmethod
+    def cache_flush_batch(session, transaction):
+        # after_commit has queued the invalidator's flushes by now, the
+        # batch also runs on rollback in case the transaction's data got
+        # cached meanwhile
+        if transaction.parent is not None:
+            return
+        ctx = stack.top
+        batch = getattr(ctx, 'redica_invalidation_batch', None)
+        if batch:
+            batch.execute()
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from dogpile.cache.api import NO_VALUE
+from dogpile.cache.proxy import ProxyBackend
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+def _to_text(key):
+    if isinstance(key, bytes):
+        return key.decode('utf-8')
+    return key
+
+
+def _evicted_keys(keys, deleted):
+    """The explicit keys, whether or not redis still had them, followed by
+    the keys tags and patterns resolved to."""
+    evicted = [_to_text(k) for k in keys]
+    seen = set(evicted)
+    for key in map(_to_text, deleted):
+        if key not in seen:
+            seen.add(key)
+            evicted.append(key)
+    return evicted
+
+
+class LocalCache(object):
+    """Bounded in-process LRU cache, entries also expire after ``ttl``
+    seconds so that a missed eviction message can only serve stale
+    values for a limited time.  Hits and misses of this tier and of the
+    one behind it are counted under the same lock as the entries."""
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=30):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = dict(l1_hits=0, l1_misses=0, l2_hits=0, l2_misses=0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._bytes
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def record(self, l2_hits=0, l2_misses=0):
+        """Count lookups of the tier behind this one."""
+        with self._lock:
+            self._stats['l2_hits'] += l2_hits
+            self._stats['l2_misses'] += l2_misses
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                expires, size, value = entry
+                if expires < time.time():
+                    self._bytes -= size
+                    entry = None
+            if entry is None:
+                self._stats['l1_misses'] += 1
+                return NO_VALUE
+            # re-insert as most recently used
+            self._entries[key] = entry
+            self._stats['l1_hits'] += 1
+            return value
+
+    def set(self, key, value, size=None):
+        """Cache ``value``, ``size`` is the length of its serialized form,
+        values are pickled to measure it when it is not given."""
+        if size is None:
+            size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            self.delete_multi([key])
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (time.time() + self.ttl, size, value)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or \
+                    self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def delete_multi(self, keys):
+        with self._lock:
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class LocalCacheProxy(ProxyBackend):
+    """Two-tier backend: a :class:`LocalCache` in front of the redis
+    backend.  Deletions are published on a redis channel so that every
+    process evicts the same keys from its own local tier.
+
+    Cached values are shared between callers of the same process and
+    must not be mutated, query results are copied into the session by
+    ``merge_result`` anyway.
+    """
+
+    #: cached objects are handed out more than once, so they must be
+    #: copied into sessions instead of being attached
+    shares_values = True
+
+    def __init__(self, channel, max_entries=1024,
+                 max_bytes=16 * 1024 * 1024, ttl=30):
+        super(LocalCacheProxy, self).__init__()
+        self.channel = channel
+        self.local = LocalCache(max_entries, max_bytes, ttl)
+        self.node_id = uuid.uuid4().hex
+        self._pid = None
+        self._subscriber = None
+        self._subscribe_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # expose the ExtendRedisBackend helpers (keys, pipeline, tag, ...)
+        proxied = self.__dict__.get('proxied')
+        if proxied is None:
+            raise AttributeError(name)
+        return getattr(proxied, name)
+
+    @property
+    def key_mangler(self):
+        return self.proxied.key_mangler
+
+    @property
+    def stats(self):
+        return self.local.stats
+
+    def _ensure_subscribed(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        # first use in this process, e.g. after a pre-fork server forked
+        with self._subscribe_lock:
+            if self._pid == pid:
+                return
+            self.local.clear()
+            pubsub = self.proxied.client.pubsub(
+                ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.channel: self._on_message})
+            self._subscriber = pubsub.run_in_thread(
+                sleep_time=1, daemon=True)
+            self._pid = pid
+
+    def _on_message(self, message):
+        node_id, keys = json.loads(_to_text(message['data']))
+        if node_id != self.node_id:
+            self.local.delete_multi(keys)
+
+    def eviction_message(self, keys):
+        return json.dumps([self.node_id, [_to_text(k) for k in keys]])
+
+    def evict(self, keys, publish=True):
+        keys = [_to_text(k) for k in keys]
+        if not keys:
+            return
+        self.local.delete_multi(keys)
+        if publish:
+            self.proxied.client.publish(
+                self.channel, self.eviction_message(keys))
+
+    def _fill(self, key, data):
+        """Load the stored bytes of a redis hit into the local tier, sized
+        by their length."""
+        if data is None:
+            return NO_VALUE
+        value = self.proxied.serializer.loads(data)
+        self.local.set(key, value, size=len(data))
+        return value
+
+    def get(self, key):
+        self._ensure_subscribed()
+        value = self.local.get(key)
+        if value is not NO_VALUE:
+            return value
+
+        value = self._fill(key, self.proxied.get_serialized(key))
+        if value is NO_VALUE:
+            self.local.record(l2_misses=1)
+        else:
+            self.local.record(l2_hits=1)
+        return value
+
+    def get_multi(self, keys):
+        self._ensure_subscribed()
+        values = [self.local.get(key) for key in keys]
+        missing = [pos for pos, v in enumerate(values) if v is NO_VALUE]
+
+        if missing:
+            fetched = self.proxied.get_serialized_multi(
+                [keys[pos] for pos in missing])
+            for pos, data in zip(missing, fetched):
+                values[pos] = self._fill(keys[pos], data)
+            hits = sum(1 for data in fetched if data is not None)
+            self.local.record(l2_hits=hits, l2_misses=len(missing) - hits)
+        return values
+
+    def set(self, key, value):
+        # other processes keep their copy until it expires from their
+        # local tier, only invalidations are broadcast
+        self.proxied.set(key, value)
+        self.local.delete_multi([key])
+
+    def set_multi(self, mapping):
+        self.proxied.set_multi(mapping)
+        self.local.delete_multi(list(mapping))
+
+    def delete(self, key):
+        self.proxied.delete(key)
+        self.evict([key])
+
+    def delete_multi(self, keys):
+        self.proxied.delete_multi(keys)
+        self.evict(keys)
+
+    def invalidate_tags(self, tags, keys=(), raw=False, patterns=(),
+                        index_ops=()):
+        deleted = self.proxied.invalidate_tags(
+            tags, keys, raw=raw, patterns=patterns, index_ops=index_ops)
+        # a key that expired from redis may still be held by another node
+        self.evict(_evicted_keys(self.proxied._mangle(keys, raw), deleted))
+        return deleted
+
+    def invalidate(self, keys=(), patterns=(), index_ops=()):
+        deleted, round_trips = self.proxied.invalidate(
+            keys, patterns, index_ops)
+        evicted = _evicted_keys(self.proxied._mangle(keys, False), deleted)
+        if evicted:
+            self.evict(evicted)
+            round_trips += 1
+        return deleted, round_trips
+
+    def write_through(self, mapping, generations):
+        # a written value replaces an invalidation, so it is broadcast
+        written, round_trips = self.proxied.write_through(
+            mapping, generations)
+        if generations:
+            self.evict(list(generations))
+            round_trips += 1
+        return written, round_trips
+
+    def hit_ratios(self):
+        stats = self.stats
+        for tier in ('l1', 'l2'):
+            hits = stats['%s_hits' % tier]
+            total = hits + stats['%s_misses' % tier]
+            stats['%s_hit_ratio' % tier] = \
+                hits / float(total) if total else 0.0
+        stats['l1_entries'] = len(self.local)
+        stats['l1_bytes'] = self.local.size
+        return stats
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_sqlalchemy_redica.memo
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Request-local memo of cached query results.  A ``FromCache`` query or
+    ``Model.cache.get(pk)`` run again in the same app context returns the
+    instances of its first run, without the redis ``GET``, the unpickling
+    and the ``merge_result``.
+
+    ``REDICA_REQUEST_MEMO``
+        enables the memo, default False
+
+    Results are kept by their region's cache key, until that key is
+    deleted or set again in the app context, and the memo is dropped at
+    its teardown.  Results of another session, e.g. after
+    ``db.session.remove()``, are not reused.  An invalidator flushing in a
+    thread or a celery task clears the whole memo on commit instead, the
+    keys it deletes are not known in the app context.
+"""
+from __future__ import absolute_import
+
+from dogpile.cache.api import NO_VALUE
+
+try:
+    from flask import _app_ctx_stack as stack
+except ImportError:
+    from flask import _request_ctx_stack as stack
+
+
+class RequestMemo(object):
+    """Query results of one app context by mangled cache key, with the
+    session their instances belong to."""
+
+    def __init__(self):
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, session):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] is not session:
+            return NO_VALUE
+        return entry[1]
+
+    def set(self, key, session, value):
+        self._entries[key] = (session, value)
+
+    def evict(self, keys):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+def request_memo():
+    """The memo of the current app context, ``None`` outside of one or
+    without ``REDICA_REQUEST_MEMO``."""
+    ctx = stack.top
+    if ctx is None or not ctx.app.config.get('REDICA_REQUEST_MEMO'):
+        return None
+    try:
+        return ctx.redica_memo
+    except AttributeError:
+        ctx.redica_memo = RequestMemo()
+        return ctx.redica_memo
+
+
+def evict_memo(keys):
+    """Forget the results of mangled cache keys in the current app
+    context."""
+    memo = getattr(stack.top, 'redica_memo', None)
+    if memo:
+        memo.evict(_to_text(key) for key in keys)
+
+
+def _to_text(key):
+    if isinstance(key, bytes):
+        return key.decode('utf-8')
+    return key
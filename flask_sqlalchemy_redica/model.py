@@ -1,19 +1,25 @@
 # -*- coding: utf-8 -*-
-import importlib
 import itertools
+import numbers
+import time
 import warnings
 
 import functools
+from timeit import default_timer
+
 from blinker import signal
-from dogpile.cache.api import NO_VALUE
+from dogpile.cache.api import CachedValue, NO_VALUE
+from dogpile.cache.region import value_version
 from flask_sqlalchemy import DefaultMeta, Model
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy import event, inspect
 from sqlalchemy.orm.attributes import get_history
 from sqlalchemy.orm.base import PASSIVE_NO_INITIALIZE
 
-from .utils import current_redica
+from .utils import current_redica, _import_model, _tag_key_from_key, \
+    integer_types, text_type
 from .cache import FromCache
+from .stats import stats
 
 
 class Cache(object):
@@ -22,7 +28,7 @@ class Cache(object):
     def __init__(self, model, regions, label,
                  columns=None, exclude_columns=None,
                  invalidate_queries=None, invalidate_relationships=None,
-                 expiration_time=None):
+                 expiration_time=None, indexes=None, write_through=False):
         self.model = model
         self.cache_regions = regions
         self.label = label
@@ -33,6 +39,12 @@ class Cache(object):
         self.invalidate_queries = invalidate_queries
         self.invalidate_relationships = invalidate_relationships
         self.expiration_time = expiration_time
+        #: compound filter indices, tuples of column names
+        self.indexes = [tuple(index) for index in indexes or ()]
+        #: rewrite the object key with the committed state instead of
+        #: deleting it
+        self.write_through = write_through
+        self._pk_type = None
 
     @property
     def regions(self):
@@ -42,48 +54,259 @@ class Cache(object):
         return self.model.query.options(self.from_cache(pk=pk)).get(pk)
 
     def filter(self, **kwargs):
+        limit, offset, order_by, query_kwargs = self._filter_args(kwargs)
+        if self.pk in query_kwargs:
+            yield self.get(query_kwargs[self.pk])
+            return
+
+        backend = self.regions[self.label].backend
+        index_key = self.cache_index_key(**query_kwargs)
+        members = backend.index_range(
+            index_key, offset, limit, desc=order_by == 'desc')
+
+        if members is None:
+            pks = self._page(
+                self._build_index(backend, index_key, query_kwargs),
+                order_by, offset, limit)
+        else:
+            pks = [self._pk_from_member(m) for m in members]
+            if stats.enabled:
+                self._record_lookups(1, 0)
+
+        for obj in self.get_many(pks):
+            # objects deleted while their values were not loaded stay in
+            # the index until it expires
+            if obj is not None:
+                yield obj
+
+    def count(self, **kwargs):
+        """Number of objects :meth:`filter` finds, from the size of the
+        filter index."""
+        _, _, _, query_kwargs = self._filter_args(kwargs)
+        if self.pk in query_kwargs:
+            return int(self.get(query_kwargs[self.pk]) is not None)
+
+        backend = self.regions[self.label].backend
+        index_key = self.cache_index_key(**query_kwargs)
+        count = backend.index_count(index_key)
+        if count is None:
+            return len(self._build_index(backend, index_key, query_kwargs))
+        if stats.enabled:
+            self._record_lookups(1, 0)
+        return count
+
+    def _build_index(self, backend, index_key, query_kwargs):
+        start = default_timer()
+        pks = self._query_index(query_kwargs)
+        backend.index_build(
+            index_key, [self._index_member(pk) for pk in pks],
+            self._built_index_expiration_time(backend, pks))
+        if stats.enabled:
+            self._record_lookups(0, 1, default_timer() - start)
+        return pks
+
+    @staticmethod
+    def _negative_expiration_time(backend):
+        return getattr(backend, 'negative_expiration_time', None)
+
+    @property
+    def _index_expiration_time(self):
+        return self.expiration_time or \
+            self.regions[self.label].expiration_time
+
+    def _built_index_expiration_time(self, backend, pks):
+        if not pks:
+            # inserts update the index either way, the short lifetime
+            # only bounds how many empty ones are kept
+            return self._negative_expiration_time(backend) or \
+                self._index_expiration_time
+        return self._index_expiration_time
+
+    @staticmethod
+    def _index_member(pk):
+        """Score and member of a pk in a filter index, numeric pks are
+        ordered by value, any other by their text."""
+        if isinstance(pk, numbers.Number) and not isinstance(pk, bool):
+            return pk, text_type(pk)
+        return 0, text_type(pk)
+
+    def _pk_from_member(self, member):
+        if isinstance(member, bytes):
+            member = member.decode('utf-8')
+        if self._pk_type is None:
+            column = self.model.__table__.columns[self.pk]
+            try:
+                self._pk_type = column.type.python_type
+            except NotImplementedError:
+                self._pk_type = text_type
+        if self._pk_type in integer_types:
+            return int(member)
+        return self._pk_type(member)
+
+    def _filter_args(self, kwargs):
+        kwargs = dict(kwargs)
         limit = kwargs.pop('limit', None)
         offset = kwargs.pop('offset', None)
         order_by = kwargs.pop('order_by', 'asc')
 
-        query_kwargs = {}
-        if kwargs:
-            if len(kwargs) > 1:
+        if len(kwargs) > 1:
+            if self._compound_index(kwargs) is None:
                 raise TypeError(
-                    'filter accept only one attribute for filtering')
-            key, value = kwargs.items()[0]
-            if key == self.pk:
-                yield self.get(value)
-                return
-
-            if key not in self._columns:
-                raise TypeError('%s does not have an attribute %s' % self, key)
-            query_kwargs[key] = value
-
-        cache_key = self.cache_key(**kwargs)
+                    'filter accept only one attribute for filtering, '
+                    'or the columns of a compound cache index')
+            return limit, offset, order_by, kwargs
+        for key in kwargs:
+            if key != self.pk and key not in self._columns:
+                raise TypeError(
+                    '%s does not have an attribute %s' % (self.model, key))
+        return limit, offset, order_by, kwargs
 
-        pks = self.regions[self.label].get(cache_key)
+    def _compound_index(self, kwargs):
+        for index in self.indexes:
+            if set(index) == set(kwargs):
+                return index
 
-        if pks is NO_VALUE:
-            pks = [o.id for o in self.model.query.filter_by(
-                **query_kwargs).with_entities(getattr(self.model, self.pk))]
-            self.regions[self.label].set(cache_key, pks)
+    def _query_index(self, query_kwargs):
+        pk_column = getattr(self.model, self.pk)
+        return [o[0] for o in self.model.query.filter_by(
+            **query_kwargs).with_entities(pk_column).order_by(pk_column)]
 
+    @staticmethod
+    def _page(pks, order_by, offset, limit):
         if order_by == 'desc':
-            pks.reverse()
+            pks = pks[::-1]
 
         if offset is not None:
-            pks = pks[pks:]
+            pks = pks[offset:]
 
         if limit is not None:
             pks = pks[:limit]
 
+        return pks
+
+    def get_many(self, pks, as_dict=False):
+        """Fetch objects by primary key with a single MGET, misses are
+        loaded with one IN query.  Returns a list in the order of ``pks``
+        with ``None`` for unknown objects, or a dict by pk of the found
+        ones when ``as_dict`` is set."""
+        pks, keys, unique = self._unique_keys(pks)
+
+        objs = {}
+        if unique:
+            values = self.regions[self.label].get_multi(
+                [key for _, key in unique])
+            objs, missing = self._merge_cached(unique, values)
+            if missing:
+                start = default_timer()
+                objs.update(self._load_many(missing))
+                if stats.enabled:
+                    self._record_lookups(
+                        0, len(missing), default_timer() - start)
+            if stats.enabled:
+                self._record_lookups(len(unique) - len(missing), 0)
+
+        return self._many_result(pks, keys, objs, as_dict)
+
+    def _record_lookups(self, hits, misses, creation_time=None):
+        labels = dict(region=self.label, model=self.model.__name__)
+        if hits:
+            stats.incr('cache_hits', hits, **labels)
+        if misses:
+            stats.incr('cache_misses', misses, **labels)
+        if creation_time is not None:
+            stats.timing('cache_creation_seconds', creation_time, **labels)
+
+    def _unique_keys(self, pks):
+        pks = list(pks)
         keys = [self.cache_key(pk) for pk in pks]
-        for pos, obj in enumerate(self.regions[self.label].get_multi(keys)):
-            if obj is NO_VALUE:
-                yield self.get(pks[pos])
-            else:
-                yield obj[0]
+
+        unique, seen = [], set()
+        for pk, key in zip(pks, keys):
+            if key not in seen:
+                seen.add(key)
+                unique.append((pk, key))
+        return pks, keys, unique
+
+    def _merge_cached(self, unique, values):
+        """Merge the cached objects into the session, returns them by
+        cache key and the pks that were not cached."""
+        cached_keys, cached_objs, missing = [], [], []
+        for (pk, key), value in zip(unique, values):
+            if value is NO_VALUE:
+                missing.append(pk)
+            elif value:
+                cached_keys.append(key)
+                cached_objs.append(value[0])
+
+        objs = {}
+        if cached_objs:
+            merged = self.model.query.merge_result(cached_objs, load=False)
+            objs.update(zip(cached_keys, merged))
+        return objs, missing
+
+    @staticmethod
+    def _many_result(pks, keys, objs, as_dict):
+        if as_dict:
+            return dict((pk, objs[key])
+                        for pk, key in zip(pks, keys) if key in objs)
+        return [objs.get(key) for key in keys]
+
+    def _query_many(self, pks):
+        pk_column = getattr(self.model, self.pk)
+        return dict(
+            (self.cache_key(getattr(o, self.pk)), o)
+            for o in self.model.query.filter(pk_column.in_(pks)))
+
+    def _committed_values(self, session, pks):
+        """Values of the object keys of ``pks`` as read by ``session``,
+        for :meth:`InvalidationBatch.execute` to write through."""
+        pk_column = getattr(self.model, self.pk)
+        metadata = dict(ct=time.time(), v=value_version)
+        return dict(
+            (self.cache_key(getattr(o, self.pk)), CachedValue([o], metadata))
+            for o in session.query(self.model).filter(pk_column.in_(pks)))
+
+    def _load_many(self, pks):
+        """Load objects with a single IN query and write them back to the
+        cache in one pipelined ``set_multi``, returns a dict by cache key.
+        Unknown pks are cached as empty results with
+        ``REDICA_NEGATIVE_CACHE_TTL``."""
+        objs = self._query_many(pks)
+        region = self.regions[self.label]
+        mapping = dict((key, [obj]) for key, obj in objs.items())
+
+        negative_expiration_time = self._negative_expiration_time(
+            region.backend)
+        unknown = []
+        if negative_expiration_time:
+            unknown = [key for key in map(self.cache_key, pks)
+                       if key not in objs]
+            mapping.update((key, []) for key in unknown)
+        if mapping:
+            region.set_multi(mapping)
+        if unknown:
+            region.backend.expire(unknown, negative_expiration_time)
+        return objs
+
+    def aget(self, pk):
+        """awaitable :meth:`get`, see :mod:`flask_sqlalchemy_redica.aio`"""
+        from .aio import get
+        return get(self, pk)
+
+    def aget_many(self, pks, as_dict=False):
+        """awaitable :meth:`get_many`"""
+        from .aio import get_many
+        return get_many(self, pks, as_dict=as_dict)
+
+    def afilter(self, **kwargs):
+        """awaitable :meth:`filter`, resolves to a list"""
+        from .aio import filter
+        return filter(self, **kwargs)
+
+    def aflush_all(self, obj):
+        """awaitable :meth:`flush_all`"""
+        from .aio import flush_all
+        return flush_all(self, obj)
 
     def flush(self, key):
         self.regions[self.label].delete(key, key_mangle=True)
@@ -95,7 +318,10 @@ class Cache(object):
         if not key_pattern.endswith('*'):
             key_pattern += '*'
         backend = self.regions[self.label].backend
-        keys = backend.keys(key_pattern)
+        if self._invalidation_mode(backend) == 'keys':
+            keys = backend.keys(key_pattern)
+        else:
+            keys = backend.scan_keys(key_pattern)
         if len(keys) > 0:
             backend.delete_multi(keys)
 
@@ -109,13 +335,15 @@ class Cache(object):
         return self.columns
 
     def from_cache(self, cache_key=None, pk=None, prefix=None,
-                   expiration_time=None):
+                   expiration_time=None, shape_key=None, hydrate='merge',
+                   xfetch_beta=None):
         if pk:
             cache_key = self.cache_key(pk)
         expiration_time = expiration_time or self.expiration_time
         return FromCache(
             self.label, cache_key, query_prefix=prefix,
-            cache_regions=self.regions, expiration_time=expiration_time)
+            cache_regions=self.regions, expiration_time=expiration_time,
+            shape_key=shape_key, hydrate=hydrate, xfetch_beta=xfetch_beta)
 
     def cache_key(self, pk='all', **kwargs):
         q_filter = u''.join(u'{}={}'.format(k, v) for k, v in kwargs.items()) \
@@ -123,6 +351,12 @@ class Cache(object):
         return u"{}:{}:object:{}".format(
             self.model.__table__, pk, q_filter)
 
+    def cache_index_key(self, **kwargs):
+        """Key of the sorted set of pks :meth:`filter` pages through."""
+        q_filter = u'&'.join(
+            u'{}={}'.format(k, kwargs[k]) for k in sorted(kwargs)) or self.pk
+        return u'{}:all:index:{}'.format(self.model.__table__, q_filter)
+
     def cache_relationship_key(self, pk, relation_name):
         return u'{}:{}:relationship:{}'.format(
             self.model.__tablename__, pk, relation_name)
@@ -135,15 +369,18 @@ class Cache(object):
             return u'{}:{}:query'.format(self.model.__tablename__, pk)
 
     def flush_filters(self, obj):
+        keys = self._flush_filter_keys(obj)
+        if len(keys) > 0:
+            self.regions[self.label].delete_multi(keys)
+
+    def _flush_filter_keys(self, obj):
         keys = self._filter_keys(obj)
-        keys.append(self.cache_key())
+        keys.append(self.cache_index_key())
 
         obj_pk = getattr(obj, self.pk)
         if obj_pk:
             keys.append(self.cache_key(obj_pk))
-
-        if len(keys) > 0:
-            self.regions[self.label].delete_multi(keys)
+        return keys
 
     def _filter_keys(self, obj):
         keys = []
@@ -151,25 +388,133 @@ class Cache(object):
             added, _, deleted = get_history(
                 obj, column, passive=PASSIVE_NO_INITIALIZE)
             for value in itertools.chain(added or (), deleted or ()):
-                keys.append(self.cache_key(**{column: value}))
+                keys.append(self.cache_index_key(**{column: value}))
+        keys.extend(op[0] for op in self._compound_index_ops(obj))
         return keys
 
+    def _index_ops(self, obj, event=None):
+        """``(index, score, member)`` updates of the filter indices for a
+        change of ``obj``, a ``'rem'`` score removes the member."""
+        obj_pk = getattr(obj, self.pk)
+        if obj_pk is None:
+            return []
+        score, member = self._index_member(obj_pk)
+
+        ops = []
+        for column in self._columns:
+            added, unchanged, deleted = get_history(
+                obj, column, passive=PASSIVE_NO_INITIALIZE)
+            if event == 'delete':
+                removed = itertools.chain(
+                    added or (), unchanged or (), deleted or ())
+                added = ()
+            else:
+                removed = deleted or ()
+            for value in removed:
+                ops.append(
+                    (self.cache_index_key(**{column: value}), 'rem', member))
+            for value in added or ():
+                ops.append(
+                    (self.cache_index_key(**{column: value}), score, member))
+
+        if event == 'insert':
+            ops.append((self.cache_index_key(), score, member))
+        elif event == 'delete':
+            ops.append((self.cache_index_key(), 'rem', member))
+        ops.extend(self._compound_index_ops(obj, event))
+        return ops
+
+    def _compound_index_ops(self, obj, event=None):
+        """Filter index updates of the compound indices, their columns are
+        loaded before a flush writes the row, see
+        :meth:`CachingMixin.listen_index_columns`."""
+        obj_pk = getattr(obj, self.pk)
+        if obj_pk is None or not self.indexes:
+            return []
+        score, member = self._index_member(obj_pk)
+
+        ops = []
+        for index in self.indexes:
+            old, new, changed = {}, {}, False
+            for column in index:
+                added, unchanged, deleted = get_history(
+                    obj, column, passive=PASSIVE_NO_INITIALIZE)
+                changed = changed or bool(added or deleted)
+                old_values = deleted or unchanged
+                new_values = added or unchanged
+                if old_values:
+                    old[column] = old_values[0]
+                if new_values:
+                    new[column] = new_values[0]
+
+            complete = len(new) == len(index)
+            if event == 'insert':
+                removed, kept = None, new if complete else None
+            elif event == 'delete':
+                removed, kept = new if complete else old, None
+            elif changed:
+                removed, kept = old, new if complete else None
+            else:
+                continue
+            if removed == kept:
+                continue
+            if removed and len(removed) == len(index):
+                ops.append((self.cache_index_key(**removed), 'rem', member))
+            if kept:
+                ops.append((self.cache_index_key(**kept), score, member))
+        return ops
+
+    @staticmethod
+    def _invalidation_mode(backend):
+        return getattr(backend, 'invalidation_mode', 'keys')
+
     def flush_caches(self, obj_pk):
         patterns = self._pattern_keys(obj_pk)
 
         backend = self.regions[self.label].backend
+        if self._invalidation_mode(backend) != 'keys':
+            self._flush_tagged_caches(backend, patterns)
+            return
+
         ppl = backend.pipeline()
-        for p in itertools.imap(lambda k: backend.key_mangler(k), patterns):
-            ppl.keys(p)
+        for p in patterns:
+            ppl.keys(backend.key_mangler(p))
+
+        results = ppl.execute()
+        if stats.enabled:
+            stats.round_trip()
 
         keys = []
-        for rs in ppl.execute():
+        for rs in results:
             if not rs:
                 continue
             keys.extend(rs)
         if len(keys) > 0:
             backend.delete_multi(keys)
 
+    def _flush_tagged_caches(self, backend, patterns):
+        tags, keys = self._split_patterns(backend, patterns)
+        if self._invalidation_mode(backend) == 'migrate':
+            # keys cached before tagging was enabled are not in any tag set
+            for p in patterns:
+                if p.endswith('*'):
+                    keys.extend(backend.scan_keys(p))
+
+        backend.invalidate_tags(tags, keys, raw=True)
+
+    @staticmethod
+    def _split_patterns(backend, patterns):
+        """Mangled tag sets of the wildcard patterns and the plain keys."""
+        tags, keys = [], []
+        for p in patterns:
+            if p.endswith('*'):
+                tags.append(_tag_key_from_key(p))
+            else:
+                keys.append(p)
+
+        mangle = backend.key_mangler or (lambda k: k)
+        return [mangle(t) for t in tags], [mangle(k) for k in keys]
+
     def _pattern_keys(self, obj_pk):
         keys = []
 
@@ -187,17 +532,117 @@ class Cache(object):
 
         return keys
 
-    def flush_all(self, obj):
-        self.flush_filters(obj)
+    def flush_all(self, obj, event=None):
+        batch = InvalidationBatch()
+        batch.add(self, obj=obj, event=event)
+        batch.execute()
 
-        obj_pk = getattr(obj, self.pk)
+    def _invalidation_keys(self, obj_pk=None, obj=None):
+        """Cache keys and wildcard patterns invalidated by a change of
+        ``obj``, or of the object with ``obj_pk`` when it is gone.  The
+        filter indices are left to :meth:`_index_ops`."""
+        keys = []
+        if obj is not None:
+            obj_pk = getattr(obj, self.pk)
+            if obj_pk:
+                keys.append(self.cache_key(obj_pk))
+
+        patterns = []
         if obj_pk:
-            self.flush_caches(obj_pk)
+            for p in self._pattern_keys(obj_pk):
+                (patterns if p.endswith('*') else keys).append(p)
+        return keys, patterns
+
+
+class InvalidationBatch(object):
+    """Cache keys to invalidate, gathered from any number of objects and
+    deleted with a single script call per region on :meth:`execute`.
+    Collects the invalidations of a whole commit when
+    ``REDICA_BATCH_INVALIDATION`` is enabled.
+
+    The object keys of ``cache_write_through`` models are written with the
+    committed state instead, unless the transaction was rolled back or the
+    object deleted.  A generation counter per key makes the write of a
+    transaction that committed before another one's reservation fail, so
+    that concurrent writers cannot leave an older state behind."""
+
+    def __init__(self):
+        self.pending = {}
+        #: set once the transaction committed, the filter indices a rolled
+        #: back (or not batched) change touched are deleted instead of
+        #: being updated
+        self.committed = False
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, cache, obj_pk=None, obj=None, event=None):
+        keys, patterns = cache._invalidation_keys(obj_pk, obj)
+        backend = cache.regions[cache.label].backend
+        pending_keys, pending_patterns, pending_ops, writes = \
+            self.pending.setdefault(backend, (set(), set(), [], {}))
+        if obj is not None:
+            pending_ops.extend(cache._index_ops(obj, event))
+            obj_pk = getattr(obj, cache.pk)
+            key = cache.cache_key(obj_pk)
+            if cache.write_through and event != 'delete' and key in keys:
+                keys.remove(key)
+                writes[key] = (cache, obj_pk)
+        pending_keys.update(keys)
+        pending_patterns.update(patterns)
+
+    def execute(self):
+        """Run the pending invalidations, returns the redis round trips
+        it took."""
+        pending, self.pending = self.pending, {}
+        committed, self.committed = self.committed, False
+        round_trips = 0
+        for backend, (keys, patterns, index_ops, writes) in pending.items():
+            if not committed:
+                keys.update(op[0] for op in index_ops)
+                keys.update(writes)
+                index_ops, writes = [], {}
+            if keys or patterns or index_ops:
+                round_trips += backend.invalidate(
+                    keys, patterns, index_ops)[1]
+            # deleted later in the transaction
+            writes = dict(
+                (key, w) for key, w in writes.items() if key not in keys)
+            if writes:
+                round_trips += self._write_through(backend, writes)
+        if stats.enabled and round_trips:
+            stats.incr('invalidation_batches')
+            stats.incr('invalidation_round_trips', round_trips)
+        return round_trips
+
+    @staticmethod
+    def _write_through(backend, writes):
+        """Reserve the object keys, read the committed objects in a
+        session of their own and write them, returns the round trips."""
+        generations = backend.reserve_writes(list(writes))
+        pks = {}
+        for cache, obj_pk in writes.values():
+            pks.setdefault(cache, []).append(obj_pk)
+
+        session = current_redica.create_scoped_session()
+        try:
+            mapping = {}
+            for cache, cache_pks in pks.items():
+                mapping.update(cache._committed_values(session, cache_pks))
+            round_trips = backend.write_through(mapping, generations)[1]
+        finally:
+            session.close()
+        return round_trips + 1
 
 
 _flush_signal = signal('flask_sqlalchemy_redica_flush_signal')
 
 
+def _load_replaced_value(target, value, oldvalue, initiator):
+    """``set`` listener registered with ``active_history``, which is what
+    makes the attribute load the value being replaced."""
+
+
 class CachingConfigure(object):
     #: enable cache
     cache_enable = True
@@ -224,6 +669,16 @@ class CachingConfigure(object):
     #: these columns will not produce cache indices
     cache_exclude_columns = ()
 
+    #: compound cache indices, e.g. ``[('tenant_id', 'status')]``, used by
+    #: ``cache.filter`` when given exactly the columns of one of them
+    cache_indexes = ()
+
+    #: rewrite the cached object with its committed state on commit
+    #: instead of deleting it, for hot objects that change often.
+    #: relationship and query keys are still invalidated.  Needs
+    #: ``REDICA_BATCH_INVALIDATION``, without it the object is deleted
+    cache_write_through = False
+
     #: enable cache invalidation
     #: if disabled, cache will only expired until timeout
     #: if enabled, when object changes, cache will invalidate automatically
@@ -265,9 +720,11 @@ class CachingMixin(CachingConfigure):
                 cls, cls.cache_regions, cls.cache_label,
                 columns=cls.cache_columns,
                 exclude_columns=cls.cache_exclude_columns,
+                indexes=cls.cache_indexes,
                 invalidate_relationships=cls.cache_relationships,
                 invalidate_queries=cls.cache_queries,
-                expiration_time=cls.cache_expiration_time
+                expiration_time=cls.cache_expiration_time,
+                write_through=cls.cache_write_through
             )
 
     @declared_attr.cascading
@@ -277,9 +734,16 @@ class CachingMixin(CachingConfigure):
         return hasattr(cls, 'cache') and getattr(cls, 'cache_enable')
 
     @classmethod
-    def from_cache(cls, pk='all'):
+    def from_cache(cls, pk='all', shape_key=None, hydrate='merge',
+                   xfetch_beta=None):
         query_prefix = cls.query_cache_key(pk, '')
-        return cls.cache.from_cache(prefix=query_prefix)
+        return cls.cache.from_cache(
+            prefix=query_prefix, shape_key=shape_key, hydrate=hydrate,
+            xfetch_beta=xfetch_beta)
+
+    @classmethod
+    def get_many(cls, pks, as_dict=False):
+        return cls.cache.get_many(pks, as_dict=as_dict)
 
     @classmethod
     def relationship_cache_key(cls, pk, relation_name):
@@ -330,6 +794,26 @@ class CachingMixin(CachingConfigure):
                 cls.on_model_invalidate, sender=sender, weak=False)
 
         cls.init_invalidate_columns(mapper)
+        if cls.cache_enable and cls.cache_indexes:
+            cls.listen_index_columns(mapper)
+
+    @classmethod
+    def listen_index_columns(cls, mapper):
+        """Compound index updates need the old and the new value of each
+        of their columns, so unloaded ones are loaded before a change of
+        the row is written and a set column loads the value it replaces.
+        """
+        columns = sorted(set(c for index in cls.cache_indexes for c in index))
+
+        def load_index_columns(mapper, connection, target):
+            for column in columns:
+                getattr(target, column)
+
+        for column in columns:
+            event.listen(getattr(cls, column), 'set', _load_replaced_value,
+                         active_history=True)
+        event.listen(mapper, 'before_update', load_index_columns)
+        event.listen(mapper, 'before_delete', load_index_columns)
 
     @classmethod
     def init_invalidate_columns(cls, mapper):
@@ -453,9 +937,13 @@ class CachingMixin(CachingConfigure):
                     _flush_signal.send(sender, **kwargs)
 
     @classmethod
-    def _flush_all(cls, target_id, target):
-        if target:
-            cls.cache.flush_all(target)
+    def _flush_all(cls, target_id, target, event=None):
+        batch = current_redica.invalidation_batch if current_redica \
+            else None
+        if batch is not None:
+            batch.add(cls.cache, target_id, target, event)
+        elif target:
+            cls.cache.flush_all(target, event)
         elif target_id:
             cls.cache.flush_caches(target_id)
 
@@ -464,7 +952,10 @@ class CachingMixin(CachingConfigure):
         if cls.cache_enable and cls.cache_invalidate:
             target = kw.get('target')
             target_id = kw.get('target_id')
-            cls._flush_all(target_id, target)
+            # the event of a notification is the one of its origin
+            event = kw.get('event') \
+                if kw.get('source') == 'model_change' else None
+            cls._flush_all(target_id, target, event)
 
 
 class CachingInvalidator(object):
@@ -479,29 +970,65 @@ class CachingInvalidator(object):
     def do_flush(items):
         if current_redica:
             session = current_redica.create_scoped_session()
+            items = CachingInvalidator._unique_items(items)
+            targets = CachingInvalidator._load_targets(session, items)
             for info in items:
-                module = info.get('module')
                 model = info.get('model')
-                target_id = info.get('target_id')
-                model_cls = getattr(importlib.import_module(module), model)
-                target = session.query(model_cls).get(target_id)
-
-                info['target'] = target
+                info['target'] = targets.get(
+                    (info.get('module'), model, info.get('target_id')))
                 info['source'] = 'flush'
 
-                origin_module = info.get('origin_module', None)
-                origin_model = info.get('origin_model', None)
-                origin_target_id = info.get('origin_target_id', None)
-                if origin_module and origin_model and origin_target_id:
-                    origin_model_cls = getattr(
-                        importlib.import_module(origin_module), origin_model)
-                    origin_target = session.query(
-                        origin_model_cls).get(origin_target_id)
-                    info['origin_target'] = origin_target
+                origin = (info.get('origin_module', None),
+                          info.get('origin_model', None),
+                          info.get('origin_target_id', None))
+                if all(origin):
+                    info['origin_target'] = targets.get(origin)
 
                 _flush_signal.send(model, **info)
             session.close()
 
+            # outside of a request nothing else runs the gathered batch
+            batch = current_redica.invalidation_batch
+            if batch:
+                batch.execute()
+
+    @staticmethod
+    def _unique_items(items):
+        """Drop repeated invalidations of the same target and event, the
+        first one queued is kept."""
+        unique, seen = [], set()
+        for info in items:
+            key = (info.get('module'), info.get('model'),
+                   info.get('target_id'), info.get('event'))
+            if key not in seen:
+                seen.add(key)
+                unique.append(info)
+        return unique
+
+    @staticmethod
+    def _load_targets(session, items):
+        """Load the targets and origin targets of the items with one IN
+        query per model, returns them by (module, model, pk)."""
+        pks = {}
+        for info in items:
+            if info.get('target_id') is not None:
+                pks.setdefault((info.get('module'), info.get('model')),
+                               set()).add(info['target_id'])
+            origin = (info.get('origin_module', None),
+                      info.get('origin_model', None))
+            if all(origin) and info.get('origin_target_id', None):
+                pks.setdefault(origin, set()).add(info['origin_target_id'])
+
+        targets = {}
+        for (module, model), model_pks in pks.items():
+            model_cls = _import_model(module, model)
+            pk_column = inspect(model_cls).primary_key[0]
+            pk_key = inspect(model_cls).get_property_by_column(pk_column).key
+            for target in session.query(model_cls).filter(
+                    pk_column.in_(model_pks)):
+                targets[(module, model, getattr(target, pk_key))] = target
+        return targets
+
     def flush(self):
         items = list(self.items)
         self.items = []
@@ -534,8 +1061,7 @@ class CachingMeta(DefaultMeta):
         name, bases, dct = args
         super(CachingMeta, cls).__init__(*args)
 
-        if any(itertools.imap(
-                lambda x: x != Model and issubclass(x, Model), bases)):
+        if any(x != Model and issubclass(x, Model) for x in bases):
             for k, v in caching_attributes:
                 if k not in dct:
                     setattr(cls, k, v)
@@ -4,48 +4,664 @@ from __future__ import absolute_import
 import functools
 
 from redis import BlockingConnectionPool
+from redis.exceptions import LockError
+from dogpile.cache.api import NO_VALUE
 from dogpile.cache.region import make_region
 from dogpile.cache import register_backend
 from dogpile.cache.backends.redis import RedisBackend
 
-from .utils import _md5_key_mangler
+try:
+    from redis.cluster import RedisCluster
+    from redis.crc import key_slot
+except ImportError:
+    # redis-py < 4.1
+    RedisCluster = key_slot = None
+
+from .local import LocalCacheProxy
+from .memo import evict_memo
+from .refresh import RefreshRunner
+from .replica import ReplicaSet, pin_primary
+from .serializer import CompressingSerializer, make_serializer
+from .stats import stats
+from .utils import _md5_key_mangler, _hash_tag_key_mangler, \
+    _tag_key_from_key
+
+#: ``keys``: find relationship/query keys with ``KEYS`` on invalidation
+#: ``tags``: record those keys in per-object sets, invalidate from the sets
+#: ``migrate``: like ``tags``, but also ``SCAN`` for keys cached before
+#: the tag sets existed
+INVALIDATION_MODES = ('keys', 'tags', 'migrate')
+
+# KEYS[1..ARGV[1]] are tag sets, the last ARGV[2] KEYS are filter indices
+# and the KEYS in between plain cache keys.  Each index has a score and
+# member in ARGV[3..], the member is added to the index or removed from
+# it with a 'rem' score, indices that are not cached are left alone.  The
+# remaining ARGV are key patterns resolved with KEYS.  Returns the cache
+# keys that were deleted.  The members of tag sets and pattern matches are
+# not declared KEYS, so on a cluster both are left out of the script
+FLUSH_TAGS_SCRIPT = """
+local deleted = {}
+local function delete_all(members)
+    for j = 1, #members, 1000 do
+        redis.call('DEL', unpack(members, j, math.min(j + 999, #members)))
+    end
+    for _, member in ipairs(members) do
+        deleted[#deleted + 1] = member
+    end
+end
+local ntags = tonumber(ARGV[1])
+local nindices = tonumber(ARGV[2])
+local nkeys = #KEYS - nindices
+for i = 1, nkeys do
+    local key = KEYS[i]
+    if i <= ntags then
+        delete_all(redis.call('SMEMBERS', key))
+        redis.call('DEL', key)
+    elseif redis.call('DEL', key) > 0 then
+        deleted[#deleted + 1] = key
+    end
+end
+for i = 1, nindices do
+    local key = KEYS[nkeys + i]
+    local score, member = ARGV[1 + 2 * i], ARGV[2 + 2 * i]
+    if redis.call('EXISTS', key) == 1 then
+        if score == 'rem' then
+            redis.call('ZREM', key, member)
+        else
+            redis.call('ZADD', key, score, member)
+        end
+    end
+end
+for i = 3 + 2 * nindices, #ARGV do
+    delete_all(redis.call('KEYS', ARGV[i]))
+end
+return deleted
+"""
+
+# filter indices are sorted sets of pks scored by pk, plus an empty
+# member scored -inf so that the index of no objects still exists.
+# ARGV[1] is 'count', 'asc' or 'desc', then the offset and limit of the
+# range, returns nil for indices that are not cached
+INDEX_RANGE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+if ARGV[1] == 'count' then
+    return redis.call('ZCARD', KEYS[1]) - 1
+end
+if ARGV[1] == 'desc' then
+    return redis.call('ZREVRANGEBYSCORE', KEYS[1], '+inf', '(-inf',
+                      'LIMIT', ARGV[2], ARGV[3])
+end
+return redis.call('ZRANGEBYSCORE', KEYS[1], '(-inf', '+inf',
+                  'LIMIT', ARGV[2], ARGV[3])
+"""
+
+# replaces the index KEYS[1] with the score and member pairs of ARGV[2..],
+# it expires after ARGV[1] seconds unless that is 0
+INDEX_BUILD_SCRIPT = """
+redis.call('DEL', KEYS[1])
+redis.call('ZADD', KEYS[1], '-inf', '')
+for i = 2, #ARGV, 1000 do
+    redis.call('ZADD', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+if tonumber(ARGV[1]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+"""
+
+# KEYS are pairs of a cache key and its write generation key, ARGV[1] is
+# the expire time and then come the generation the writer reserved and
+# the value of each pair.  A value is only set while no other writer
+# reserved its key since, keys of such conflicts are deleted.  Returns
+# the keys that were set
+WRITE_THROUGH_SCRIPT = """
+local written = {}
+for i = 1, #KEYS, 2 do
+    local generation, value = ARGV[i + 1], ARGV[i + 2]
+    if redis.call('GET', KEYS[i + 1]) == generation then
+        if tonumber(ARGV[1]) > 0 then
+            redis.call('SET', KEYS[i], value, 'EX', ARGV[1])
+        else
+            redis.call('SET', KEYS[i], value)
+        end
+        written[#written + 1] = KEYS[i]
+    else
+        redis.call('DEL', KEYS[i])
+    end
+end
+return written
+"""
+
+
+def _generation_key(key):
+    """Counter of the writers of a mangled cache key, in its slot."""
+    return key + ':gen'
+
+
+def _slot_groups(tags, keys, index_ops=()):
+    """Split mangled tag sets, keys and index updates by cluster slot,
+    multi key commands and scripts must stay within one."""
+    groups = {}
+    for pos, group in ((0, tags), (1, keys)):
+        for key in group:
+            groups.setdefault(
+                key_slot(_to_bytes(key)), ([], [], []))[pos].append(key)
+    for op in index_ops:
+        groups.setdefault(
+            key_slot(_to_bytes(op[0])), ([], [], []))[2].append(op)
+    return list(groups.values())
+
+
+def _flush_args(tags, keys, index_ops, patterns=()):
+    """KEYS and ARGV of a :data:`FLUSH_TAGS_SCRIPT` call."""
+    args = [len(tags), len(index_ops)]
+    for _, score, member in index_ops:
+        args.extend((score, member))
+    return (list(tags) + list(keys) + [op[0] for op in index_ops],
+            args + list(patterns))
+
+
+def _to_bytes(key):
+    if isinstance(key, bytes):
+        return key
+    return key.encode('utf-8')
+
+
+def _index_build_args(members, expire=None):
+    args = [int(expire or 0)]
+    for score, member in members:
+        args.extend((score, member))
+    return args
+
+
+class _RedisLock(object):
+    """dogpile mutex interface of a redis lock, dogpile passes
+    ``acquire(wait)`` while the first argument of redis-py's ``acquire``
+    is ``sleep``."""
+
+    def __init__(self, lock):
+        self.lock = lock
+
+    def acquire(self, wait=True):
+        return self.lock.acquire(blocking=wait)
+
+    def release(self):
+        try:
+            self.lock.release()
+        except LockError:
+            # held past its timeout, the value got created anyway
+            pass
 
 
 class ExtendRedisBackend(RedisBackend):
     def __init__(self, arguments):
         self.key_mangler = arguments.pop('key_mangler', None)
+        self.invalidation_mode = arguments.pop('invalidation_mode', 'keys')
+        self.serializer = make_serializer(arguments.pop('serializer', None))
+        # compressed entries are read whether or not writes compress, as
+        # nodes may disagree on the setting while it is being changed
+        self.serializer = CompressingSerializer(
+            self.serializer, arguments.pop('compression', None) or None,
+            arguments.pop('compression_threshold', 4096),
+            arguments.pop('compression_level', None))
+        #: XFetch beta of early recomputes, 0 turns them off
+        self.xfetch_beta = arguments.pop('xfetch_beta', 0)
+        #: seconds empty object lookups and filter results are cached for,
+        #: ``None`` caches them as long as any other value
+        self.negative_expiration_time = arguments.pop(
+            'negative_expiration_time', None)
+        # kept for clients created next to this one, e.g. for asyncio
+        self.cache_url = arguments.pop('cache_url', None) or \
+            arguments.get('url')
+        #: talk to a redis cluster, keys must be hash tagged by object
+        self.cluster = arguments.pop('cluster', False)
+        #: replicas serving ``get`` and ``get_multi``
+        self.replicas = ReplicaSet.from_urls(
+            arguments.pop('read_urls', None),
+            arguments.pop('read_strategy', 'round_robin'))
+        #: seconds reads stay on the primary after an invalidation
+        self.read_pin_seconds = arguments.pop('read_pin_seconds', 2)
         super(ExtendRedisBackend, self).__init__(arguments)
+        self._flush_tags = self.client.register_script(FLUSH_TAGS_SCRIPT)
+        self._index_range = self.client.register_script(INDEX_RANGE_SCRIPT)
+        self._index_build = self.client.register_script(INDEX_BUILD_SCRIPT)
+        self._write_through = self.client.register_script(
+            WRITE_THROUGH_SCRIPT)
+
+    def _create_client(self):
+        if not self.cluster:
+            return super(ExtendRedisBackend, self)._create_client()
+        if RedisCluster is None:
+            raise ImportError('REDICA_CACHE_CLUSTER needs redis-py 4.1+')
+        return RedisCluster.from_url(self.url)
+
+    def get_mutex(self, key):
+        mutex = super(ExtendRedisBackend, self).get_mutex(key)
+        if mutex is not None:
+            return _RedisLock(mutex)
+
+    def _invalidated(self, keys):
+        evict_memo(keys)
+        if self.replicas:
+            pin_primary(self.read_pin_seconds)
+
+    def get(self, key):
+        return self._loads(self.get_serialized(key))
+
+    def get_multi(self, keys):
+        return [self._loads(v) for v in self.get_serialized_multi(keys)]
+
+    def get_serialized(self, key):
+        """The stored bytes of ``key``, ``None`` when it is not cached."""
+        value = self.replicas.read(self.client, 'get', key)
+        if stats.enabled:
+            stats.round_trip(bytes_in=len(value) if value else 0)
+        return value
+
+    def get_serialized_multi(self, keys):
+        if not keys:
+            return []
+        if self.cluster:
+            # one MGET per slot, sent to all nodes before reading replies
+            values = self.client.mget_nonatomic(keys)
+        else:
+            values = self.replicas.read(self.client, 'mget', keys)
+        if stats.enabled:
+            stats.round_trip(bytes_in=sum(len(v) for v in values if v))
+        return values
+
+    def _loads(self, value):
+        if value is None:
+            return NO_VALUE
+        return self.serializer.loads(value)
+
+    def set(self, key, value):
+        value = self.serializer.dumps(value)
+        self.client.set(key, value, ex=self.redis_expiration_time or None)
+        if stats.enabled:
+            stats.round_trip(bytes_out=len(value))
+
+    def set_multi(self, mapping):
+        ppl = self.client.pipeline(transaction=False)
+        size = 0
+        for key, value in mapping.items():
+            value = self.serializer.dumps(value)
+            size += len(value)
+            ppl.set(key, value, ex=self.redis_expiration_time or None)
+        ppl.execute()
+        if stats.enabled:
+            stats.round_trip(bytes_out=size)
+
+    def delete(self, key):
+        self.delete_multi([key])
+
+    def delete_multi(self, keys):
+        if not keys:
+            return
+        deleted = self.client.delete(*keys)
+        self._invalidated(keys)
+        if stats.enabled:
+            stats.round_trip()
+            stats.incr('keys_deleted', deleted)
+
+    def expire(self, keys, seconds, raw=False):
+        """Shorten the time to live of cache keys, pipelined."""
+        keys = self._mangle(keys, raw)
+        if not keys:
+            return
+        ppl = self.client.pipeline(transaction=False)
+        for key in keys:
+            ppl.expire(key, seconds)
+        ppl.execute()
+        if stats.enabled:
+            stats.round_trip()
+
+    def _mangle(self, keys, raw):
+        if raw or not self.key_mangler:
+            return list(keys)
+        return [self.key_mangler(k) for k in keys]
 
     def keys(self, pattern, raw=False):
         if not raw and self.key_mangler:
             pattern = self.key_mangler(pattern)
+        if stats.enabled:
+            stats.round_trip()
         return self.client.keys(pattern)
 
+    def scan_keys(self, pattern, raw=False, count=1000):
+        if not raw and self.key_mangler:
+            pattern = self.key_mangler(pattern)
+        return self._scan(pattern, count)[0]
+
+    def _scan(self, pattern, count=1000):
+        if self.cluster:
+            # the cluster client walks the cursors of every node
+            keys = list(self.client.scan_iter(match=pattern, count=count))
+            if stats.enabled:
+                stats.round_trip()
+            return keys, 1
+
+        keys, cursor, round_trips = [], None, 0
+        while cursor != 0:
+            cursor, batch = self.client.scan(
+                cursor or 0, match=pattern, count=count)
+            keys.extend(batch)
+            round_trips += 1
+            if stats.enabled:
+                stats.round_trip()
+        return keys, round_trips
+
     def pipeline(self):
+        if self.cluster:
+            return self.client.pipeline(transaction=False)
         return self.client.pipeline()
 
+    def tag(self, tag, keys, raw=False):
+        """Add cache keys to a tag set, the set lives at least as long
+        as its newest member."""
+        self.tag_multi({tag: keys}, raw)
+
+    def tag_multi(self, mapping, raw=False):
+        """:meth:`tag` for a dict of tag sets and their keys, in a single
+        round trip."""
+        ppl = self.client.pipeline(transaction=False)
+        for tag, keys in mapping.items():
+            tag, = self._mangle([tag], raw)
+            keys = self._mangle(keys, raw)
+            if not keys:
+                continue
+            ppl.sadd(tag, *keys)
+            if self.redis_expiration_time:
+                ppl.expire(tag, self.redis_expiration_time)
+        if not len(ppl):
+            return
+        ppl.execute()
+        if stats.enabled:
+            stats.round_trip()
+
+    def invalidate_tags(self, tags, keys=(), raw=False, patterns=(),
+                        index_ops=()):
+        """Atomically delete the members of the tag sets, the sets
+        themselves, the extra keys and the keys matching ``patterns`` and
+        apply the ``(index, score, member)`` updates of filter indices in
+        a single round trip, returns the deleted cache keys."""
+        return self._flush(
+            self._mangle(tags, raw), self._mangle(keys, raw),
+            self._mangle(patterns, raw), self._mangle_ops(index_ops, raw))[0]
+
+    def _mangle_ops(self, index_ops, raw):
+        if raw or not self.key_mangler:
+            return list(index_ops)
+        return [(self.key_mangler(key), score, member)
+                for key, score, member in index_ops]
+
+    def _flush(self, tags, keys, patterns=(), index_ops=()):
+        """Run the flush script on mangled keys, once per cluster slot,
+        returns the deleted keys and the number of calls.  On a cluster
+        the tag sets are read and cleaned up by the client, before and
+        after the script."""
+        if not tags and not keys and not patterns and not index_ops:
+            return [], 0
+        calls, tagged = 0, {}
+        if not self.cluster:
+            groups = [(tags, keys, index_ops)]
+        elif patterns:
+            raise ValueError('KEYS patterns are not supported on a cluster')
+        else:
+            if tags:
+                tagged = self._tag_members(tags)
+                calls += 1
+            members = [m for tag in tags for m in tagged[tag]]
+            groups = _slot_groups([], list(keys) + members, index_ops)
+
+        deleted = []
+        for group_tags, group_keys, group_ops in groups:
+            script_keys, args = _flush_args(
+                group_tags, group_keys, group_ops, patterns)
+            deleted.extend(self._flush_tags(keys=script_keys, args=args))
+        calls += len(groups)
+        if any(tagged.values()):
+            self._untag(tagged)
+            calls += 1
+        self._invalidated(list(keys) + deleted)
+        if stats.enabled:
+            for _ in range(calls):
+                stats.round_trip()
+            stats.incr('keys_deleted', len(deleted))
+        return deleted, calls
+
+    def _tag_members(self, tags):
+        """Members of the tag sets.  A cluster script may only touch the
+        KEYS it is passed, so the members are read ahead of the flush and
+        passed to it as plain keys."""
+        ppl = self.client.pipeline(transaction=False)
+        for tag in tags:
+            ppl.smembers(tag)
+        return dict(zip(tags, ppl.execute()))
+
+    def _untag(self, tagged):
+        """Remove the flushed members from their tag sets, members tagged
+        since :meth:`_tag_members` read them stay."""
+        ppl = self.client.pipeline(transaction=False)
+        for tag, members in tagged.items():
+            if members:
+                ppl.srem(tag, *members)
+        ppl.execute()
+
+    def invalidate(self, keys=(), patterns=(), index_ops=()):
+        """Delete cache keys and the keys matching the wildcard
+        ``patterns``, resolved as the ``invalidation_mode`` says, and
+        update filter indices with a single script call.  Returns the
+        deleted keys and the number of round trips it took."""
+        keys = self._mangle(keys, False)
+        index_ops = self._mangle_ops(index_ops, False)
+        if self.invalidation_mode == 'keys':
+            return self._flush(
+                [], keys, self._mangle(patterns, False), index_ops)
+
+        tags = [_tag_key_from_key(p) for p in patterns]
+        tags = self._mangle([t for t in tags if t], False)
+        round_trips = 0
+        if self.invalidation_mode == 'migrate':
+            # keys cached before tagging was enabled are not in any set
+            for p in self._mangle(patterns, False):
+                scanned, scans = self._scan(p)
+                keys.extend(scanned)
+                round_trips += scans
+        deleted, calls = self._flush(tags, keys, index_ops=index_ops)
+        return deleted, round_trips + calls
+
+    def index_range(self, key, offset=None, limit=None, desc=False):
+        """Members of a filter index ordered by score, ``None`` when the
+        index is not cached."""
+        key, = self._mangle([key], False)
+        members = self._index_range(keys=[key], args=[
+            'desc' if desc else 'asc', offset or 0,
+            -1 if limit is None else limit])
+        if stats.enabled:
+            stats.round_trip(
+                bytes_in=sum(len(m) for m in members) if members else 0)
+        return members
+
+    def index_count(self, key):
+        """Size of a filter index, ``None`` when it is not cached."""
+        key, = self._mangle([key], False)
+        count = self._index_range(keys=[key], args=['count', 0, 0])
+        if stats.enabled:
+            stats.round_trip()
+        return count
+
+    def index_build(self, key, members, expire=None):
+        """Replace a filter index with ``(score, member)`` pairs."""
+        key, = self._mangle([key], False)
+        self._index_build(keys=[key], args=_index_build_args(members, expire))
+        if stats.enabled:
+            stats.round_trip()
+
+    def index_build_multi(self, mapping, expire=None):
+        """:meth:`index_build` for a dict of indices, pipelined."""
+        if not mapping:
+            return
+        ppl = self.client.pipeline(transaction=False)
+        for key, members in mapping.items():
+            key, = self._mangle([key], False)
+            self._index_build(
+                keys=[key], args=_index_build_args(members, expire),
+                client=ppl)
+        ppl.execute()
+        if stats.enabled:
+            stats.round_trip()
+
+    def reserve_writes(self, keys):
+        """Start writing ``keys`` through, returns the generation of each
+        key to pass to :meth:`write_through`.  A later reservation of a
+        key makes the earlier writes of it fail."""
+        keys = self._mangle(keys, False)
+        if not keys:
+            return {}
+        ppl = self.client.pipeline(transaction=False)
+        for key in keys:
+            ppl.incr(_generation_key(key))
+            if self.redis_expiration_time:
+                ppl.expire(_generation_key(key), self.redis_expiration_time)
+        results = ppl.execute()
+        if stats.enabled:
+            stats.round_trip()
+        step = 2 if self.redis_expiration_time else 1
+        return dict(zip(keys, results[::step]))
+
+    def write_through(self, mapping, generations):
+        """Set the values of ``mapping`` unless another writer reserved
+        their keys after :meth:`reserve_writes` returned ``generations``,
+        those keys and reserved ones missing from ``mapping`` are
+        deleted.  Returns the keys that were set and the number of calls."""
+        values = dict(zip(self._mangle(mapping, False), mapping.values()))
+        missing = [k for k in generations if k not in values]
+        calls = 0
+        if missing:
+            self.client.delete(*missing)
+            calls += 1
+            if stats.enabled:
+                stats.round_trip()
+
+        keys = [k for k in generations if k in values]
+        if not keys:
+            groups = []
+        elif self.cluster:
+            groups = _slot_groups([], keys)
+        else:
+            groups = [([], keys, [])]
+        written, size = [], 0
+        for _, group_keys, _ in groups:
+            script_keys, args = [], [int(self.redis_expiration_time or 0)]
+            for key in group_keys:
+                value = self.serializer.dumps(values[key])
+                size += len(value)
+                script_keys.extend((key, _generation_key(key)))
+                args.extend((generations[key], value))
+            written.extend(self._write_through(keys=script_keys, args=args))
+        self._invalidated(list(generations))
+        if stats.enabled:
+            for pos, _ in enumerate(groups):
+                stats.round_trip(bytes_out=0 if pos else size)
+            stats.incr('write_throughs', len(written))
+            stats.incr('write_through_conflicts', len(keys) - len(written))
+        return written, calls + len(groups)
+
 
 def make_redis_region(app, prefix):
     expiration_time = app.config.setdefault(
         'REDICA_DEFAULT_EXPIRE', 3600)
-    key_mangler = functools.partial(_md5_key_mangler, prefix)
     redica_cache_url = app.config.get('REDICA_CACHE_URL')
+    invalidation_mode = app.config.setdefault(
+        'REDICA_INVALIDATION_MODE', 'keys')
+    if invalidation_mode not in INVALIDATION_MODES:
+        raise ValueError(
+            'REDICA_INVALIDATION_MODE must be one of %s' %
+            ', '.join(INVALIDATION_MODES))
+
+    cluster = app.config.setdefault('REDICA_CACHE_CLUSTER', False)
+    read_urls = app.config.setdefault('REDICA_CACHE_READ_URLS', None)
+    if cluster:
+        if invalidation_mode == 'keys':
+            raise ValueError(
+                'REDICA_CACHE_CLUSTER needs the tags or migrate '
+                'REDICA_INVALIDATION_MODE')
+        if read_urls:
+            raise ValueError(
+                'REDICA_CACHE_READ_URLS is not supported with '
+                'REDICA_CACHE_CLUSTER')
+        key_mangler = functools.partial(_hash_tag_key_mangler, prefix)
+    else:
+        key_mangler = functools.partial(_md5_key_mangler, prefix)
+    max_staleness = app.config.setdefault('REDICA_REFRESH_MAX_STALENESS', 30)
     cfg = {
         'backend': 'extended_redis_backend',
         'expiration_time': expiration_time,
         'arguments': {
-            'redis_expiration_time': expiration_time + 30,
+            'redis_expiration_time': expiration_time + max_staleness,
             'key_mangler': key_mangler,
+            'cache_url': redica_cache_url,
+            'invalidation_mode': invalidation_mode,
+            'serializer': app.config.setdefault(
+                'REDICA_SERIALIZER', 'pickle'),
+            'xfetch_beta': app.config.setdefault('REDICA_XFETCH_BETA', 0),
+            'negative_expiration_time': app.config.setdefault(
+                'REDICA_NEGATIVE_CACHE_TTL', None),
         }
     }
-    if app.config.get('REDICA_CACHE_POOL_BLOCKING', True):
+    if app.config.get('REDICA_DISTRIBUTED_LOCK', False):
+        # a value is created by one process at a time across all nodes,
+        # the lock expires should its holder die
+        cfg['arguments'].update(
+            distributed_lock=True,
+            lock_timeout=app.config.get('REDICA_LOCK_TIMEOUT', 30),
+            lock_sleep=app.config.get('REDICA_LOCK_SLEEP', 0.1),
+            # background refreshes release it from another thread
+            thread_local_lock=False)
+    compression = app.config.setdefault('REDICA_COMPRESSION', None)
+    if compression:
+        cfg['arguments'].update(
+            compression=compression,
+            compression_threshold=app.config.setdefault(
+                'REDICA_COMPRESSION_THRESHOLD', 4096),
+            compression_level=app.config.get('REDICA_COMPRESSION_LEVEL'))
+    if read_urls:
+        cfg['arguments'].update(
+            read_urls=read_urls,
+            read_strategy=app.config.setdefault(
+                'REDICA_CACHE_READ_STRATEGY', 'round_robin'),
+            read_pin_seconds=app.config.setdefault(
+                'REDICA_READ_PIN_SECONDS', 2))
+    if cluster:
+        cfg['arguments'].update(cluster=True, url=redica_cache_url)
+    elif app.config.get('REDICA_CACHE_CONNECTION_POOL'):
+        # a ready made pool, e.g. of an in-process redis stand-in
+        cfg['arguments']['connection_pool'] = \
+            app.config['REDICA_CACHE_CONNECTION_POOL']
+    elif app.config.get('REDICA_CACHE_POOL_BLOCKING', True):
         cfg['arguments']['connection_pool'] = BlockingConnectionPool.from_url(
             redica_cache_url)
     else:
         cfg['arguments']['url'] = redica_cache_url
 
+    if app.config.get('REDICA_L1_ENABLED', False):
+        cfg['wrap'] = [LocalCacheProxy(
+            ':'.join([prefix, 'l1-evict']),
+            max_entries=app.config.get('REDICA_L1_MAX_ENTRIES', 1024),
+            max_bytes=app.config.get('REDICA_L1_MAX_BYTES', 16 * 1024 * 1024),
+            ttl=app.config.get('REDICA_L1_TTL', 30))]
+
+    async_creation_runner = None
+    if app.config.get('REDICA_REFRESH_ASYNC', False):
+        async_creation_runner = RefreshRunner(
+            app, workers=app.config.get('REDICA_REFRESH_WORKERS', 4),
+            max_queue=app.config.get('REDICA_REFRESH_QUEUE_SIZE', 100))
+
     return dict(
-        default=make_region().configure(**cfg)
+        default=make_region(
+            async_creation_runner=async_creation_runner).configure(**cfg)
     )
 
 
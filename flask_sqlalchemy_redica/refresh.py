@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_sqlalchemy_redica.refresh
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Stale-while-revalidate for cached queries, enabled per region with
+    ``REDICA_REFRESH_ASYNC``.  Once a cached query result expired the
+    stale value keeps being served while a thread pool runs the query
+    again, instead of the request that got the dogpile mutex.
+
+    ``REDICA_REFRESH_WORKERS``
+        refresh threads per process, default 4
+    ``REDICA_REFRESH_QUEUE_SIZE``
+        refreshes that may wait for a thread, further expired keys are
+        served stale and retried by a later request, default 100
+    ``REDICA_REFRESH_MAX_STALENESS``
+        seconds a value is kept in redis past its expiration time,
+        older values are gone and rebuilt inline, default 30
+
+    Only ``FromCache`` queries (``get_or_create``) refresh in the
+    background, the query runs again on a session of its own.
+"""
+from __future__ import absolute_import
+
+import logging
+import os
+import threading
+from timeit import default_timer
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .stats import stats
+
+logger = logging.getLogger(__name__)
+
+_refresh_local = threading.local()
+
+
+def refresh_session():
+    """Session of the refresh running in the current thread, if any."""
+    return getattr(_refresh_local, 'session', None)
+
+
+class RefreshRunner(object):
+    """``async_creation_runner`` of a dogpile region, regenerates values
+    in a bounded pool of daemon threads started on first use in each
+    process."""
+
+    def __init__(self, app, workers=4, max_queue=100):
+        self.app = app
+        self.workers = workers
+        self.max_queue = max_queue
+        #: ``refreshed``, ``dropped`` (queue full) and ``failed`` values
+        self.stats = dict(refreshed=0, dropped=0, failed=0)
+        self.queue = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def depth(self):
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            self.queue = queue.Queue(self.max_queue)
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._run, name='redica-refresh-%d' % i)
+                thread.daemon = True
+                thread.start()
+            self._pid = pid
+
+    def __call__(self, region, key, creator, mutex):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait((region, key, creator, mutex))
+        except queue.Full:
+            mutex.release()
+            self.stats['dropped'] += 1
+            if stats.enabled:
+                stats.incr('refresh_dropped')
+        if stats.enabled:
+            stats.gauge('refresh_queue_depth', self.depth)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self._refresh(*job)
+            finally:
+                self.queue.task_done()
+
+    def _refresh(self, region, key, creator, mutex):
+        start = default_timer()
+        try:
+            with self.app.app_context():
+                redica = self.app.extensions['sqlalchemy_redica']
+                session = redica.create_scoped_session()
+                _refresh_local.session = session()
+                try:
+                    region.set(key, creator())
+                finally:
+                    _refresh_local.session = None
+                    session.remove()
+        except Exception:
+            self.stats['failed'] += 1
+            logger.exception('Failed to refresh cache key %s', key)
+        else:
+            self.stats['refreshed'] += 1
+            if stats.enabled:
+                stats.timing('refresh_seconds', default_timer() - start)
+        finally:
+            mutex.release()
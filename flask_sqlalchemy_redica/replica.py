@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_sqlalchemy_redica.replica
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Cache reads from redis replicas.  ``get`` and ``get_multi`` of a region
+    go to one of ``REDICA_CACHE_READ_URLS``, sets, deletes, tags and locks
+    stay on ``REDICA_CACHE_URL``.
+
+    ``REDICA_CACHE_READ_URLS``
+        replica urls, a list or a comma separated string
+    ``REDICA_CACHE_READ_STRATEGY``
+        ``round_robin`` (default) or ``latency``, which reads from the
+        replica with the lowest average read time
+    ``REDICA_READ_PIN_SECONDS``
+        once an app context invalidated cache keys its reads go to the
+        primary for that many seconds, so that it doesn't read entries
+        a replica didn't delete yet, default 2
+
+    A replica that fails a read is skipped for the call, which is retried
+    on the primary.
+"""
+from __future__ import absolute_import
+
+import itertools
+import random
+import threading
+import time
+from timeit import default_timer
+
+from redis import BlockingConnectionPool, StrictRedis
+from redis.exceptions import ConnectionError, TimeoutError
+
+try:
+    from flask import _app_ctx_stack as stack
+except ImportError:
+    from flask import _request_ctx_stack as stack
+
+from .stats import stats
+
+READ_STRATEGIES = ('round_robin', 'latency')
+
+_pin_local = threading.local()
+
+
+def pin_primary(seconds):
+    """Read from the primary in the current app context (or thread, outside
+    of one) for the next ``seconds``."""
+    until = time.time() + seconds
+    ctx = stack.top
+    if ctx is not None:
+        ctx.redica_primary_until = max(
+            until, getattr(ctx, 'redica_primary_until', 0))
+    else:
+        _pin_local.until = max(until, getattr(_pin_local, 'until', 0))
+
+
+def primary_pinned():
+    ctx = stack.top
+    if ctx is not None:
+        until = getattr(ctx, 'redica_primary_until', 0)
+    else:
+        until = getattr(_pin_local, 'until', 0)
+    return until > time.time()
+
+
+def _parse_urls(urls):
+    if not urls:
+        return []
+    if isinstance(urls, (list, tuple)):
+        return list(urls)
+    return [url.strip() for url in urls.split(',') if url.strip()]
+
+
+class ReplicaSet(object):
+    """Picks the client of a cache read."""
+
+    #: weight of the latest read in the moving average of read times
+    decay = 0.2
+    #: share of ``latency`` reads that go to a random replica, so that the
+    #: read times of the slower ones stay current
+    explore = 0.05
+
+    def __init__(self, clients, strategy='round_robin'):
+        if strategy not in READ_STRATEGIES:
+            raise ValueError(
+                'REDICA_CACHE_READ_STRATEGY must be one of %s' %
+                ', '.join(READ_STRATEGIES))
+        self.clients = list(clients)
+        self.strategy = strategy
+        #: moving average of the read seconds of each client
+        self.latency = [0.0] * len(self.clients)
+        self._next = itertools.cycle(range(len(self.clients)))
+
+    @classmethod
+    def from_urls(cls, urls, strategy='round_robin'):
+        return cls([
+            StrictRedis(connection_pool=BlockingConnectionPool.from_url(url))
+            for url in _parse_urls(urls)], strategy)
+
+    def __len__(self):
+        return len(self.clients)
+
+    def _pick(self):
+        if self.strategy == 'round_robin' or random.random() < self.explore:
+            return next(self._next)
+        return min(range(len(self.clients)), key=self.latency.__getitem__)
+
+    def read(self, primary, command, *args):
+        """Run a read command on a replica, or on ``primary`` while the
+        context is pinned to it or the replica failed."""
+        if not self.clients or primary_pinned():
+            return getattr(primary, command)(*args)
+
+        index = self._pick()
+        start = default_timer()
+        try:
+            result = getattr(self.clients[index], command)(*args)
+        except (ConnectionError, TimeoutError):
+            self.latency[index] = float('inf')
+            return getattr(primary, command)(*args)
+
+        elapsed = default_timer() - start
+        if self.latency[index] in (0.0, float('inf')):
+            self.latency[index] = elapsed
+        else:
+            self.latency[index] += self.decay * (elapsed - self.latency[index])
+        if stats.enabled:
+            stats.incr('replica_reads')
+        return result
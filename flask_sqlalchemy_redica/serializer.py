@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import datetime
+import decimal
+import zlib
+
+from dogpile.cache.api import CachedValue
+from sqlalchemy import inspect
+from sqlalchemy.orm.attributes import instance_state
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    from sqlalchemy.util._collections import AbstractKeyedTuple, \
+        lightweight_named_tuple
+except ImportError:
+    # rows of sqlalchemy 1.4+ are pickled as a whole
+    AbstractKeyedTuple = lightweight_named_tuple = None
+
+from .stats import stats
+from .utils import _import_model
+
+try:
+    _PRIMITIVES = (type(None), bool, int, long, float, str, unicode)
+    _string_types = basestring
+except NameError:
+    _PRIMITIVES = (type(None), bool, int, float, bytes, str)
+    _string_types = str
+
+_FORMAT_VERSION = 1
+
+# first byte of a pickle of protocol 2 or higher, msgpack encoded values
+# start with the array of the row format instead
+_PICKLE_PROTO = b'\x80'
+
+# kinds of reduced values, primitives are stored as they are
+_PICKLED, _INSTANCE, _ROW = range(3)
+
+_PICKLE_EXT, _DATETIME_EXT, _DATE_EXT, _DECIMAL_EXT = range(1, 5)
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, datetime.datetime):
+        if obj.tzinfo is None:
+            return msgpack.ExtType(_DATETIME_EXT, msgpack.packb([
+                obj.year, obj.month, obj.day, obj.hour, obj.minute,
+                obj.second, obj.microsecond]))
+    elif isinstance(obj, datetime.date):
+        return msgpack.ExtType(_DATE_EXT, msgpack.packb(
+            [obj.year, obj.month, obj.day]))
+    elif isinstance(obj, decimal.Decimal):
+        return msgpack.ExtType(_DECIMAL_EXT, str(obj).encode('ascii'))
+    return msgpack.ExtType(
+        _PICKLE_EXT, pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+
+def _msgpack_ext_hook(code, data):
+    if code == _DATETIME_EXT:
+        return datetime.datetime(*msgpack.unpackb(data))
+    if code == _DATE_EXT:
+        return datetime.date(*msgpack.unpackb(data))
+    if code == _DECIMAL_EXT:
+        return decimal.Decimal(data.decode('ascii'))
+    if code == _PICKLE_EXT:
+        return pickle.loads(data)
+    return msgpack.ExtType(code, data)
+
+
+class PickleSerializer(object):
+    """Pickles cached values as they are, the default."""
+
+    def dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class RowSerializer(object):
+    """Stores only the loaded column values of mapped instances plus the
+    model they belong to, instead of pickling the instances with their
+    ``_sa_instance_state``.  Instances are rebuilt as detached objects
+    on load, ready for ``merge_result``.
+
+    Handles results of single entities, of mixed entity and column rows
+    and plain values like pk lists.  Relationships loaded on cached
+    instances are not kept, they lazy load again once merged.  Values are
+    encoded with msgpack when it is installed, anything msgpack can't
+    represent is pickled in place.  Values the :class:`PickleSerializer`
+    stored are still read.
+    """
+
+    def __init__(self, use_msgpack=True):
+        self.use_msgpack = use_msgpack and msgpack is not None
+
+    def dumps(self, value):
+        metadata = None
+        if isinstance(value, CachedValue):
+            value, metadata = value.payload, value.metadata
+
+        tables = ([], {}, [], {})
+        if isinstance(value, list):
+            payload = [self._reduce(v, tables) for v in value]
+        else:
+            payload = self._reduce(value, tables)
+
+        data = [_FORMAT_VERSION, tables[0], tables[2],
+                isinstance(value, list), payload, metadata]
+        if self.use_msgpack:
+            return msgpack.packb(
+                data, use_bin_type=True, default=_msgpack_default)
+        return pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        if data[:1] == _PICKLE_PROTO:
+            data = pickle.loads(data)
+            if isinstance(data, CachedValue):
+                # stored by the PickleSerializer before the region switched
+                return data
+        else:
+            data = msgpack.unpackb(
+                data, raw=False, ext_hook=_msgpack_ext_hook)
+
+        _, models, rows, is_list, payload, metadata = data
+        models = [self._resolve(*m) for m in models]
+        rows = [lightweight_named_tuple('result', labels)
+                for labels in rows]
+        if is_list:
+            value = [self._restore(v, models, rows) for v in payload]
+        else:
+            value = self._restore(payload, models, rows)
+
+        if metadata is not None:
+            return CachedValue(value, metadata)
+        return value
+
+    def _reduce(self, value, tables):
+        models, model_index, rows, row_index = tables
+        if isinstance(value, _PRIMITIVES):
+            return value
+
+        if AbstractKeyedTuple is not None and \
+                isinstance(value, AbstractKeyedTuple):
+            labels = getattr(value, '_real_fields', None) or \
+                getattr(value, '_labels', None)
+            if labels is not None:
+                labels = tuple(labels)
+                pos = row_index.get(labels)
+                if pos is None:
+                    pos = row_index[labels] = len(rows)
+                    rows.append(list(labels))
+                return (_ROW, pos, [self._reduce(v, tables) for v in value])
+
+        try:
+            state = instance_state(value)
+        except AttributeError:
+            return (_PICKLED, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+        mapper = state.mapper
+        pos = model_index.get(mapper)
+        if pos is None:
+            pos = model_index[mapper] = len(models)
+            models.append((mapper.class_.__module__, mapper.class_.__name__,
+                           [p.key for p in mapper.column_attrs]))
+
+        keys = models[pos][2]
+        dict_ = state.dict
+        values = [dict_.get(k) for k in keys]
+        unloaded = [i for i, k in enumerate(keys) if k not in dict_]
+        if unloaded:
+            return (_INSTANCE, pos, values, unloaded)
+        return (_INSTANCE, pos, values)
+
+    @staticmethod
+    def _resolve(module, name, keys):
+        mapper = inspect(_import_model(module, name))
+        pk_keys = [mapper.get_property_by_column(c).key
+                   for c in mapper.primary_key]
+        return mapper, keys, pk_keys
+
+    def _restore(self, item, models, rows):
+        if not isinstance(item, (list, tuple)):
+            return item
+
+        kind = item[0]
+        if kind == _PICKLED:
+            return pickle.loads(item[1])
+        if kind == _ROW:
+            return rows[item[1]](
+                [self._restore(v, models, rows) for v in item[2]])
+
+        mapper, keys, pk_keys = models[item[1]]
+        unloaded = set(item[3]) if len(item) > 3 else ()
+
+        obj = mapper.class_manager.new_instance()
+        state = instance_state(obj)
+        dict_ = state.dict
+        for pos, (key, value) in enumerate(zip(keys, item[2])):
+            if pos not in unloaded:
+                dict_[key] = value
+        state.key = mapper.identity_key_from_primary_key(
+            [dict_.get(k) for k in pk_keys])
+        return obj
+
+
+class _Zlib(object):
+    code = b'z'
+
+    def __init__(self, level=None):
+        self.level = 6 if level is None else level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class _Lz4(object):
+    code = b'l'
+
+    def __init__(self, level=None):
+        self.level = level or 0
+
+    def compress(self, data):
+        return lz4.frame.compress(data, compression_level=self.level)
+
+    def decompress(self, data):
+        return lz4.frame.decompress(data)
+
+
+CODECS = dict(zlib=_Zlib, lz4=_Lz4)
+
+# 0xc1 starts neither a pickle nor a msgpack value, it is followed by the
+# codec code
+_COMPRESSED = b'\xc1'
+
+
+class CompressingSerializer(object):
+    """Compresses what ``serializer`` dumps once it is ``threshold`` bytes
+    or larger.  Compressed values start with a two byte header, values
+    without it are loaded as they are, so entries cached before
+    compression was turned on stay readable.  A ``None`` codec writes
+    values uncompressed but still reads compressed ones, so entries
+    cached before compression was turned off stay readable too."""
+
+    def __init__(self, serializer, codec='zlib', threshold=4096, level=None):
+        if codec is not None and codec not in CODECS:
+            raise ValueError(
+                'REDICA_COMPRESSION must be one of %s' %
+                ', '.join(sorted(CODECS)))
+        if codec == 'lz4' and lz4 is None:
+            raise ValueError('REDICA_COMPRESSION lz4 needs the lz4 package')
+        self.serializer = serializer
+        self.codec = CODECS[codec](level) if codec else None
+        self.threshold = threshold
+        # any installed codec can be read, e.g. after switching codecs
+        self._codecs = dict(
+            (c.code, c()) for c in CODECS.values()
+            if c is not _Lz4 or lz4 is not None)
+
+    def dumps(self, value):
+        data = self.serializer.dumps(value)
+        if self.codec is None or len(data) < self.threshold:
+            return data
+        compressed = _COMPRESSED + self.codec.code + \
+            self.codec.compress(data)
+        if len(compressed) >= len(data):
+            return data
+        if stats.enabled:
+            stats.incr('compressed_values')
+            stats.incr('compression_bytes_in', len(data))
+            stats.incr('compression_bytes_out', len(compressed))
+        return compressed
+
+    def loads(self, data):
+        if data[:1] == _COMPRESSED:
+            data = self._codecs[data[1:2]].decompress(data[2:])
+        return self.serializer.loads(data)
+
+
+SERIALIZERS = dict(
+    pickle=PickleSerializer,
+    rows=RowSerializer,
+)
+
+
+def make_serializer(serializer):
+    """Return a serializer from its name or an object with ``dumps``
+    and ``loads``."""
+    if serializer is None:
+        return PickleSerializer()
+    if isinstance(serializer, _string_types):
+        try:
+            return SERIALIZERS[serializer]()
+        except KeyError:
+            raise ValueError(
+                'REDICA_SERIALIZER must be one of %s or a serializer' %
+                ', '.join(sorted(SERIALIZERS)))
+    return serializer
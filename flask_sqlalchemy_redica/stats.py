@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_sqlalchemy_redica.stats
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Cache metrics.  Instrumented code reports to the module level
+    :data:`stats`, which fans out to the registered sinks::
+
+        sink = MemorySink()
+        stats.add_sink(sink)
+        ...
+        print(sink.prometheus_text())
+
+    Nothing is collected while no sink is registered, instrumented code
+    only checks ``stats.enabled`` then.
+
+    Metrics, labeled by ``region`` and ``model`` where known:
+
+    ``cache_hits``, ``cache_misses``, ``cache_creation_seconds``
+        lookups of cached queries, ``Cache.filter`` indices and
+        ``Cache.get_many`` objects
+    ``redis_round_trips``, ``redis_bytes_in``, ``redis_bytes_out``
+        redis calls of the redica backend
+    ``compressed_values``, ``compression_bytes_in``,
+    ``compression_bytes_out``
+        values compressed by ``REDICA_COMPRESSION``, their size before and
+        after, the ratio is ``bytes_out / bytes_in``
+    ``memo_hits``
+        cached query results served by the ``REDICA_REQUEST_MEMO``, each
+        one a redis round trip saved
+    ``replica_reads``
+        reads served by a ``REDICA_CACHE_READ_URLS`` replica
+    ``invalidations``, ``keys_deleted``, ``cache_flush_seconds``
+        invalidations flushed on commit, cache keys they deleted and the
+        time spent in ``cache_flush``
+    ``write_throughs``, ``write_through_conflicts``
+        objects of ``cache_write_through`` models rewritten on commit, and
+        the ones deleted instead as another writer reserved them
+    ``refresh_seconds``, ``refresh_queue_depth``, ``refresh_dropped``
+        background refreshes of stale query results
+"""
+from __future__ import absolute_import
+
+import threading
+
+from blinker import signal
+
+try:
+    from flask import _app_ctx_stack as stack
+except ImportError:
+    from flask import _request_ctx_stack as stack
+
+#: sent by :class:`SignalSink` for every metric, with the metric name as
+#: sender and ``kind``, ``value`` and ``labels`` as keyword arguments
+metric_signal = signal('flask_sqlalchemy_redica_metric')
+
+
+class Stats(object):
+    """Dispatches metrics to sinks, a sink has ``incr(name, value,
+    labels)``, ``timing(name, seconds, labels)`` and ``gauge(name, value,
+    labels)`` methods."""
+
+    def __init__(self):
+        self.sinks = []
+        #: checked by instrumented code before collecting anything
+        self.enabled = False
+
+    def add_sink(self, sink):
+        if sink not in self.sinks:
+            self.sinks.append(sink)
+        self.enabled = True
+
+    def remove_sink(self, sink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+        self.enabled = bool(self.sinks)
+
+    def incr(self, name, value=1, **labels):
+        for sink in self.sinks:
+            sink.incr(name, value, labels)
+
+    def timing(self, name, seconds, **labels):
+        for sink in self.sinks:
+            sink.timing(name, seconds, labels)
+
+    def gauge(self, name, value, **labels):
+        for sink in self.sinks:
+            sink.gauge(name, value, labels)
+
+    def round_trip(self, bytes_in=0, bytes_out=0):
+        self.incr('redis_round_trips')
+        if bytes_in:
+            self.incr('redis_bytes_in', bytes_in)
+        if bytes_out:
+            self.incr('redis_bytes_out', bytes_out)
+
+
+#: the instance instrumented code reports to
+stats = Stats()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class MemorySink(object):
+    """Aggregates counters and timings in process, e.g. to be scraped
+    with :meth:`prometheus_text`."""
+
+    def __init__(self):
+        self.counters = {}
+        #: (count, total seconds) by name and labels
+        self.timings = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name, value, labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def timing(self, name, seconds, labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            count, total = self.timings.get(key, (0, 0.0))
+            self.timings[key] = (count + 1, total + seconds)
+
+    def gauge(self, name, value, labels):
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def value(self, name, **labels):
+        """Counter value, summed over the labels not given."""
+        return sum(v for (n, l), v in self.counters.items()
+                   if n == name and set(labels.items()) <= set(l))
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.timings.clear()
+            self.gauges.clear()
+
+    def prometheus_text(self, namespace='redica'):
+        """Render the metrics in the prometheus text exposition format,
+        counters as ``_total`` and timings as summaries."""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            timings = sorted(self.timings.items())
+            gauges = sorted(self.gauges.items())
+
+        lines = []
+        last = None
+        for (name, labels), value in counters:
+            metric = '%s_%s_total' % (namespace, name)
+            if metric != last:
+                lines.append('# TYPE %s counter' % metric)
+                last = metric
+            lines.append('%s%s %s' % (metric, _format_labels(labels), value))
+        for (name, labels), (count, total) in timings:
+            metric = '%s_%s' % (namespace, name)
+            if metric != last:
+                lines.append('# TYPE %s summary' % metric)
+                last = metric
+            labels = _format_labels(labels)
+            lines.append('%s_count%s %d' % (metric, labels, count))
+            lines.append('%s_sum%s %r' % (metric, labels, total))
+        for (name, labels), value in gauges:
+            metric = '%s_%s' % (namespace, name)
+            if metric != last:
+                lines.append('# TYPE %s gauge' % metric)
+                last = metric
+            lines.append('%s%s %s' % (metric, _format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels)
+
+
+class SignalSink(object):
+    """Sends every metric as :data:`metric_signal`."""
+
+    def incr(self, name, value, labels):
+        metric_signal.send(name, kind='counter', value=value, labels=labels)
+
+    def timing(self, name, seconds, labels):
+        metric_signal.send(name, kind='timing', value=seconds, labels=labels)
+
+    def gauge(self, name, value, labels):
+        metric_signal.send(name, kind='gauge', value=value, labels=labels)
+
+
+class AppContextSink(object):
+    """Sums up the metrics of the current app context, without labels,
+    see :func:`context_stats`."""
+
+    def incr(self, name, value, labels):
+        ctx = stack.top
+        if ctx is None:
+            return
+        summary = _context_summary(ctx)
+        summary[name] = summary.get(name, 0) + value
+
+    def timing(self, name, seconds, labels):
+        self.incr(name, seconds, labels)
+
+    def gauge(self, name, value, labels):
+        ctx = stack.top
+        if ctx is not None:
+            _context_summary(ctx)[name] = value
+
+
+def _context_summary(ctx):
+    try:
+        return ctx.redica_stats
+    except AttributeError:
+        ctx.redica_stats = {}
+        return ctx.redica_stats
+
+
+def context_stats():
+    """Metrics summed up in the current app context (usually one request)
+    by an :class:`AppContextSink`."""
+    ctx = stack.top
+    if ctx is None:
+        return {}
+    return dict(_context_summary(ctx))
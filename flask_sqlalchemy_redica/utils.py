@@ -1,9 +1,20 @@
 # -*- coding: utf-8 -*-
 import hashlib
+import importlib
+import re
 
 from flask import current_app
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.expression import BindParameter
 from werkzeug.local import LocalProxy
 
+try:
+    text_type = unicode
+    integer_types = (int, long)
+except NameError:
+    text_type = str
+    integer_types = (int,)
+
 
 def _md5_key_mangler(prefix, key):
     if key.startswith('SELECT '):
@@ -11,21 +22,138 @@ def _md5_key_mangler(prefix, key):
     return ':'.join([prefix, key])
 
 
-def _key_from_query(query):
+_object_key_re = re.compile(r'^([^:{}]+:[^:{}]+)(:.*)?$')
+
+
+def _hash_tag_key_mangler(prefix, key):
+    """Like :func:`_md5_key_mangler`, but the ``table:pk`` head of per
+    object keys becomes a redis cluster hash tag, so that the object,
+    relationship, query and tag keys of an object share a slot."""
+    if key.startswith('SELECT '):
+        return _md5_key_mangler(prefix, key)
+    m = _object_key_re.match(key)
+    if m:
+        return u'{}:{{{}}}{}'.format(prefix, m.group(1), m.group(2) or u'')
+    return ':'.join([prefix, key])
+
+
+_tagged_key_re = re.compile(r'^([^:]+):([^:]+):(relationship|query)(?::|$)')
+
+
+def _tag_key(table, pk, kind):
+    return u'{}:{}:tags:{}'.format(table, pk, kind)
+
+
+def _tag_key_from_key(key):
+    """Return the tag set a relationship or query cache key belongs to,
+    ``None`` for any other key."""
+    m = _tagged_key_re.match(key)
+    if m:
+        return _tag_key(*m.groups())
+
+
+def _key_from_query(query, shape_key=None):
     stmt = query.with_labels().statement
+    if shape_key is None:
+        shape_key = _statement_shape(stmt)
+    if shape_key is not None:
+        key = _shaped_key_from_statement(stmt, shape_key)
+        if key is not None:
+            return key
+
     compiled = stmt.compile()
     params = compiled.params
 
     return ' '.join(
-        [unicode(compiled)] + [unicode(params[k]) for k in sorted(params)]
+        [text_type(compiled)] + [text_type(params[k]) for k in sorted(params)]
     )
 
 
-def _prefixed_key_from_query(query, prefix):
-    key = _key_from_query(query)
+def _prefixed_key_from_query(query, prefix, shape_key=None):
+    key = _key_from_query(query, shape_key)
     return ':'.join([prefix, hashlib.md5(key.encode('utf-8')).hexdigest()])
 
 
+#: compiled sql and bind parameter names by (shape, number of binds),
+#: ``None`` marks shapes whose parameters can't be extracted safely
+_query_shapes = {}
+_MAX_QUERY_SHAPES = 2000
+
+
+def _statement_shape(stmt):
+    """Structural cache key of a statement where sqlalchemy can build one
+    without compiling (1.4+), otherwise ``None``."""
+    generate = getattr(stmt, '_generate_cache_key', None)
+    if generate is not None:
+        cache_key = generate()
+        if cache_key is not None:
+            return cache_key.key
+
+
+def _statement_binds(stmt):
+    binds, seen = [], set()
+
+    def visit_bindparam(bind):
+        if id(bind) not in seen:
+            seen.add(id(bind))
+            binds.append(bind)
+
+    # skip the derived column collections, building them costs more
+    # than compiling, binds in the raw columns are still visited
+    visitors.traverse(
+        stmt, {'column_collections': False},
+        {'bindparam': visit_bindparam})
+    for attr in ('_limit_clause', '_offset_clause'):
+        clause = getattr(stmt, attr, None)
+        if isinstance(clause, BindParameter):
+            visit_bindparam(clause)
+    return binds
+
+
+def _compile_shape(stmt, binds):
+    compiled = stmt.compile()
+    names = [compiled.bind_names.get(b) for b in binds]
+    if None in names or set(names) != set(compiled.params):
+        return None
+    return text_type(compiled), names
+
+
+def _shaped_key_from_statement(stmt, shape_key):
+    """Same key as the plain :func:`_key_from_query` output, but the sql
+    string is compiled once per query shape, like baked queries do, and
+    only the bound values are serialized per call."""
+    binds = _statement_binds(stmt)
+    shape = (shape_key, len(binds))
+    try:
+        compiled = _query_shapes[shape]
+    except KeyError:
+        if len(_query_shapes) >= _MAX_QUERY_SHAPES:
+            _query_shapes.clear()
+        compiled = _query_shapes[shape] = _compile_shape(stmt, binds)
+
+    if compiled is None:
+        return None
+
+    sql, names = compiled
+    params = dict(zip(names, (b.effective_value for b in binds)))
+    return ' '.join(
+        [sql] + [text_type(params[k]) for k in sorted(params)]
+    )
+
+
+_model_registry = {}
+
+
+def _import_model(module, name):
+    """Resolve a model class from its module and class name, cached."""
+    try:
+        return _model_registry[(module, name)]
+    except KeyError:
+        model = getattr(importlib.import_module(module), name)
+        _model_registry[(module, name)] = model
+        return model
+
+
 def _get_current_redica():
     if hasattr(current_app, 'extensions'):
         return current_app.extensions['sqlalchemy_redica']
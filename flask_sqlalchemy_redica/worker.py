@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+    flask_sqlalchemy_redica.worker
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Runs cache invalidations in a thread of the web process instead of on
+    the commit path, enabled with ``REDICA_INVALIDATOR_TYPE = 'thread'``.
+
+    ``REDICA_INVALIDATOR_QUEUE_SIZE``
+        invalidations that may wait for the worker, default 10000
+    ``REDICA_INVALIDATOR_BLOCK_TIMEOUT``
+        seconds a commit waits for room in a full queue before the
+        invalidation is dropped, default 0.1
+    ``REDICA_INVALIDATOR_WINDOW``
+        seconds the worker gathers invalidations into one batch, repeated
+        invalidations of an object within the window are flushed once,
+        default 0.05
+    ``REDICA_INVALIDATOR_BATCH_SIZE``
+        most invalidations flushed at once, default 500
+
+    Dropped invalidations only leave entries cached until they expire.
+"""
+from __future__ import absolute_import
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from flask import current_app
+
+from .model import CachingInvalidator
+from .stats import stats
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+_worker_lock = threading.Lock()
+
+
+class InvalidationWorker(object):
+    """Bounded queue of invalidations flushed in batches by a daemon
+    thread, started on first use in each process."""
+
+    def __init__(self, app, callback, max_size=10000, block_timeout=0.1,
+                 window=0.05, batch_size=500):
+        self.app = app
+        self.callback = callback
+        self.max_size = max_size
+        self.block_timeout = block_timeout
+        self.window = window
+        self.batch_size = batch_size
+        self._stats = dict(queued=0, blocked=0, dropped=0, coalesced=0,
+                           flushed=0, failed=0)
+        # counted by request threads and the worker thread alike
+        self._stats_lock = threading.Lock()
+        self.queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def stats(self):
+        """``queued``, ``blocked`` (puts that had to wait for room),
+        ``dropped``, ``coalesced``, ``flushed`` and ``failed`` items."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self._stats[name] += value
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        # first use in this process, items queued before a fork belong
+        # to the parent
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            self.queue = queue.Queue(self.max_size)
+            self._thread = threading.Thread(
+                target=self._run, name='redica-invalidator')
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = pid
+
+    def put(self, items):
+        self._ensure_started()
+        for item in items:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self._count('blocked')
+                try:
+                    self.queue.put(item, timeout=self.block_timeout)
+                except queue.Full:
+                    self._count('dropped')
+                    if stats.enabled:
+                        stats.incr('invalidations_dropped')
+                    continue
+            self._count('queued')
+
+    def _collect(self):
+        """Block for an item, then gather more for ``window`` seconds."""
+        items = [self.queue.get()]
+        deadline = time.time() + self.window
+        while items[-1] is not _STOP and len(items) < self.batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            stop = items[-1] is _STOP
+            if stop:
+                items.pop()
+            try:
+                self._flush(items)
+            finally:
+                for _ in range(len(items) + stop):
+                    self.queue.task_done()
+            if stop:
+                return
+
+    def _flush(self, items):
+        unique = CachingInvalidator._unique_items(items)
+        self._count('coalesced', len(items) - len(unique))
+        if not unique:
+            return
+        try:
+            with self.app.app_context():
+                self.callback(unique)
+        except Exception:
+            self._count('failed', len(unique))
+            logger.exception('Failed to invalidate %d cache items',
+                             len(unique))
+        else:
+            self._count('flushed', len(unique))
+
+    def drain(self, timeout=None):
+        """Wait until the queued items are flushed, returns whether they
+        were within ``timeout`` seconds."""
+        if self._pid != os.getpid():
+            return True
+        deadline = timeout is not None and time.time() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline and deadline - time.time()
+                if deadline and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining or None)
+        return True
+
+    def stop(self, timeout=5):
+        """Flush the queued items and stop the thread."""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+        self._pid = None
+
+
+def invalidation_worker(app, callback=None):
+    """The worker of ``app``, created from its config on first use."""
+    worker = app.extensions.get('redica_invalidation_worker')
+    if worker is not None:
+        return worker
+
+    with _worker_lock:
+        worker = app.extensions.get('redica_invalidation_worker')
+        if worker is None:
+            config = app.config
+            worker = InvalidationWorker(
+                app, callback or CachingInvalidator.do_flush,
+                max_size=config.get('REDICA_INVALIDATOR_QUEUE_SIZE', 10000),
+                block_timeout=config.get(
+                    'REDICA_INVALIDATOR_BLOCK_TIMEOUT', 0.1),
+                window=config.get('REDICA_INVALIDATOR_WINDOW', 0.05),
+                batch_size=config.get('REDICA_INVALIDATOR_BATCH_SIZE', 500))
+            app.extensions['redica_invalidation_worker'] = worker
+            atexit.register(worker.stop)
+    return worker
+
+
+class ThreadedCachingInvalidator(CachingInvalidator):
+    def invalidate(self, **kwargs):
+        # targets are bound to the request's session, the worker loads
+        # them again
+        kwargs.pop('target', None)
+        kwargs.pop('origin_target', None)
+        super(ThreadedCachingInvalidator, self).invalidate(**kwargs)
+
+    def flush(self):
+        items = list(self.items)
+        self.items = []
+        if items:
+            invalidation_worker(
+                current_app._get_current_object(), self.callback).put(items)
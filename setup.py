@@ -23,9 +23,12 @@ setup(
     platforms='any',
     install_requires=[
         'Flask-SQLAlchemy>=2.2,<=3.0',
-        'dogpile.cache>=0.6.2',
+        'dogpile.cache>=0.9.1',
         'blinker>=1.4.0'
     ],
+    extras_require={
+        'asyncio': ['redis>=4.2'],
+    },
     test_suite='tests',
     classifiers=[
         'Environment :: Web Environment',
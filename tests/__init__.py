@@ -1,2 +1,23 @@
 
 from .helloworld import *
+from .batch_loading import *
+from .local_cache import *
+from .asyncio_api import *
+from .instrumentation import *
+from .threaded_invalidator import *
+from .refresh import *
+from .stampede import *
+from .cluster import *
+from .replica import *
+from .compression import *
+from .filter_index import *
+from .compound_index import *
+from .relationship_batch import *
+from .warm import *
+from .negative_cache import *
+from .request_memo import *
+from .write_through import *
+from .hydration import *
+from .row_serializer import *
+from .query_shape import *
+from .invalidation import *
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+try:
+    import asyncio
+    import fakeredis
+    from fakeredis import aioredis as fake_aioredis
+    from flask_sqlalchemy_redica import aio
+    from flask_sqlalchemy_redica.utils import _tag_key_from_key
+except (ImportError, SyntaxError):
+    aio = None
+
+from .batch_loading import StatementCounter
+from .helloworld import db, DummyUser, create_app
+
+
+@unittest.skipIf(aio is None, 'needs python 3 and fakeredis')
+class TestAsyncCache(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+
+        # sync and async clients share one in-process redis stand-in
+        server = fakeredis.FakeServer()
+        region = DummyUser.cache.regions['default']
+        self.backend = region.backend
+        self.sync_client = self.backend.client
+        self.backend.client = fakeredis.FakeRedis(server=server)
+        aio.register_async_client(
+            region, fake_aioredis.FakeRedis(server=server))
+        self.loop = asyncio.new_event_loop()
+
+        db.create_all()
+        for i in range(5):
+            db.session.add(DummyUser(name='user%d' % i))
+        db.session.commit()
+        self.pks = [u.id for u in DummyUser.query.order_by(DummyUser.id)]
+        db.session.expunge_all()
+
+    def tearDown(self):
+        self.loop.close()
+        db.session.remove()
+        db.drop_all()
+        self.backend.client = self.sync_client
+        self.ctx.pop()
+
+    def run_counted(self, coro):
+        with StatementCounter(db.engine) as statements:
+            result = self.loop.run_until_complete(coro)
+        return result, statements.count
+
+    def test_aget_many(self):
+        users, statements = self.run_counted(
+            DummyUser.cache.aget_many(self.pks[::-1]))
+        self.assertEqual(self.pks[::-1], [u.id for u in users])
+        self.assertEqual(1, statements)
+
+        db.session.expunge_all()
+        users, statements = self.run_counted(
+            DummyUser.cache.aget_many(self.pks))
+        self.assertEqual(self.pks, [u.id for u in users])
+        self.assertEqual(0, statements)
+        self.assertTrue(all(u in db.session for u in users))
+
+        user, statements = self.run_counted(DummyUser.cache.aget(-1))
+        self.assertIsNone(user)
+
+    def test_shared_entries(self):
+        DummyUser.cache.get_many(self.pks)
+        db.session.expunge_all()
+
+        users, statements = self.run_counted(
+            DummyUser.cache.aget_many(self.pks))
+        self.assertEqual(self.pks, [u.id for u in users])
+        self.assertEqual(0, statements)
+
+    def test_afilter(self):
+        users, statements = self.run_counted(
+            DummyUser.cache.afilter(order_by='desc', limit=2))
+        self.assertEqual(self.pks[::-1][:2], [u.id for u in users])
+        self.assertEqual(2, statements)
+
+        users, statements = self.run_counted(
+            DummyUser.cache.afilter(offset=1))
+        self.assertEqual(self.pks[1:], [u.id for u in users])
+        self.assertEqual(1, statements)
+
+    def test_cached_all(self):
+        query = DummyUser.query.order_by(DummyUser.id).options(
+            DummyUser.from_cache())
+        users, statements = self.run_counted(query.cached_all())
+        self.assertEqual(self.pks, [u.id for u in users])
+        self.assertEqual(1, statements)
+
+        users, statements = self.run_counted(query.cached_all())
+        self.assertEqual(self.pks, [u.id for u in users])
+        self.assertEqual(0, statements)
+
+    def test_negative_entries(self):
+        self.backend.negative_expiration_time = 30
+        try:
+            users, _ = self.run_counted(DummyUser.cache.afilter(name='new'))
+            self.assertEqual([], users)
+            query = DummyUser.query.filter_by(name='new').options(
+                DummyUser.from_cache())
+            users, _ = self.run_counted(query.cached_all())
+            self.assertEqual([], users)
+            users, statements = self.run_counted(query.cached_all())
+            self.assertEqual(0, statements)
+        finally:
+            self.backend.negative_expiration_time = None
+
+        for key in (DummyUser.cache.cache_index_key(name='new'),
+                    query._get_cache_plus_key()[1]):
+            ttl = self.backend.client.ttl(self.backend.key_mangler(key))
+            self.assertTrue(0 < ttl <= 30)
+
+        # found results keep the regular lifetime
+        self.run_counted(DummyUser.cache.afilter(name='user1'))
+        ttl = self.backend.client.ttl(self.backend.key_mangler(
+            DummyUser.cache.cache_index_key(name='user1')))
+        self.assertFalse(0 < ttl <= 30)
+
+    def test_cluster_invalidate_tags(self):
+        aregion = aio.async_region(DummyUser.cache.regions['default'])
+        keys = ['dummy_user:%d:query:recent' % pk for pk in self.pks]
+        aregion.region.set_multi(dict((k, k) for k in keys))
+        tags = []
+        for k in keys:
+            tags.append(_tag_key_from_key(k))
+            self.backend.tag(tags[-1], [k])
+        tags = [aregion.mangle(t) for t in tags]
+        untagged = aregion.mangle('untagged')
+        self.backend.client.set(untagged, 'x')
+
+        self.backend.cluster = True
+        try:
+            deleted = self.loop.run_until_complete(
+                aregion.invalidate_tags(tags, [untagged]))
+        finally:
+            self.backend.cluster = False
+        self.assertEqual(len(keys) + 1, len(deleted))
+        self.assertFalse(any(aregion.region.get_multi(keys)))
+        self.assertEqual(0, self.backend.client.exists(*tags))
+
+    def test_aflush_all(self):
+        user, _ = self.run_counted(DummyUser.cache.aget(self.pks[0]))
+        self.run_counted(DummyUser.cache.aflush_all(user))
+
+        db.session.expunge_all()
+        _, statements = self.run_counted(DummyUser.cache.aget(self.pks[0]))
+        self.assertEqual(1, statements)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlalchemy import event
+
+from flask_sqlalchemy_redica.model import CachingInvalidator, _flush_signal
+
+from .helloworld import db, DummyUser, create_app
+
+
+class StatementCounter(object):
+    """count SQL statements executed on an engine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+class RoundTripCounter(object):
+    """count redis round trips, a pipeline counts as one"""
+
+    def __init__(self, client):
+        self.client = client
+        self.count = 0
+
+    def _counting(self, func):
+        def wrapper(*args, **kwargs):
+            self.count += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    def _pipeline(self, *args, **kwargs):
+        ppl = self._client_pipeline(*args, **kwargs)
+        ppl.execute = self._counting(ppl.execute)
+        return ppl
+
+    def __enter__(self):
+        self._client_pipeline = self.client.pipeline
+        self.client.execute_command = self._counting(
+            self.client.execute_command)
+        self.client.pipeline = self._pipeline
+        return self
+
+    def __exit__(self, *exc_info):
+        del self.client.execute_command
+        del self.client.pipeline
+
+
+class TestFilterBatchLoading(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.client = DummyUser.cache.regions['default'].backend.client
+        self.client.flushdb()
+        for i in range(10):
+            db.session.add(DummyUser(name='user%d' % i))
+        db.session.commit()
+        self.pks = [u.id for u in DummyUser.query.order_by(DummyUser.id)]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.client.flushdb()
+        self.ctx.pop()
+
+    def filter(self):
+        with StatementCounter(db.engine) as statements, \
+                RoundTripCounter(self.client) as round_trips:
+            pks = [u.id for u in DummyUser.cache.filter()]
+        return pks, statements.count, round_trips.count
+
+    def test_cold(self):
+        pks, statements, round_trips = self.filter()
+        self.assertEqual(self.pks, pks)
+        # pk index query and a single IN query for all objects
+        self.assertEqual(2, statements)
+        # GET index, SET index, MGET objects, one set_multi pipeline
+        self.assertEqual(4, round_trips)
+
+    def test_warm(self):
+        self.filter()
+        pks, statements, round_trips = self.filter()
+        self.assertEqual(self.pks, pks)
+        self.assertEqual(0, statements)
+        self.assertEqual(2, round_trips)
+
+    def test_partially_warm(self):
+        self.filter()
+        DummyUser.cache.regions['default'].delete_multi(
+            [DummyUser.cache.cache_key(pk) for pk in self.pks[::3]])
+
+        pks, statements, round_trips = self.filter()
+        self.assertEqual(self.pks, pks)
+        self.assertEqual(1, statements)
+        self.assertEqual(3, round_trips)
+
+    def test_get_many(self):
+        pks = [self.pks[3], self.pks[0], -1, self.pks[3]]
+        DummyUser.cache.get(self.pks[0])
+        db.session.expunge_all()
+
+        with StatementCounter(db.engine) as statements:
+            users = DummyUser.get_many(pks)
+        self.assertEqual(1, statements.count)
+        self.assertEqual(pks[:2], [u.id for u in users[:2]])
+        self.assertIsNone(users[2])
+        self.assertIs(users[0], users[3])
+        for user in users[:2]:
+            self.assertIn(user, db.session)
+
+        users = DummyUser.cache.get_many(pks, as_dict=True)
+        self.assertEqual(set(pks[:2]), set(users))
+
+
+class TestInvalidatorBatchLoading(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        for i in range(300):
+            db.session.add(DummyUser(name='user%d' % i))
+        db.session.commit()
+        self.pks = [u.id for u in DummyUser.query.order_by(DummyUser.id)]
+        self.flushed = []
+        _flush_signal.connect(self.on_flush, sender='DummyUser')
+
+    def tearDown(self):
+        _flush_signal.disconnect(self.on_flush, sender='DummyUser')
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def on_flush(self, sender, **kw):
+        self.flushed.append(kw)
+
+    def item(self, pk, event='update', **kwargs):
+        kwargs.update(module=DummyUser.__module__, model='DummyUser',
+                      target_id=pk, event=event, source='notify')
+        return kwargs
+
+    def test_fan_out(self):
+        items = [self.item(pk) for pk in self.pks]
+        items.extend(self.item(pk) for pk in self.pks[:100])
+        items.append(self.item(self.pks[0], event='delete'))
+
+        with StatementCounter(db.engine) as statements:
+            CachingInvalidator.do_flush(items)
+
+        self.assertEqual(1, statements.count)
+        self.assertEqual(301, len(self.flushed))
+        self.assertEqual(
+            self.pks, [kw['target'].id for kw in self.flushed[:300]])
+        self.assertEqual('delete', self.flushed[-1]['event'])
+
+    def test_origin_targets(self):
+        items = [self.item(pk, origin_module=DummyUser.__module__,
+                           origin_model='DummyUser',
+                           origin_target_id=self.pks[-1])
+                 for pk in self.pks[:10]]
+        items.append(self.item(-1))
+
+        with StatementCounter(db.engine) as statements:
+            CachingInvalidator.do_flush(items)
+
+        self.assertEqual(1, statements.count)
+        self.assertIsNone(self.flushed[-1]['target'])
+        for kw in self.flushed[:10]:
+            self.assertEqual(self.pks[-1], kw['origin_target'].id)
+            self.assertEqual('flush', kw['source'])
+
+
+class TestCommitInvalidation(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.client = DummyUser.cache.regions['default'].backend.client
+        self.client.flushdb()
+        for i in range(50):
+            db.session.add(DummyUser(name='user%d' % i))
+        db.session.commit()
+        self.users = DummyUser.query.order_by(DummyUser.id).all()
+        self.pks = [user.id for user in self.users]
+        for user in self.users:
+            DummyUser.cache.get(user.id)
+            list(DummyUser.cache.filter(name=user.name))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.client.flushdb()
+        self.ctx.pop()
+
+    def test_single_round_trip(self):
+        # loads the invalidation script
+        self.users[0].name = 'warm'
+        db.session.commit()
+
+        for user in self.users:
+            user.name += '-renamed'
+        db.session.flush()
+        for user in self.users:
+            user.name += '-again'
+
+        with RoundTripCounter(self.client) as round_trips:
+            db.session.commit()
+        self.assertEqual(1, round_trips.count)
+
+        db.session.expunge_all()
+        for pk in self.pks[1:]:
+            self.assertTrue(DummyUser.cache.get(pk).name.endswith('-again'))
+            self.assertEqual(
+                [], list(DummyUser.cache.filter(name='user%d' % (pk - 1))))
+
+    def test_rollback(self):
+        self.users[0].name = 'rolled back'
+        db.session.flush()
+        self.assertTrue(len(db.invalidation_batch))
+        db.session.rollback()
+        self.assertFalse(len(db.invalidation_batch))
+
+    def test_disabled(self):
+        self.app.config['REDICA_BATCH_INVALIDATION'] = False
+        self.users[0].name = 'renamed'
+        db.session.flush()
+        # invalidated on flush
+        self.assertEqual(
+            [], self.client.keys('*object:%d:*' % self.users[0].id))
+        db.session.commit()
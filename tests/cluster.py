@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import functools
+import os
+import unittest
+
+from flask import Flask
+
+from flask_sqlalchemy_redica.redis import _slot_groups, key_slot, \
+    make_redis_region
+from flask_sqlalchemy_redica.utils import _hash_tag_key_mangler, \
+    _tag_key_from_key
+
+from .helloworld import DummyUser
+
+CLUSTER_URL = os.environ.get('REDICA_TEST_CLUSTER_URL')
+
+
+def slot(key):
+    return key_slot(key.encode('utf-8'))
+
+
+def mangle(key):
+    return _hash_tag_key_mangler('redica', key)
+
+
+@unittest.skipIf(key_slot is None, 'redis-py without cluster support')
+class TestHashTagKeys(unittest.TestCase):
+
+    def test_object_keys_share_a_slot(self):
+        cache = DummyUser.cache
+        keys = [cache.cache_key(7),
+                cache.cache_relationship_key(7, 'friends'),
+                cache.cache_query_key(7, 'recent'),
+                cache.cache_query_key(7, None)]
+        keys += [_tag_key_from_key(k) for k in keys[1:]]
+        self.assertEqual(
+            'redica:{dummy_user:7}:object:id', mangle(keys[0]))
+        self.assertEqual(1, len(set(slot(mangle(k)) for k in keys)))
+        self.assertNotEqual(slot(mangle(cache.cache_key(8))),
+                            slot(mangle(keys[0])))
+
+    def test_filter_keys_share_a_slot(self):
+        cache = DummyUser.cache
+        self.assertEqual(slot(mangle(cache.cache_index_key(name='a'))),
+                         slot(mangle(cache.cache_index_key(name='b'))))
+
+    def test_query_keys(self):
+        key = mangle('SELECT dummy_user.id FROM dummy_user')
+        self.assertNotIn('{', key)
+        self.assertEqual(len('redica:') + 32, len(key))
+
+    def test_slot_groups(self):
+        tags = [mangle('dummy_user:1:tags:query'),
+                mangle('dummy_user:2:tags:query')]
+        keys = [mangle('dummy_user:1:object:id'),
+                mangle('dummy_user:2:object:id'),
+                mangle('dummy_user:2:query:recent')]
+        ops = [(mangle('dummy_user:all:index:name=a'), 'rem', '1')]
+        groups = sorted(_slot_groups(tags, keys, ops))
+        self.assertEqual(sorted([
+            ([tags[0]], [keys[0]], []),
+            ([tags[1]], [keys[1], keys[2]], []),
+            ([], [], ops),
+        ]), groups)
+
+
+class TestClusterRegion(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['REDICA_CACHE_URL'] = CLUSTER_URL
+        self.app.config['REDICA_CACHE_CLUSTER'] = True
+
+    def test_keys_mode_is_rejected(self):
+        with self.assertRaises(ValueError):
+            make_redis_region(self.app, 'redica')
+
+    @unittest.skipIf(not CLUSTER_URL, 'REDICA_TEST_CLUSTER_URL not set')
+    def test_invalidate(self):
+        self.app.config['REDICA_INVALIDATION_MODE'] = 'tags'
+        region = make_redis_region(self.app, 'redica_test')['default']
+        backend = region.backend
+        keys = ['dummy_user:%d:query:recent' % pk for pk in range(20)]
+        region.set_multi(dict((k, k) for k in keys))
+        for k in keys:
+            backend.tag(_tag_key_from_key(k), [k])
+        self.assertEqual(keys, region.get_multi(keys))
+
+        deleted, round_trips = backend.invalidate(
+            patterns=['dummy_user:%d:query:*' % pk for pk in range(20)])
+        self.assertEqual(20, len(deleted))
+        # tag sets read, a script call per slot, tag sets cleaned up
+        self.assertEqual(22, round_trips)
+        self.assertFalse(any(region.get_multi(keys)))
+
+
+class TestClusterFlush(unittest.TestCase):
+    """The cluster code path of a flush, run against a single node."""
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.config['REDICA_CACHE_URL'] = 'redis://localhost:6379/2'
+        app.config['REDICA_INVALIDATION_MODE'] = 'tags'
+        self.region = make_redis_region(app, 'redica_flush')['default']
+        self.backend = self.region.backend
+        self.backend.cluster = True
+        self.region.key_mangler = self.backend.key_mangler = \
+            functools.partial(_hash_tag_key_mangler, 'redica_flush')
+        self.keys = ['dummy_user:%d:query:recent' % pk for pk in range(3)]
+        self.region.set_multi(dict((k, k) for k in self.keys))
+        for k in self.keys:
+            self.backend.tag(_tag_key_from_key(k), [k])
+        self.tag = self.backend.key_mangler(_tag_key_from_key(self.keys[0]))
+
+    def tearDown(self):
+        self.backend.client.flushdb()
+
+    def test_tag_members_are_passed_as_keys(self):
+        scripts = []
+        flush_tags = self.backend._flush_tags
+        tag_members = self.backend._tag_members
+
+        def recording(keys, args):
+            scripts.append(keys)
+            return flush_tags(keys=keys, args=args)
+
+        def tagging_later(tags):
+            members = tag_members(tags)
+            self.backend.client.sadd(self.tag, 'later')
+            return members
+
+        self.backend._flush_tags = recording
+        self.backend._tag_members = tagging_later
+        deleted, round_trips = self.backend.invalidate(
+            patterns=['dummy_user:%d:query:*' % pk for pk in range(3)])
+        self.assertEqual(3, len(deleted))
+        # tag sets read, a script call per slot, tag sets cleaned up
+        self.assertEqual(5, round_trips)
+        self.assertEqual(0, self.backend.client.exists(
+            *map(self.backend.key_mangler, self.keys)))
+        self.assertEqual(3, len(scripts))
+        for keys in scripts:
+            self.assertEqual(1, len(keys))
+            self.assertIn(keys[0], deleted)
+        # members tagged after the read are kept for the next flush
+        self.assertEqual(set([b'later']), self.backend.client.smembers(
+            self.tag))
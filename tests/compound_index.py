@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlalchemy.orm import defer
+
+from flask_sqlalchemy_redica import CachingMixin
+
+from .batch_loading import StatementCounter
+from .helloworld import db, create_app
+
+
+class DummyTicket(db.Model, CachingMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+
+    cache_indexes = [('tenant_id', 'status')]
+
+
+class TestCompoundIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.backend = DummyTicket.cache.regions['default'].backend
+        self.backend.client.flushdb()
+        for i in range(6):
+            db.session.add(DummyTicket(
+                tenant_id=i % 2, status='open' if i < 4 else 'closed'))
+        db.session.commit()
+        self.pks = [t.id for t in DummyTicket.query.order_by(DummyTicket.id)]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.backend.client.flushdb()
+        self.ctx.pop()
+
+    def filter(self, **kwargs):
+        return [t.id for t in DummyTicket.cache.filter(**kwargs)]
+
+    def test_filter(self):
+        self.assertEqual(self.pks[0:4:2],
+                         self.filter(tenant_id=0, status='open'))
+        with StatementCounter(db.engine) as statements:
+            self.assertEqual(self.pks[0:4:2],
+                             self.filter(status='open', tenant_id=0))
+        self.assertEqual(0, statements.count)
+        self.assertEqual(2, DummyTicket.cache.count(
+            tenant_id=1, status='open'))
+
+    def test_unknown_combination(self):
+        with self.assertRaises(TypeError):
+            self.filter(tenant_id=0, id=1)
+
+    def test_maintained(self):
+        self.filter(tenant_id=0, status='open')
+        self.filter(tenant_id=0, status='closed')
+
+        ticket = DummyTicket.query.get(self.pks[0])
+        ticket.status = 'closed'
+        db.session.add(DummyTicket(tenant_id=0, status='open'))
+        db.session.delete(DummyTicket.query.get(self.pks[4]))
+        db.session.commit()
+
+        new = DummyTicket.query.order_by(DummyTicket.id.desc()).first()
+        with StatementCounter(db.engine) as statements:
+            self.assertEqual([self.pks[2], new.id],
+                             self.filter(tenant_id=0, status='open'))
+            self.assertEqual([self.pks[0]],
+                             self.filter(tenant_id=0, status='closed'))
+        # no index query, the new and the changed ticket are loaded
+        self.assertEqual(2, statements.count)
+
+    def test_partially_loaded(self):
+        self.filter(tenant_id=0, status='open')
+        self.filter(tenant_id=0, status='closed')
+
+        ticket = DummyTicket.query.get(self.pks[0])
+        db.session.expire(ticket, ['tenant_id'])
+        ticket.status = 'closed'
+        db.session.commit()
+        self.assertEqual([self.pks[2]],
+                         self.filter(tenant_id=0, status='open'))
+        self.assertEqual([self.pks[0], self.pks[4]],
+                         self.filter(tenant_id=0, status='closed'))
+
+    def test_deferred(self):
+        self.filter(tenant_id=0, status='open')
+        self.filter(tenant_id=0, status='closed')
+        db.session.expunge_all()
+
+        ticket = DummyTicket.query.options(defer('status')).get(self.pks[2])
+        ticket.status = 'closed'
+        db.session.commit()
+        self.assertEqual([self.pks[0]],
+                         self.filter(tenant_id=0, status='open'))
+        self.assertEqual([self.pks[2], self.pks[4]],
+                         self.filter(tenant_id=0, status='closed'))
+
+        db.session.expunge_all()
+        ticket = DummyTicket.query.options(
+            defer('tenant_id'), defer('status')).get(self.pks[0])
+        db.session.delete(ticket)
+        db.session.commit()
+        self.assertEqual(0, DummyTicket.cache.count(
+            tenant_id=0, status='open'))
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from flask import Flask
+
+from flask_sqlalchemy_redica import stats, MemorySink
+from flask_sqlalchemy_redica.redis import make_redis_region
+from flask_sqlalchemy_redica.serializer import CompressingSerializer, \
+    PickleSerializer, lz4
+
+LARGE = [u'row %d' % (i % 10) for i in range(2000)]
+
+
+class TestCompressingSerializer(unittest.TestCase):
+
+    def setUp(self):
+        self.serializer = CompressingSerializer(
+            PickleSerializer(), threshold=1024)
+
+    def test_small_values_are_kept(self):
+        data = self.serializer.dumps([1, 2, 3])
+        self.assertEqual(PickleSerializer().dumps([1, 2, 3]), data)
+        self.assertEqual([1, 2, 3], self.serializer.loads(data))
+
+    def test_large_values_are_compressed(self):
+        data = self.serializer.dumps(LARGE)
+        self.assertEqual(b'\xc1z', data[:2])
+        self.assertTrue(len(data) < len(PickleSerializer().dumps(LARGE)) / 10)
+        self.assertEqual(LARGE, self.serializer.loads(data))
+
+    def test_uncompressed_entries_are_read(self):
+        data = PickleSerializer().dumps(LARGE)
+        self.assertEqual(LARGE, self.serializer.loads(data))
+
+    @unittest.skipIf(lz4 is None, 'lz4 is not installed')
+    def test_lz4(self):
+        serializer = CompressingSerializer(
+            PickleSerializer(), 'lz4', threshold=1024)
+        data = serializer.dumps(LARGE)
+        self.assertEqual(b'\xc1l', data[:2])
+        self.assertEqual(LARGE, serializer.loads(data))
+        # entries of the previous codec stay readable
+        self.assertEqual(LARGE, serializer.loads(
+            self.serializer.dumps(LARGE)))
+
+    def test_uncompressed_writes(self):
+        serializer = CompressingSerializer(PickleSerializer(), None)
+        data = serializer.dumps(LARGE)
+        self.assertEqual(PickleSerializer().dumps(LARGE), data)
+        self.assertEqual(LARGE, serializer.loads(data))
+        self.assertEqual(LARGE, serializer.loads(
+            self.serializer.dumps(LARGE)))
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            CompressingSerializer(PickleSerializer(), 'brotli')
+
+    def test_stats(self):
+        sink = MemorySink()
+        stats.add_sink(sink)
+        try:
+            data = self.serializer.dumps(LARGE)
+            self.serializer.dumps([1])
+        finally:
+            stats.remove_sink(sink)
+        self.assertEqual(1, sink.value('compressed_values'))
+        self.assertEqual(len(data), sink.value('compression_bytes_out'))
+        self.assertEqual(len(PickleSerializer().dumps(LARGE)),
+                         sink.value('compression_bytes_in'))
+
+
+class TestCompressedRegion(unittest.TestCase):
+
+    def test_region(self):
+        app = Flask(__name__)
+        app.config['REDICA_CACHE_URL'] = 'redis://localhost:6379/2'
+        app.config['REDICA_COMPRESSION'] = 'zlib'
+        region = make_redis_region(app, 'compression_test')['default']
+        backend = region.backend
+
+        region.set('large', LARGE)
+        data = backend.client.get(backend.key_mangler('large'))
+        self.assertEqual(b'\xc1z', data[:2])
+        self.assertEqual(LARGE, region.get('large'))
+        self.assertEqual([LARGE], region.get_multi(['large']))
+        region.delete('large')
+
+    def test_compression_turned_off(self):
+        app = Flask(__name__)
+        app.config['REDICA_CACHE_URL'] = 'redis://localhost:6379/2'
+        app.config['REDICA_COMPRESSION'] = 'zlib'
+        compressed = make_redis_region(app, 'compression_test')['default']
+        compressed.set('large', LARGE)
+
+        app = Flask(__name__)
+        app.config['REDICA_CACHE_URL'] = 'redis://localhost:6379/2'
+        region = make_redis_region(app, 'compression_test')['default']
+        self.assertEqual(LARGE, region.get('large'))
+        self.assertEqual([LARGE], region.get_multi(['large']))
+
+        # and written uncompressed from then on
+        region.set('large', LARGE)
+        data = region.backend.client.get(region.backend.key_mangler('large'))
+        self.assertNotEqual(b'\xc1', data[:1])
+        region.delete('large')
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from .batch_loading import RoundTripCounter, StatementCounter
+from .helloworld import db, DummyUser, create_app
+
+
+class TestFilterIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.backend = DummyUser.cache.regions['default'].backend
+        self.backend.client.flushdb()
+        for i in range(10):
+            db.session.add(DummyUser(name='even' if i % 2 else 'odd'))
+        db.session.commit()
+        self.pks = [u.id for u in DummyUser.query.order_by(DummyUser.id)]
+        # warm the indices and objects
+        list(DummyUser.cache.filter())
+        list(DummyUser.cache.filter(name='even'))
+        list(DummyUser.cache.filter(name='odd'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.backend.client.flushdb()
+        self.ctx.pop()
+
+    def filter(self, **kwargs):
+        return [u.id for u in DummyUser.cache.filter(**kwargs)]
+
+    def index(self, **kwargs):
+        members = self.backend.index_range(
+            DummyUser.cache.cache_index_key(**kwargs))
+        if members is not None:
+            return [int(m) for m in members]
+
+    def test_server_side_page(self):
+        with StatementCounter(db.engine) as statements, \
+                RoundTripCounter(self.backend.client) as round_trips:
+            pks = self.filter(order_by='desc', offset=2, limit=3)
+        self.assertEqual(self.pks[::-1][2:5], pks)
+        self.assertEqual(0, statements.count)
+        # the page of the index and one MGET
+        self.assertEqual(2, round_trips.count)
+
+        self.assertEqual(self.pks[8:], self.filter(offset=8, limit=5))
+        self.assertEqual([], self.filter(offset=20))
+        self.assertEqual(self.pks[1::2], self.filter(name='even'))
+
+    def test_count(self):
+        self.assertEqual(10, DummyUser.cache.count())
+        self.assertEqual(5, DummyUser.cache.count(name='odd'))
+        self.assertEqual(0, DummyUser.cache.count(name='none'))
+        # the empty index is cached too
+        self.assertEqual(0, self.backend.index_count(
+            DummyUser.cache.cache_index_key(name='none')))
+
+    def test_insert(self):
+        user = DummyUser(name='odd')
+        db.session.add(user)
+        db.session.commit()
+        self.assertEqual(self.pks + [user.id], self.index())
+        self.assertEqual(self.pks[::2] + [user.id], self.index(name='odd'))
+
+    def test_update(self):
+        user = DummyUser.query.get(self.pks[0])
+        user.name = 'even'
+        db.session.commit()
+        self.assertEqual(self.pks[2::2], self.index(name='odd'))
+        self.assertEqual(sorted(self.pks[1::2] + [user.id]),
+                         self.index(name='even'))
+        self.assertEqual(self.pks, self.index())
+
+    def test_delete(self):
+        db.session.delete(DummyUser.query.get(self.pks[1]))
+        db.session.commit()
+        self.assertEqual(self.pks[3::2], self.index(name='even'))
+        self.assertEqual(self.pks[:1] + self.pks[2:], self.index())
+
+    def test_rollback_drops_indices(self):
+        user = DummyUser.query.get(self.pks[0])
+        user.name = 'even'
+        db.session.flush()
+        db.session.rollback()
+        self.assertIsNone(self.index(name='even'))
+        self.assertIsNone(self.index(name='odd'))
+        self.assertEqual(self.pks, self.index())
+        self.assertEqual(self.pks[::2], self.filter(name='odd'))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from flask import Flask
+from sqlalchemy.orm import joinedload, object_session
+
+from flask_sqlalchemy_redica.cache import FromCache
+from flask_sqlalchemy_redica.redis import make_redis_region
+
+from .helloworld import db, DummyUser, create_app
+from .relationship_batch import DummyItem, DummyOrder
+
+
+class TestHydration(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.backend = DummyUser.cache.regions['default'].backend
+        self.backend.client.flushdb()
+        db.session.add(DummyUser(name='cached'))
+        db.session.commit()
+        self.pk = DummyUser.query.first().id
+        # fill the cache
+        self.query('merge').all()
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.backend.client.flushdb()
+        self.ctx.pop()
+
+    def query(self, hydrate, regions=None):
+        return DummyUser.query.filter_by(id=self.pk).options(
+            FromCache(cache_key='hydration:%d' % self.pk, hydrate=hydrate,
+                      cache_regions=regions or DummyUser.cache.regions))
+
+    def test_fast_adds_cached_instances(self):
+        user = self.query('fast').one()
+        self.assertIs(db.session(), object_session(user))
+        self.assertEqual('cached', user.name)
+        self.assertEqual([user], self.query('fast').all())
+        self.assertIs(user, self.query('fast').first())
+
+    def test_fast_keeps_the_session_instance(self):
+        user = DummyUser.query.get(self.pk)
+        self.assertIs(user, self.query('fast').one())
+
+    def test_fast_merges_a_conflicting_identity(self):
+        user = DummyUser.query.get(self.pk)
+        # the row changed behind the cache's back
+        db.session.execute(DummyUser.__table__.update().values(name='db'))
+        db.session.expire(user)
+        self.assertEqual('db', user.name)
+        cached = self.query('fast').one()
+        self.assertIs(user, cached)
+        self.assertEqual('cached', cached.name)
+
+    def test_detached(self):
+        users = self.query('detached').all()
+        self.assertEqual(['cached'], [u.name for u in users])
+        self.assertIsNone(object_session(users[0]))
+        self.assertNotIn(users[0], db.session)
+        self.assertEqual('cached', self.query('detached').first().name)
+
+    def test_fast_with_shared_values_merges(self):
+        app = Flask(__name__)
+        app.config['REDICA_CACHE_URL'] = 'redis://localhost:6379/2'
+        app.config['REDICA_L1_ENABLED'] = True
+        regions = make_redis_region(app, 'hydration_test')
+        local = regions['default'].backend.local
+
+        first = self.query('fast', regions).one()
+        db.session.expunge_all()
+        second = self.query('fast', regions).one()
+        self.assertEqual(1, len(local))
+        # the local tier's instance is shared, sessions get copies of it
+        shared = list(local._entries.values())[0][2].payload[0]
+        self.assertIsNone(object_session(shared))
+        self.assertIsNot(shared, second)
+        self.assertIsNot(first, second)
+        self.assertIs(db.session(), object_session(second))
+
+    def test_fast_with_a_related_instance_in_the_session(self):
+        order = DummyOrder(items=[DummyItem()])
+        db.session.add(order)
+        db.session.commit()
+        item_pk, order_pk = order.items[0].id, order.id
+        db.session.expunge_all()
+
+        def query():
+            return DummyItem.query.filter_by(id=item_pk).options(
+                joinedload(DummyItem.order),
+                FromCache(cache_key='hydration:item:%d' % item_pk,
+                          hydrate='fast',
+                          cache_regions=DummyItem.cache.regions))
+        query().all()
+        db.session.expunge_all()
+
+        order = DummyOrder.query.get(order_pk)
+        item = query().one()
+        self.assertIs(db.session(), object_session(item))
+        self.assertIs(order, item.order)
+
+        # without a conflict the cached instances are added as they are
+        db.session.expunge_all()
+        item = query().one()
+        self.assertIs(db.session(), object_session(item.order))
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from flask_sqlalchemy_redica.stats import stats, MemorySink, \
+    AppContextSink, context_stats
+
+from .helloworld import db, DummyUser, create_app
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        db.session.add_all([DummyUser(name='Brazil'),
+                            DummyUser(name='Germany')])
+        db.session.commit()
+        DummyUser.cache.regions['default'].backend.client.flushdb()
+
+        self.sink = MemorySink()
+        self.context_sink = AppContextSink()
+        stats.add_sink(self.sink)
+        stats.add_sink(self.context_sink)
+
+    def tearDown(self):
+        stats.remove_sink(self.sink)
+        stats.remove_sink(self.context_sink)
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_disabled_without_sinks(self):
+        stats.remove_sink(self.sink)
+        stats.remove_sink(self.context_sink)
+        self.assertFalse(stats.enabled)
+        DummyUser.cache.get(1)
+        self.assertEqual({}, self.sink.counters)
+
+    def test_query_hits_and_misses(self):
+        DummyUser.cache.get(1)
+        DummyUser.cache.get(1)
+
+        labels = dict(region='default', model='DummyUser')
+        self.assertEqual(1, self.sink.value('cache_misses', **labels))
+        self.assertEqual(1, self.sink.value('cache_hits', **labels))
+        count, total = self.sink.timings[(
+            'cache_creation_seconds', tuple(sorted(labels.items())))]
+        self.assertEqual(1, count)
+        self.assertTrue(total > 0)
+        self.assertTrue(self.sink.value('redis_bytes_out') > 0)
+        self.assertTrue(self.sink.value('redis_bytes_in') > 0)
+
+    def test_filter_and_get_many(self):
+        list(DummyUser.cache.filter(name='Brazil'))
+        DummyUser.cache.get_many([1, 2])
+
+        # index miss plus one object miss, then one hit and one miss
+        self.assertEqual(3, self.sink.value('cache_misses'))
+        self.assertEqual(1, self.sink.value('cache_hits'))
+
+    def test_invalidation_on_commit(self):
+        DummyUser.cache.get(1)
+        user = DummyUser.query.get(1)
+        user.name = 'Brasil'
+        db.session.commit()
+
+        self.assertTrue(self.sink.value('keys_deleted') >= 1)
+
+    def test_cache_flush(self):
+        db.cache_invalidator.invalidate(
+            module=DummyUser.__module__, model='DummyUser', target_id=1,
+            event='update', source='notify')
+        db.session.commit()
+
+        self.assertEqual(1, self.sink.value('invalidations'))
+        self.assertEqual(1, self.sink.timings[
+            ('cache_flush_seconds', ())][0])
+
+    def test_context_summary(self):
+        DummyUser.cache.get(1)
+        DummyUser.cache.get(1)
+        summary = context_stats()
+        self.assertEqual(1, summary['cache_hits'])
+        self.assertEqual(1, summary['cache_misses'])
+        self.assertTrue(summary['redis_round_trips'] >= 2)
+
+    def test_prometheus_text(self):
+        DummyUser.cache.get(1)
+        text = self.sink.prometheus_text()
+        self.assertIn('# TYPE redica_cache_misses_total counter', text)
+        self.assertIn('redica_cache_misses_total'
+                      '{model="DummyUser",region="default"} 1', text)
+        self.assertIn('# TYPE redica_cache_creation_seconds summary', text)
+        self.assertIn('redica_cache_creation_seconds_count'
+                      '{model="DummyUser",region="default"} 1', text)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from flask_sqlalchemy_redica.utils import _tag_key_from_key
+
+from .helloworld import db, DummyUser, create_app
+
+
+class TestKeysInvalidation(unittest.TestCase):
+
+    mode = 'keys'
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.backend = DummyUser.cache.regions['default'].backend
+        self.backend.client.flushdb()
+        self.backend.invalidation_mode = self.mode
+        user = DummyUser(name='before')
+        db.session.add(user)
+        db.session.commit()
+        self.pk = user.id
+
+    def tearDown(self):
+        self.backend.invalidation_mode = 'keys'
+        db.session.remove()
+        db.drop_all()
+        self.backend.client.flushdb()
+        self.ctx.pop()
+
+    def query(self):
+        return DummyUser.query.filter_by(id=self.pk).options(
+            DummyUser.from_cache(pk=self.pk))
+
+    def cached(self):
+        """Cache the query, returns its mangled key."""
+        self.assertEqual(['before'], [u.name for u in self.query()])
+        key = self.query()._get_cache_plus_key()[1]
+        self.assertTrue(key.startswith('dummy_user:%d:query:' % self.pk))
+        return self.backend.key_mangler(key)
+
+    def exists(self, key):
+        return bool(self.backend.client.exists(key))
+
+    def change(self):
+        user = DummyUser.query.get(self.pk)
+        user.name = 'after'
+        db.session.commit()
+
+    def test_commit(self):
+        key = self.cached()
+        self.assertTrue(self.exists(key))
+        self.change()
+        self.assertFalse(self.exists(key))
+        self.assertEqual(['after'], [u.name for u in self.query()])
+
+    def test_flush_caches(self):
+        key = self.cached()
+        DummyUser.cache.flush_caches(self.pk)
+        self.assertFalse(self.exists(key))
+
+
+class TestTagsInvalidation(TestKeysInvalidation):
+
+    mode = 'tags'
+
+    def tag(self):
+        return self.backend.key_mangler(_tag_key_from_key(
+            DummyUser.cache.cache_query_key(self.pk, '')))
+
+    def test_tagged_on_creation(self):
+        key = self.cached()
+        self.assertEqual(set([key.encode('utf-8')]),
+                         self.backend.client.smembers(self.tag()))
+        self.change()
+        self.assertFalse(self.exists(self.tag()))
+
+    def test_untagged_entries(self):
+        self.backend.invalidation_mode = 'keys'
+        key = self.cached()
+        self.backend.invalidation_mode = self.mode
+        self.change()
+        # only migrate looks for keys cached before tagging
+        self.assertEqual(self.mode == 'tags', self.exists(key))
+
+
+class TestMigrateInvalidation(TestTagsInvalidation):
+
+    mode = 'migrate'
+
+    def test_scan_keys(self):
+        key = self.cached()
+        pattern = DummyUser.cache.cache_query_key(self.pk, '*')
+        self.assertEqual([key.encode('utf-8')],
+                         self.backend.scan_keys(pattern))
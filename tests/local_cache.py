@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+from dogpile.cache.api import NO_VALUE
+from flask import Flask
+
+from flask_sqlalchemy_redica.local import LocalCache
+from flask_sqlalchemy_redica.redis import make_redis_region
+
+
+class TestLocalCache(unittest.TestCase):
+
+    def test_lru_by_entries(self):
+        cache = LocalCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(1, cache.get('a'))
+        self.assertIs(NO_VALUE, cache.get('b'))
+        self.assertEqual(2, len(cache))
+
+    def test_bytes_limit(self):
+        cache = LocalCache(max_bytes=200)
+        cache.set('a', 'x' * 100)
+        cache.set('b', 'y' * 100)
+        self.assertIs(NO_VALUE, cache.get('a'))
+        self.assertTrue(cache.size <= 200)
+        cache.set('c', 'z' * 1000)
+        self.assertIs(NO_VALUE, cache.get('c'))
+
+    def test_ttl(self):
+        cache = LocalCache(ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+        self.assertIs(NO_VALUE, cache.get('a'))
+        self.assertEqual(0, cache.size)
+
+    def test_stats_across_threads(self):
+        cache = LocalCache()
+        cache.set('a', 1)
+
+        def lookups():
+            for _ in range(500):
+                cache.get('a')
+                cache.get('b')
+        threads = [threading.Thread(target=lookups) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(4000, cache.stats['l1_hits'])
+        self.assertEqual(4000, cache.stats['l1_misses'])
+
+    def test_size_of_serialized_value(self):
+        cache = LocalCache(max_bytes=100)
+        cache.set('a', 1, size=60)
+        self.assertEqual(60, cache.size)
+        cache.set('b', 2, size=60)
+        self.assertIs(NO_VALUE, cache.get('a'))
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestLocalCacheProxy(unittest.TestCase):
+    """Two regions on the same eviction channel stand for two processes."""
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.config['REDICA_CACHE_URL'] = 'redis://localhost:6379/2'
+        app.config['REDICA_L1_ENABLED'] = True
+        self.region = make_redis_region(app, 'l1_test')['default']
+        self.peer = make_redis_region(app, 'l1_test')['default']
+        self.proxy = self.region.backend
+        self.key = self.proxy.key_mangler('a')
+        self.proxy.client.flushdb()
+        self.region.set('a', [1])
+        # both processes hold the value in their local tier
+        self.assertEqual([1], self.region.get('a'))
+        self.assertEqual([1], self.peer.get('a'))
+
+    def tearDown(self):
+        self.proxy.client.flushdb()
+
+    def held_by_peer(self):
+        return self.peer.backend.local.get(self.key) is not NO_VALUE
+
+    def test_read_through(self):
+        self.assertEqual([1], self.region.get('a'))
+        self.assertEqual([[1], NO_VALUE], self.region.get_multi(['a', 'b']))
+        ratios = self.proxy.hit_ratios()
+        self.assertEqual(2, ratios['l1_hits'])
+        self.assertEqual(2, ratios['l1_misses'])
+        self.assertEqual(1, ratios['l2_hits'])
+        self.assertEqual(1, ratios['l2_misses'])
+        self.assertEqual(0.5, ratios['l1_hit_ratio'])
+        self.assertEqual(1, ratios['l1_entries'])
+        # sized by the bytes read from redis
+        self.assertEqual(len(self.proxy.client.get(self.key)),
+                         ratios['l1_bytes'])
+
+    def test_delete_evicts_peers(self):
+        self.region.delete('a')
+        self.assertTrue(wait_for(lambda: not self.held_by_peer()))
+        self.assertIs(NO_VALUE, self.peer.get('a'))
+
+    def test_delete_multi_evicts_peers(self):
+        self.proxy.delete_multi([self.key])
+        self.assertTrue(wait_for(lambda: not self.held_by_peer()))
+
+    def test_invalidate_evicts_peers(self):
+        deleted, _ = self.proxy.invalidate(keys=['a'])
+        self.assertEqual(1, len(deleted))
+        self.assertTrue(wait_for(lambda: not self.held_by_peer()))
+
+    def test_invalidate_evicts_keys_gone_from_redis(self):
+        # expired or evicted from redis, still in the peer's local tier
+        self.proxy.client.delete(self.key)
+        deleted, _ = self.proxy.invalidate(keys=['a'])
+        self.assertEqual([], deleted)
+        self.assertTrue(wait_for(lambda: not self.held_by_peer()))
+
+        self.peer.backend.local.set(self.key, [1], size=1)
+        self.assertTrue(self.held_by_peer())
+        self.proxy.invalidate_tags([], ['a'])
+        self.assertTrue(wait_for(lambda: not self.held_by_peer()))
+
+    def test_write_through_evicts_peers(self):
+        generations = self.proxy.reserve_writes(['a'])
+        self.proxy.write_through(
+            {'a': self.region.backend.get(self.key)}, generations)
+        self.assertTrue(wait_for(lambda: not self.held_by_peer()))
+        self.assertEqual([1], self.peer.get('a'))
+
+    def test_set_is_not_broadcast(self):
+        self.region.set('a', [2])
+        self.assertEqual([2], self.region.get('a'))
+        time.sleep(0.05)
+        self.assertTrue(self.held_by_peer())
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from .batch_loading import StatementCounter
+from .helloworld import db, DummyUser, create_app
+
+
+class TestNegativeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.backend = DummyUser.cache.regions['default'].backend
+        self.backend.client.flushdb()
+        self.backend.negative_expiration_time = 30
+        self.user = DummyUser(name='known')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        self.backend.negative_expiration_time = None
+        db.session.remove()
+        db.drop_all()
+        self.backend.client.flushdb()
+        self.ctx.pop()
+
+    def ttl(self, key):
+        return self.backend.client.ttl(self.backend.key_mangler(key))
+
+    def test_get(self):
+        self.assertIsNone(DummyUser.cache.get(404))
+        with StatementCounter(db.engine) as statements:
+            self.assertIsNone(DummyUser.cache.get(404))
+        self.assertEqual(0, statements.count)
+        self.assertTrue(0 < self.ttl(DummyUser.cache.cache_key(404)) <= 30)
+
+        # found objects keep the regular lifetime
+        pk = self.user.id
+        db.session.expunge_all()
+        DummyUser.cache.get(pk)
+        self.assertFalse(0 < self.ttl(DummyUser.cache.cache_key(pk)) <= 30)
+
+    def test_get_many(self):
+        self.assertEqual([self.user, None],
+                         DummyUser.get_many([self.user.id, 404]))
+        with StatementCounter(db.engine) as statements:
+            self.assertEqual([self.user, None],
+                             DummyUser.get_many([self.user.id, 404]))
+        self.assertEqual(0, statements.count)
+        self.assertTrue(0 < self.ttl(DummyUser.cache.cache_key(404)) <= 30)
+
+    def test_filter(self):
+        self.assertEqual([], list(DummyUser.cache.filter(name='new')))
+        with StatementCounter(db.engine) as statements:
+            self.assertEqual([], list(DummyUser.cache.filter(name='new')))
+        self.assertEqual(0, statements.count)
+        self.assertTrue(0 < self.ttl(
+            DummyUser.cache.cache_index_key(name='new')) <= 30)
+
+    def test_insert_clears_negative_entries(self):
+        DummyUser.get_many([self.user.id + 1])
+        list(DummyUser.cache.filter(name='new'))
+
+        user = DummyUser(name='new')
+        db.session.add(user)
+        db.session.commit()
+        self.assertEqual(self.user.id + 1, user.id)
+        self.assertEqual([user], DummyUser.get_many([user.id]))
+        self.assertEqual(user, DummyUser.cache.get(user.id))
+        self.assertEqual([user], list(DummyUser.cache.filter(name='new')))
+
+    def test_disabled(self):
+        self.backend.negative_expiration_time = None
+        DummyUser.get_many([404])
+        self.assertEqual(-2, self.ttl(DummyUser.cache.cache_key(404)))
+        with StatementCounter(db.engine) as statements:
+            DummyUser.get_many([404])
+        self.assertEqual(1, statements.count)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from flask_sqlalchemy_redica.cache import FromCache
+from flask_sqlalchemy_redica.utils import _key_from_query, _query_shapes, \
+    text_type
+
+from .helloworld import DummyUser, create_app
+
+
+def compiled_key(query):
+    """The key as it was built before query shapes, by compiling."""
+    compiled = query.with_labels().statement.compile()
+    params = compiled.params
+    return ' '.join([text_type(compiled)] +
+                    [text_type(params[k]) for k in sorted(params)])
+
+
+class TestQueryShape(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        _query_shapes.clear()
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    def by_name(self, name, *criteria):
+        return DummyUser.query.filter(
+            DummyUser.name == name, *criteria).limit(5)
+
+    def test_literals_share_a_shape(self):
+        keys = [_key_from_query(self.by_name(n), 'by_name')
+                for n in ('a', 'b', 'c')]
+        self.assertEqual(1, len(_query_shapes))
+        self.assertEqual(len(set(keys)), 3)
+        self.assertEqual([compiled_key(self.by_name(n))
+                          for n in ('a', 'b', 'c')], keys)
+
+    def test_shapes_do_not_collide(self):
+        by_name = _key_from_query(self.by_name('1'), 'by_name')
+        by_id = _key_from_query(
+            DummyUser.query.filter(DummyUser.id == '1').limit(5), 'by_id')
+        self.assertEqual(2, len(_query_shapes))
+        self.assertNotEqual(by_name, by_id)
+
+        # a shape key reused for a query with more binds gets its own sql
+        both = _key_from_query(
+            self.by_name('1', DummyUser.id == 1), 'by_name')
+        self.assertEqual(3, len(_query_shapes))
+        self.assertEqual(
+            compiled_key(self.by_name('1', DummyUser.id == 1)), both)
+
+    def test_unshaped_keys_are_unchanged(self):
+        query = self.by_name('a')
+        self.assertEqual(compiled_key(query), _key_from_query(query))
+
+        def cache_key(**kwargs):
+            return query.options(
+                FromCache(query_prefix='dummy_user:all:query:',
+                          **kwargs))._get_cache_plus_key()[1]
+
+        # entries cached before shapes existed are found under both
+        self.assertEqual(cache_key(), cache_key(shape_key='by_name'))
+        self.assertNotEqual(
+            cache_key(),
+            self.by_name('b').options(
+                FromCache(query_prefix='dummy_user:all:query:',
+                          shape_key='by_name'))._get_cache_plus_key()[1])
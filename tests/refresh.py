@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+from flask_sqlalchemy_redica.cache import FromCache
+from flask_sqlalchemy_redica.refresh import RefreshRunner
+
+from .helloworld import db, DummyUser, create_app
+
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        db.session.add(DummyUser(name='Brazil'))
+        db.session.commit()
+
+        self.region = DummyUser.cache.regions['default']
+        self.region.backend.client.flushdb()
+        self.runner = RefreshRunner(self.app, workers=1, max_queue=1)
+        self.region.async_creation_runner = self.runner
+
+    def tearDown(self):
+        self.region.async_creation_runner = None
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def query(self):
+        return DummyUser.query.options(
+            FromCache(expiration_time=0.2)).first()
+
+    def rename(self, name):
+        # bypasses the mapper events and so the invalidation
+        db.session.execute(
+            DummyUser.__table__.update().values(name=name))
+        db.session.commit()
+
+    def test_serves_stale_value(self):
+        self.assertEqual('Brazil', self.query().name)
+        self.rename('Germany')
+        time.sleep(0.3)
+
+        db.session.expunge_all()
+        self.assertEqual('Brazil', self.query().name)
+        self.runner.queue.join()
+        self.assertEqual(1, self.runner.stats['refreshed'])
+
+        db.session.expunge_all()
+        self.assertEqual('Germany', self.query().name)
+
+    def test_full_queue(self):
+        release = threading.Event()
+
+        def slow_creator():
+            release.wait(5)
+            return 'slow'
+
+        def refresh(key):
+            mutex = threading.Lock()
+            mutex.acquire()
+            self.runner(self.region, key, slow_creator, mutex)
+            return mutex
+
+        # occupy the single worker, then fill the queue
+        refresh('running')
+        while self.runner.depth:
+            time.sleep(0.01)
+        refresh('queued')
+
+        mutex = refresh('dropped')
+        self.assertEqual(1, self.runner.stats['dropped'])
+        # the mutex of a dropped refresh is released right away
+        self.assertTrue(mutex.acquire(False))
+
+        release.set()
+        self.runner.queue.join()
+        self.assertEqual(2, self.runner.stats['refreshed'])
+        self.assertEqual('slow', self.region.get('queued'))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from flask_sqlalchemy_redica import CachingMixin
+from flask_sqlalchemy_redica.cache import RelationshipBatchCache, \
+    load_relationships
+
+from .batch_loading import RoundTripCounter, StatementCounter
+from .helloworld import db, create_app
+
+order_tags = db.Table(
+    'dummy_order_tag',
+    db.Column('order_id', db.Integer, db.ForeignKey('dummy_order.id')),
+    db.Column('tag_id', db.Integer, db.ForeignKey('dummy_tag.id')))
+
+
+class DummyOrder(db.Model, CachingMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    items = db.relationship(
+        'DummyItem', backref='order', order_by='DummyItem.id')
+    tags = db.relationship('DummyTag', secondary=order_tags)
+
+
+class DummyItem(db.Model, CachingMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('dummy_order.id'))
+
+
+class DummyTag(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20))
+
+
+class TestRelationshipBatchCache(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.client = DummyOrder.cache.regions['default'].backend.client
+        self.client.flushdb()
+        tags = [DummyTag(name='t%d' % i) for i in range(3)]
+        for i in range(10):
+            order = DummyOrder(tags=tags[:i % 3])
+            order.items = [DummyItem() for _ in range(i % 4)]
+            db.session.add(order)
+        db.session.commit()
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.client.flushdb()
+        self.ctx.pop()
+
+    def orders(self):
+        db.session.expunge_all()
+        with StatementCounter(db.engine) as statements, \
+                RoundTripCounter(self.client) as round_trips:
+            orders = DummyOrder.query.options(
+                RelationshipBatchCache(DummyOrder.items)).all()
+            items = [[i.id for i in o.items] for o in orders]
+        return items, statements.count, round_trips.count
+
+    def test_cold_and_warm(self):
+        items, statements, round_trips = self.orders()
+        self.assertEqual([i % 4 for i in range(10)], [len(i) for i in items])
+        # orders plus one IN query for the items of all of them
+        self.assertEqual(2, statements)
+        # MGET and the set_multi pipeline
+        self.assertEqual(2, round_trips)
+
+        warm, statements, round_trips = self.orders()
+        self.assertEqual(items, warm)
+        self.assertEqual(1, statements)
+        self.assertEqual(1, round_trips)
+
+    def test_partially_warm(self):
+        items, _, _ = self.orders()
+        first = DummyOrder.query.order_by(DummyOrder.id).first()
+        DummyOrder.cache.regions['default'].delete(
+            DummyOrder.cache.cache_relationship_key(first.id, 'items'))
+
+        warm, statements, round_trips = self.orders()
+        self.assertEqual(items, warm)
+        self.assertEqual(2, statements)
+        self.assertEqual(2, round_trips)
+
+    def test_secondary(self):
+        orders = DummyOrder.query.order_by(DummyOrder.id).all()
+        with StatementCounter(db.engine) as statements:
+            load_relationships(orders, DummyOrder.tags)
+            names = [sorted(t.name for t in o.tags) for o in orders]
+        self.assertEqual(1, statements.count)
+
+        db.session.expunge_all()
+        orders = DummyOrder.query.order_by(DummyOrder.id).all()
+        with StatementCounter(db.engine) as statements:
+            load_relationships(orders, DummyOrder.tags)
+            self.assertEqual(names, [sorted(t.name for t in o.tags)
+                                     for o in orders])
+        self.assertEqual(0, statements.count)
+        self.assertEqual(['t0', 't1'], names[2])
+
+    def test_many_to_one(self):
+        items = DummyItem.query.all()
+        with StatementCounter(db.engine) as statements:
+            load_relationships(items, DummyItem.order)
+            self.assertTrue(all(i.order.id == i.order_id for i in items))
+        self.assertEqual(1, statements.count)
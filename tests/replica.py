@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+from flask import Flask
+
+from flask_sqlalchemy_redica.redis import make_redis_region
+from flask_sqlalchemy_redica.replica import ReplicaSet, pin_primary, \
+    primary_pinned, _pin_local
+
+
+class TestReplicaReads(unittest.TestCase):
+    """The "replica" is another database of the test server, so reads
+    can be told apart from primary reads."""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['REDICA_CACHE_URL'] = 'redis://localhost:6379/2'
+        self.app.config['REDICA_CACHE_READ_URLS'] = \
+            'redis://localhost:6379/3'
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.region = make_redis_region(self.app, 'replica_test')['default']
+        self.backend = self.region.backend
+        self.replica = self.backend.replicas.clients[0]
+        self.backend.client.flushdb()
+        self.replica.flushdb()
+
+    def tearDown(self):
+        self.ctx.pop()
+
+    def copy_to_replica(self, key):
+        key = self.backend.key_mangler(key)
+        self.replica.set(key, self.backend.client.get(key))
+
+    def test_reads_from_replica(self):
+        self.region.set('a', 1)
+        # not on the replica yet
+        self.assertFalse(self.region.get('a'))
+        self.copy_to_replica('a')
+        self.assertEqual(1, self.region.get('a'))
+        self.assertEqual([1], self.region.get_multi(['a']))
+
+    def test_pinned_after_invalidation(self):
+        self.region.set('a', 1)
+        self.copy_to_replica('a')
+        self.region.delete('a')
+        # the replica still has the deleted key
+        self.assertTrue(self.replica.keys('*'))
+        self.assertTrue(primary_pinned())
+        self.assertFalse(self.region.get('a'))
+
+        self.ctx.redica_primary_until = time.time()
+        self.assertEqual(1, self.region.get('a'))
+
+    def test_pin_outside_app_context(self):
+        self.ctx.pop()
+        try:
+            pin_primary(60)
+            self.assertTrue(primary_pinned())
+        finally:
+            _pin_local.until = 0
+            self.ctx.push()
+        self.assertFalse(primary_pinned())
+
+    def test_failed_replica(self):
+        replicas = ReplicaSet.from_urls(
+            'redis://localhost:1/0, redis://localhost:6379/3',
+            strategy='latency')
+        self.replica.set('b', 'replica')
+        self.backend.client.set('b', 'primary')
+        replicas.explore = 0
+        self.assertEqual(b'primary', replicas.read(
+            self.backend.client, 'get', 'b'))
+        self.assertEqual(float('inf'), replicas.latency[0])
+        self.assertEqual(b'replica', replicas.read(
+            self.backend.client, 'get', 'b'))
+
+    def test_strategy(self):
+        with self.assertRaises(ValueError):
+            ReplicaSet([], strategy='random')
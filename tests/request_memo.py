@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from flask_sqlalchemy_redica import stats, MemorySink
+
+from .batch_loading import RoundTripCounter
+from .helloworld import db, DummyUser, create_app
+
+
+class TestRequestMemo(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['REDICA_REQUEST_MEMO'] = True
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.backend = DummyUser.cache.regions['default'].backend
+        self.backend.client.flushdb()
+        db.session.add(DummyUser(name='memo'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.backend.client.flushdb()
+        self.ctx.pop()
+
+    def query(self):
+        return DummyUser.query.filter_by(name='memo').options(
+            DummyUser.cache.from_cache()).all()
+
+    def test_repeated_query(self):
+        users = self.query()
+        sink = MemorySink()
+        stats.add_sink(sink)
+        try:
+            with RoundTripCounter(self.backend.client) as round_trips:
+                self.assertEqual(users, self.query())
+                self.assertEqual(users, self.query())
+        finally:
+            stats.remove_sink(sink)
+        self.assertEqual(0, round_trips.count)
+        self.assertEqual(2, sink.value(
+            'memo_hits', region='default', model='DummyUser'))
+
+    def test_invalidation(self):
+        user = self.query()[0]
+        by_pk = DummyUser.query.filter_by(id=user.id).options(
+            DummyUser.cache.from_cache(pk=user.id))
+        by_pk.all()
+        user.name = 'changed'
+        db.session.commit()
+
+        # the object key was deleted on commit, the query's key was not
+        with RoundTripCounter(self.backend.client) as round_trips:
+            self.assertEqual(['changed'], [u.name for u in by_pk.all()])
+        self.assertTrue(round_trips.count)
+        with RoundTripCounter(self.backend.client) as round_trips:
+            self.query()
+        self.assertEqual(0, round_trips.count)
+
+        DummyUser.query.filter_by(name='memo').options(
+            DummyUser.cache.from_cache()).invalidated()
+        with RoundTripCounter(self.backend.client) as round_trips:
+            self.assertEqual([], self.query())
+        self.assertTrue(round_trips.count)
+
+    def test_other_session(self):
+        self.query()
+        db.session.remove()
+        with RoundTripCounter(self.backend.client) as round_trips:
+            user = self.query()[0]
+        self.assertEqual(1, round_trips.count)
+        self.assertIs(db.session(), db.session.object_session(user))
+
+    def test_teardown(self):
+        self.query()
+        self.assertEqual(1, len(self.ctx.redica_memo))
+        self.ctx.pop()
+        self.ctx.push()
+        self.assertFalse(hasattr(self.ctx, 'redica_memo'))
+
+    def test_disabled(self):
+        self.app.config['REDICA_REQUEST_MEMO'] = False
+        self.query()
+        with RoundTripCounter(self.backend.client) as round_trips:
+            self.query()
+        self.assertEqual(1, round_trips.count)
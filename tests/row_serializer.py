@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+from dogpile.cache.api import CachedValue
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import instance_state
+
+from flask_sqlalchemy_redica.serializer import PickleSerializer, \
+    RowSerializer, msgpack
+
+from .helloworld import db, DummyUser, create_app
+
+
+class TestRowSerializer(unittest.TestCase):
+
+    use_msgpack = True
+
+    def setUp(self):
+        if self.use_msgpack and msgpack is None:
+            self.skipTest('msgpack is not installed')
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        db.session.add_all([DummyUser(name='a'), DummyUser(name='b')])
+        db.session.commit()
+        self.users = DummyUser.query.order_by(DummyUser.id).all()
+        self.serializer = RowSerializer(use_msgpack=self.use_msgpack)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def round_trip(self, value):
+        return self.serializer.loads(self.serializer.dumps(value))
+
+    def test_entities(self):
+        metadata = dict(ct=time.time(), v=1)
+        value = self.round_trip(CachedValue(self.users, metadata))
+        self.assertEqual(metadata, value.metadata)
+        users = value.payload
+        self.assertEqual([(u.id, u.name) for u in self.users],
+                         [(u.id, u.name) for u in users])
+        self.assertIsNone(object_session(users[0]))
+        self.assertEqual(instance_state(self.users[0]).key,
+                         instance_state(users[0]).key)
+
+        merged = DummyUser.query.merge_result(users, load=False)
+        self.assertEqual(self.users, list(merged))
+
+    def test_mixed_rows(self):
+        rows = db.session.query(DummyUser, DummyUser.name).order_by(
+            DummyUser.id).all()
+        restored = self.round_trip(rows)
+        self.assertEqual(['a', 'b'], [r.name for r in restored])
+        self.assertEqual(['a', 'b'], [r[1] for r in restored])
+        self.assertEqual([u.id for u in self.users],
+                         [r.DummyUser.id for r in restored])
+
+    def test_plain_values(self):
+        self.assertIsNone(self.round_trip(None))
+        self.assertEqual([], self.round_trip([]))
+        self.assertEqual([1, None, u'x'], self.round_trip([1, None, u'x']))
+
+    def test_entity_without_relationships(self):
+        user = self.users[0]
+        db.session.expire(user, ['name'])
+        restored, missing = self.round_trip([user, None])
+        self.assertIsNone(missing)
+        self.assertEqual(user.id, restored.id)
+        # the unloaded attribute stays unloaded
+        self.assertNotIn('name', instance_state(restored).dict)
+
+    def test_pickled_values(self):
+        metadata = dict(ct=time.time(), v=1)
+        data = PickleSerializer().dumps(CachedValue(self.users, metadata))
+        value = self.serializer.loads(data)
+        self.assertEqual(metadata, value.metadata)
+        self.assertEqual(['a', 'b'], [u.name for u in value.payload])
+
+
+class TestPickledRowSerializer(TestRowSerializer):
+
+    use_msgpack = False
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from flask import Flask
+from sqlalchemy import event
+
+from flask_sqlalchemy_redica import cache as cache_module
+from flask_sqlalchemy_redica.cache import FromCache, _xfetch_expiration
+
+from .batch_loading import StatementCounter
+from .helloworld import db, DummyUser
+
+PROCESSES = 6
+
+try:
+    mp = multiprocessing.get_context('fork')
+except AttributeError:
+    mp = multiprocessing
+
+
+def cached_query(expiration_time=1, **kwargs):
+    return DummyUser.query.filter_by(name='Brazil').options(
+        FromCache(expiration_time=expiration_time, **kwargs))
+
+
+class TestDistributedLock(unittest.TestCase):
+    """Runs one expiring query in several processes at once and counts
+    how often the database executes it."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        self.app.config['REDICA_CACHE_URL'] = 'redis://localhost:6379/2'
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = \
+            'sqlite:///' + os.path.join(self.tmp, 'stampede.db')
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        db.session.add(DummyUser(name='Brazil'))
+        db.session.commit()
+
+        self.backend = DummyUser.cache.regions['default'].backend
+        self.backend.client.flushdb()
+
+        self.executions = mp.Value('i', 0)
+        self.engine = db.get_engine(self.app)
+        event.listen(self.engine, 'before_cursor_execute', self.slow_select)
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute', self.slow_select)
+        self.backend.distributed_lock = False
+        self.backend.thread_local_lock = True
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        shutil.rmtree(self.tmp)
+
+    def slow_select(self, conn, cursor, statement, *args):
+        if statement.startswith('SELECT') and 'dummy_user' in statement:
+            with self.executions.get_lock():
+                self.executions.value += 1
+            time.sleep(0.3)
+
+    def enable_lock(self):
+        self.backend.distributed_lock = True
+        self.backend.thread_local_lock = False
+        self.backend.lock_timeout = 5
+        self.backend.lock_sleep = 0.02
+
+    def run_processes(self):
+        start = mp.Event()
+
+        def child():
+            self.engine.dispose()
+            with self.app.app_context():
+                start.wait(5)
+                assert cached_query().all()[0].name == 'Brazil'
+
+        processes = [mp.Process(target=child) for _ in range(PROCESSES)]
+        for p in processes:
+            p.start()
+        start.set()
+        for p in processes:
+            p.join(30)
+            self.assertEqual(0, p.exitcode)
+
+    def test_cold_key(self):
+        self.enable_lock()
+        self.run_processes()
+        self.assertEqual(1, self.executions.value)
+
+    def test_expired_key(self):
+        self.enable_lock()
+        cached_query().all()
+        time.sleep(1.1)
+
+        self.run_processes()
+        self.assertEqual(2, self.executions.value)
+
+    def test_without_lock(self):
+        cached_query().all()
+        time.sleep(1.1)
+
+        self.run_processes()
+        self.assertTrue(self.executions.value > 2)
+
+
+class TestEarlyRecompute(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['REDICA_CACHE_URL'] = 'redis://localhost:6379/2'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        db.session.add(DummyUser(name='Brazil'))
+        db.session.commit()
+        DummyUser.cache.regions['default'].backend.client.flushdb()
+        self.random = cache_module.random.random
+        cache_module.random.random = lambda: 0.5
+
+    def tearDown(self):
+        cache_module.random.random = self.random
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_xfetch_expiration(self):
+        self.assertEqual(60, _xfetch_expiration(60, 0, 1))
+        self.assertAlmostEqual(
+            60 - 2 * 0.6931, _xfetch_expiration(60, 2, 1, lambda: 0.5), 3)
+        self.assertTrue(
+            _xfetch_expiration(60, 2, 1, lambda: 0.999999) < 40)
+
+    def query_statements(self, **kwargs):
+        with StatementCounter(db.engine) as statements:
+            cached_query(expiration_time=3600, **kwargs).all()
+        return statements.count
+
+    def test_recomputes_early(self):
+        self.assertEqual(1, self.query_statements(xfetch_beta=1e9))
+        self.assertEqual(1, self.query_statements(xfetch_beta=1e9))
+
+    def test_disabled(self):
+        self.assertEqual(1, self.query_statements())
+        self.assertEqual(0, self.query_statements())
+        self.assertEqual(0, self.query_statements(xfetch_beta=1))
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import threading
+import unittest
+
+from flask_sqlalchemy_redica.worker import InvalidationWorker, \
+    ThreadedCachingInvalidator, invalidation_worker
+
+from .helloworld import db, DummyUser, create_app
+
+
+def item(pk, event='update'):
+    return dict(module=DummyUser.__module__, model='DummyUser',
+                target_id=pk, event=event, source='notify')
+
+
+class TestInvalidationWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def callback(self, items):
+        self.release.wait(5)
+        self.batches.append(items)
+
+    def test_coalesces_within_window(self):
+        worker = InvalidationWorker(self.app, self.callback, window=0.2)
+        worker.put([item(1), item(2), item(1), item(1, 'delete')])
+        worker.put([item(2)])
+        self.assertTrue(worker.drain(5))
+        self.assertEqual(1, len(self.batches))
+        self.assertEqual([(1, 'update'), (2, 'update'), (1, 'delete')],
+                         [(i['target_id'], i['event'])
+                          for i in self.batches[0]])
+        self.assertEqual(2, worker.stats['coalesced'])
+        self.assertEqual(3, worker.stats['flushed'])
+        worker.stop()
+
+    def test_batch_size(self):
+        worker = InvalidationWorker(
+            self.app, self.callback, window=0.2, batch_size=2)
+        worker.put([item(pk) for pk in range(5)])
+        self.assertTrue(worker.drain(5))
+        self.assertEqual([2, 2, 1], [len(b) for b in self.batches])
+        worker.stop()
+
+    def test_backpressure_and_drops(self):
+        self.release.clear()
+        worker = InvalidationWorker(
+            self.app, self.callback, max_size=2, block_timeout=0.01,
+            window=0)
+        worker.put([item(1)])
+        # wait for the worker to block in the callback
+        while worker.queue.qsize():
+            pass
+        worker.put([item(pk) for pk in range(2, 6)])
+        self.assertEqual(2, worker.stats['blocked'])
+        self.assertEqual(2, worker.stats['dropped'])
+        self.assertEqual(3, worker.stats['queued'])
+
+        self.release.set()
+        self.assertTrue(worker.drain(5))
+        self.assertEqual(3, worker.stats['flushed'])
+        worker.stop()
+
+    def test_concurrent_puts(self):
+        worker = InvalidationWorker(self.app, self.callback, window=0)
+        threads = [threading.Thread(
+            target=lambda: [worker.put([item(pk)]) for pk in range(200)])
+            for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(worker.drain(5))
+        stats = worker.stats
+        self.assertEqual(1600, stats['queued'])
+        self.assertEqual(1600, stats['coalesced'] + stats['flushed'])
+        worker.stop()
+
+    def test_stop_drains(self):
+        worker = InvalidationWorker(self.app, self.callback, window=1)
+        worker.put([item(1)])
+        worker.stop()
+        self.assertEqual(1, len(self.batches))
+        self.assertFalse(worker._thread.is_alive())
+
+    def test_failures_are_counted(self):
+        def callback(items):
+            raise RuntimeError('redis is down')
+
+        worker = InvalidationWorker(self.app, callback, window=0)
+        worker.put([item(1)])
+        self.assertTrue(worker.drain(5))
+        self.assertEqual(1, worker.stats['failed'])
+        worker.stop()
+
+
+class TestThreadedCachingInvalidator(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        db.session.add(DummyUser(name='Brazil'))
+        db.session.commit()
+
+    def tearDown(self):
+        invalidation_worker(self.app).stop()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_flush_in_worker(self):
+        user = DummyUser.cache.get(1)
+        region = DummyUser.cache.regions['default']
+        key = DummyUser.cache.cache_key(1)
+        self.assertTrue(region.get(key))
+
+        invalidator = ThreadedCachingInvalidator()
+        invalidator.invalidate(target=user, **item(1))
+        invalidator.invalidate(**item(1))
+        invalidator.flush()
+        self.assertEqual([], invalidator.items)
+
+        worker = invalidation_worker(self.app)
+        self.assertTrue(worker.drain(5))
+        self.assertEqual(1, worker.stats['coalesced'])
+        self.assertFalse(region.get(key))
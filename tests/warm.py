@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from flask_sqlalchemy_redica.cache import FromCache
+from flask_sqlalchemy_redica.cli import CacheWarmer
+
+from .batch_loading import StatementCounter
+from .compound_index import DummyTicket
+from .helloworld import db, DummyUser, create_app
+
+
+class TestWarmCommand(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.region = DummyUser.cache.regions['default']
+        self.region.backend.client.flushdb()
+        for i in range(25):
+            db.session.add(DummyUser(name='user%d' % (i % 5)))
+            db.session.add(DummyTicket(tenant_id=i % 2, status='open'))
+        db.session.commit()
+        self.pks = [u.id for u in DummyUser.query.order_by(DummyUser.id)]
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.region.backend.client.flushdb()
+        self.ctx.pop()
+
+    def warm(self, *args):
+        result = self.app.test_cli_runner().invoke(
+            args=['redica', 'warm'] + list(args))
+        self.assertEqual(0, result.exit_code, result.output)
+        return result.output
+
+    def cached(self, pks):
+        return [self.region.get(DummyUser.cache.cache_key(pk))
+                for pk in pks]
+
+    def test_objects_and_indices(self):
+        output = self.warm('DummyUser', '--filter', 'name',
+                           '--batch-size', '10')
+        self.assertIn('DummyUser: 20 rows', output)
+        self.assertIn('warmed 50 rows', output)
+        self.assertTrue(all(self.cached(self.pks)))
+
+        with StatementCounter(db.engine) as statements:
+            self.assertEqual(self.pks[1::5], [
+                u.id for u in DummyUser.cache.filter(name='user1')])
+            self.assertEqual(self.pks, [
+                u.id for u in DummyUser.cache.filter()])
+        self.assertEqual(0, statements.count)
+
+    def test_pk_range(self):
+        self.warm('DummyUser', '--pks', '%d:%d' % (
+            self.pks[5], self.pks[9]))
+        cached = self.cached(self.pks)
+        self.assertEqual(5, len([v for v in cached if v]))
+        self.assertTrue(all(cached[5:10]))
+
+    def test_compound_index(self):
+        self.warm('DummyTicket', '--pks', '0:0',
+                  '--filter', 'tenant_id,status')
+        with StatementCounter(db.engine) as statements:
+            self.assertEqual(12, DummyTicket.cache.count(
+                tenant_id=1, status='open'))
+        self.assertEqual(0, statements.count)
+
+    def test_named_query(self):
+        @db.warm_query()
+        def first_users():
+            return DummyUser.query.options(
+                FromCache(cache_key='first_users')).limit(3)
+
+        self.warm('--query', 'first_users')
+        self.assertEqual(3, len(self.region.get('first_users')))
+        del db.warm_queries['first_users']
+
+    def test_unknown_model(self):
+        result = self.app.test_cli_runner().invoke(
+            args=['redica', 'warm', 'Nope'])
+        self.assertNotEqual(0, result.exit_code)
+
+    def test_rate_limit(self):
+        warmer = CacheWarmer(db, batch_size=5, rate=100)
+        warmer.warm_objects(DummyUser)
+        # 25 rows at 100 rows/s
+        self.assertTrue(warmer.throughput <= 110)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import unittest
+import warnings
+
+from flask_sqlalchemy_redica import CachingMixin
+from flask_sqlalchemy_redica.model import InvalidationBatch
+
+from .batch_loading import RoundTripCounter, StatementCounter
+from .helloworld import db, create_app
+
+
+class DummyCounter(db.Model, CachingMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+
+    cache_write_through = True
+
+
+class TestWriteThrough(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.region = DummyCounter.cache.regions['default']
+        self.backend = self.region.backend
+        self.backend.client.flushdb()
+        self.counter = DummyCounter(hits=1)
+        db.session.add(self.counter)
+        db.session.commit()
+        self.pk = self.counter.id
+        self.key = DummyCounter.cache.cache_key(self.pk)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.backend.client.flushdb()
+        self.ctx.pop()
+
+    def cached_hits(self):
+        value = self.region.get(self.key)
+        if value:
+            return value[0].hits
+
+    def test_insert(self):
+        self.assertEqual(1, self.cached_hits())
+
+    def test_update(self):
+        query_key = DummyCounter.cache.cache_query_key(self.pk, 'recent')
+        self.region.set(query_key, [])
+        self.counter.hits += 1
+        db.session.commit()
+        self.assertEqual(2, self.cached_hits())
+        # other keys of the object are still invalidated
+        self.assertFalse(self.region.get(query_key))
+
+        db.session.expunge_all()
+        with StatementCounter(db.engine) as statements:
+            self.assertEqual(2, DummyCounter.cache.get(self.pk).hits)
+        self.assertEqual(0, statements.count)
+
+    def test_rollback(self):
+        self.counter.hits += 1
+        db.session.flush()
+        db.session.rollback()
+        self.assertIsNone(self.cached_hits())
+
+    def test_delete(self):
+        self.counter.hits += 1
+        db.session.flush()
+        db.session.delete(self.counter)
+        db.session.commit()
+        self.assertIsNone(self.cached_hits())
+
+    def test_round_trips(self):
+        writes = {self.key: (DummyCounter.cache, self.pk)}
+        with RoundTripCounter(self.backend.client) as round_trips:
+            reported = InvalidationBatch._write_through(self.backend, writes)
+        self.assertEqual(round_trips.count, reported)
+        self.assertEqual(1, self.cached_hits())
+
+    def test_concurrent_writers(self):
+        first = self.backend.reserve_writes([self.key])
+        second = self.backend.reserve_writes([self.key])
+        # the writer that reserved the key first lost the race
+        self.assertEqual(([], 1), self.backend.write_through(
+            {self.key: 'first'}, first))
+        self.assertIsNone(self.cached_hits())
+        written, calls = self.backend.write_through(
+            {self.key: 'second'}, second)
+        self.assertEqual((1, 1), (len(written), calls))
+        self.assertEqual('second', self.backend.get(
+            self.backend.key_mangler(self.key)))
+
+    def test_needs_batch_invalidation(self):
+        app = create_app()
+        app.config['REDICA_BATCH_INVALIDATION'] = False
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            db.init_app(app)
+        self.assertEqual(
+            ['DummyCounter.cache_write_through needs '
+             'REDICA_BATCH_INVALIDATION, its cached objects are deleted '
+             'instead'],
+            [str(w.message) for w in caught
+             if 'cache_write_through' in str(w.message)])